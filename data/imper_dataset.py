@@ -4,6 +4,7 @@ from data.dataset import DatasetBase
 import numpy as np
 from utils import cv_utils
 from utils.util import load_pickle_file, ToTensor, ImageTransformer
+from utils.video import VIDEO_EXTENSIONS, probe_video, read_video_frame
 import glob
 
 
@@ -66,8 +67,14 @@ class ImPerBaseDataset(DatasetBase):
 
             total = len(lines)
             for i, line in enumerate(lines):
-                images_path = glob.glob(os.path.join(self._vids_dir, line, '*'))
-                images_path.sort()
+                video_path = self._find_video(line)
+                if video_path is None:
+                    images_path = glob.glob(os.path.join(self._vids_dir, line, '*'))
+                    images_path.sort()
+                else:
+                    # the frames are decoded on demand, without extracting them by tools/unzip_iPER.py
+                    images_path = [(video_path, t) for t in range(probe_video(video_path)[2])]
+
                 smpl_data = load_pickle_file(os.path.join(self._smpls_dir, line, 'pose_shape.pkl'))
                 cams = smpl_data['cams']
                 # kps_data = load_pickle_file(os.path.join(self._smpls_dir, line, 'kps.pkl'))
@@ -94,6 +101,30 @@ class ImPerBaseDataset(DatasetBase):
 
         return vids_info
 
+    def _find_video(self, line):
+        """
+        Returns the video of `line` if its frames are not extracted, e.g, `001/1/1` -> `001/1/1.mp4`,
+        or `001_1_1.mp4` as in iPER_256_video_release, otherwise, None.
+        """
+        if os.path.isdir(os.path.join(self._vids_dir, line)):
+            return None
+
+        for name in [line, line.replace('/', '_')]:
+            for ext in VIDEO_EXTENSIONS:
+                video_path = os.path.join(self._vids_dir, name + ext)
+                if os.path.isfile(video_path):
+                    return video_path
+
+        return None
+
+    @staticmethod
+    def _read_image(image_path):
+        if isinstance(image_path, tuple):
+            video_path, t = image_path
+            return read_video_frame(video_path, t)
+        else:
+            return cv_utils.read_cv2_img(image_path)
+
     @property
     def video_info(self):
         return self._vids_info
@@ -110,7 +141,7 @@ class ImPerBaseDataset(DatasetBase):
         images_paths = vid_info['images']
         for t in pair_ids:
             image_path = images_paths[t]
-            image = cv_utils.read_cv2_img(image_path)
+            image = self._read_image(image_path)
 
             images.append(image)
 
@@ -144,7 +175,7 @@ class ImPerDataset(ImPerBaseDataset):
         images_paths = vid_info['images']
         for t in pair_ids:
             image_path = images_paths[t]
-            image = cv_utils.read_cv2_img(image_path)
+            image = self._read_image(image_path)
 
             images.append(image)
 
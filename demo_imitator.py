@@ -1,13 +1,12 @@
 import numpy as np
 from tqdm import tqdm
 import os
-import glob
 
 from models.imitator import Imitator
 from options.test_options import TestOptions
 from utils.util import mkdir
 import pickle
-from utils.video import make_video
+from utils.video import VideoWriter
 
 
 from run_imitator import adaptive_personalize
@@ -56,25 +55,17 @@ def generate_actor_result(test_opt, src_img_path):
 
     for action_type in ['dance', 'base', 'acrobat']:
         for i in action_list_dict[action_type]:
-            if test_opt.output_dir:
-                pred_output_dir = os.path.join(test_opt.output_dir, 'mixamo_preds')
-                if os.path.exists(pred_output_dir):
-                    os.system("rm -r %s" % pred_output_dir)
-                mkdir(pred_output_dir)
-            else:
-                pred_output_dir = None
-
-            print(pred_output_dir)
             tgt_smpls = load_mixamo_smpl(i)
 
-            imitator.inference_by_smpls(tgt_smpls, cam_strategy='smooth', output_dir=pred_output_dir, visualizer=None)
-
             save_dir = os.path.join(test_opt.output_dir, src_img_name, action_type)
             mkdir(save_dir)
 
+            # the predictions are piped to the encoder, no intermediate frames are saved.
             output_mp4_path = os.path.join(save_dir, 'mixamo_%.4d_%s.mp4' % (i, src_img_name))
-            img_path_list = sorted(glob.glob('%s/*.jpg' % pred_output_dir))
-            make_video(output_mp4_path, img_path_list, save_frames_dir=None, fps=30)
+            print(output_mp4_path)
+            with VideoWriter(output_mp4_path, fps=30) as video_writer:
+                imitator.inference_by_smpls(tgt_smpls, cam_strategy='smooth', output_dir='', visualizer=None,
+                                            batch_size=test_opt.batch_size, video_writer=video_writer)
 
 
 def clean(output_dir):
@@ -1,15 +1,13 @@
 import numpy as np
 from tqdm import tqdm
-import cv2
 import os
-import glob
 
 from models.imitator import Imitator
 from models.viewer import Viewer
 from options.test_options import TestOptions
 
 from utils.visdom_visualizer import VisdomVisualizer
-from utils.video import make_video
+from utils.video import VideoWriter
 from utils.util import mkdir
 
 from run_imitator import adaptive_personalize
@@ -77,25 +75,17 @@ def generate_T_pose_novel_view_result(test_opt, src_img_path):
     else:
         imitator.personalize(test_opt.src_path, visualizer=None)
 
-    if test_opt.output_dir:
-        pred_output_dir = os.path.join(test_opt.output_dir, 'T_novel_view_preds')
-        if os.path.exists(pred_output_dir):
-            os.system("rm -r %s" % pred_output_dir)
-        mkdir(pred_output_dir)
-    else:
-        pred_output_dir = None
-
-    print(pred_output_dir)
     tgt_smpls = create_T_pose_novel_view_smpl()
 
-    imitator.inference_by_smpls(tgt_smpls, cam_strategy='smooth', output_dir=pred_output_dir, visualizer=None)
-
     save_dir = os.path.join(test_opt.output_dir, src_img_name)
     mkdir(save_dir)
 
+    # the predictions are piped to the encoder, no intermediate frames are saved.
     output_mp4_path = os.path.join(save_dir, 'T_novel_view_%s.mp4' % src_img_name)
-    img_path_list = sorted(glob.glob('%s/*.jpg' % pred_output_dir))
-    make_video(output_mp4_path, img_path_list, save_frames_dir=None, fps=30)
+    print(output_mp4_path)
+    with VideoWriter(output_mp4_path, fps=30) as video_writer:
+        imitator.inference_by_smpls(tgt_smpls, cam_strategy='smooth', output_dir='', visualizer=None,
+                                    batch_size=test_opt.batch_size, video_writer=video_writer)
 
     # clean other left
     clean(test_opt.output_dir)
@@ -126,27 +116,20 @@ def generate_orig_pose_novel_view_result(opt, src_path):
 
     src_img_true_name = os.path.split(opt.src_path)[-1][:-4]
     save_dir = os.path.join(opt.output_dir, src_img_true_name)
-    mkdir(os.path.join(save_dir, 'imgs'))
+    mkdir(save_dir)
+    output_mp4_path = '%s/%s.mp4' % (save_dir, src_img_true_name)
 
     print('\n\t\t\tSynthesizing {} novel views'.format(length))
-    for i in logger:
-        params['R'][0] = 0
-        params['R'][1] = delta * i / 180.0 * np.pi
-        params['R'][2] = 0
+    with VideoWriter(output_mp4_path, fps=30, rgb=False) as video_writer:
+        for i in logger:
+            params['R'][0] = 0
+            params['R'][1] = delta * i / 180.0 * np.pi
+            params['R'][2] = 0
 
-        preds = viewer.view(params['R'], params['t'], visualizer=None, name=str(i))
-        # pred_outs.append(preds)
+            preds = viewer.view(params['R'], params['t'], visualizer=None, name=str(i))
 
-        save_img_name = '%s.%d.jpg' % (os.path.split(opt.src_path)[-1], delta * i)
-
-        cv2.imwrite('%s/imgs/%s' % (save_dir, save_img_name), tensor2cv2(preds))
-
-    """
-    make video
-    """
-    img_path_list = glob.glob("%s/imgs/*.jpg" % save_dir)
-    output_mp4_path = '%s/%s.mp4' % (save_dir, src_img_true_name)
-    make_video(output_mp4_path, img_path_list, save_frames_dir=None, fps=30)
+            # the views are piped to the encoder in order, no intermediate frames are saved.
+            video_writer.write(tensor2cv2(preds))
 
     clean(opt.output_dir)
     clean(save_dir)
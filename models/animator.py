@@ -4,6 +4,7 @@ import torch.nn.functional as F
 from .models import BaseModel
 from networks.networks import NetworksFactory, HumanModelRecovery
 from utils.nmr import SMPLRenderer
+from utils.fold_bn import fold_batch_norms
 from utils.util import to_tensor
 import utils.cv_utils as cv_utils
 
@@ -32,7 +33,7 @@ class Animator(BaseModel):
         self.first_cam = None
 
         # initialize T
-        self.initial_T = torch.zeros(opt.image_size, opt.image_size, 2, dtype=torch.float32).cuda() - 1.0
+        self.initial_T = torch.zeros(opt.image_size, opt.image_size, 2, dtype=torch.float32).to(self._device) - 1.0
         self.initial_T_grid = self._make_grid()
 
     def _make_grid(self):
@@ -42,13 +43,13 @@ class Animator(BaseModel):
         grid_y, grid_x = torch.meshgrid(xy, xy)
 
         # 1. make mesh grid
-        T = torch.stack([grid_x, grid_y], dim=-1).cuda()  # (image_size, image_size, 2)
+        T = torch.stack([grid_x, grid_y], dim=-1).to(self._device)  # (image_size, image_size, 2)
 
         return T
 
     def _create_generator(self):
         net = NetworksFactory.get_by_name(self._opt.gen_name, bg_dim=4, src_dim=3+self._G_cond_nc,
-                                          tsf_dim=3+self._G_cond_nc, repeat_num=6).cuda()
+                                          tsf_dim=3+self._G_cond_nc, repeat_num=6).to(self._device)
 
         if self._opt.load_path:
             self._load_params(net, self._opt.load_path)
@@ -62,18 +63,19 @@ class Animator(BaseModel):
         return net
 
     def _create_mesh_model(self):
-        hmr = HumanModelRecovery(smpl_pkl_path=self._opt.smpl_model).cuda()
-        saved_data = torch.load(self._opt.hmr_model)
+        hmr = HumanModelRecovery(smpl_pkl_path=self._opt.smpl_model).to(self._device)
+        saved_data = torch.load(self._opt.hmr_model, map_location='cpu')
         hmr.load_state_dict(saved_data)
 
         hmr.eval()
+        fold_batch_norms(hmr)
         print('load hmr model from {}'.format(self._opt.hmr_model))
         return hmr
 
     def _create_render(self, faces):
         render = SMPLRenderer(faces=faces, map_name=self._opt.map_name, uv_map_path=self._opt.uv_mapping,
                               tex_size=self._opt.tex_size, image_size=self._opt.image_size, fill_back=True,
-                              anti_aliasing=True, background_color=(0, 0, 0), has_front_map=True).cuda()
+                              anti_aliasing=True, background_color=(0, 0, 0), has_front_map=True).to(self._device)
         return render
 
     def _init_create_networks(self):
@@ -86,7 +88,7 @@ class Animator(BaseModel):
         img = cv_utils.read_cv2_img(input_file)
         img = cv_utils.transform_img(img, image_size=224) * 2 - 1.0  # hmr receive [-1, 1]
         img = img.transpose((2, 0, 1))
-        img = torch.FloatTensor(img).cuda()[None, ...]
+        img = torch.FloatTensor(img).to(self._device)[None, ...]
         theta = self.hmr(img)[-1]
 
         return theta
@@ -135,10 +137,10 @@ class Animator(BaseModel):
             ori_img = cv_utils.read_cv2_img(tgt_path)
             if tgt_smpl is None:
                 img_hmr = cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
-                img_hmr = torch.FloatTensor(img_hmr).cuda()[None, ...]
+                img_hmr = torch.FloatTensor(img_hmr).to(self._device)[None, ...]
                 tgt_smpl = self.hmr(img_hmr)[-1]
             else:
-                tgt_smpl = to_tensor(tgt_smpl).cuda()[None, ...]
+                tgt_smpl = to_tensor(tgt_smpl).to(self._device)[None, ...]
 
             if t == 0 and cam_strategy == 'smooth':
                 self.first_cam = tgt_smpl[:, 0:3].clone()
@@ -216,14 +218,14 @@ class Animator(BaseModel):
 
             # resize image and convert the color space from [0, 255] to [-1, 1]
             img = cv_utils.transform_img(ori_img, self._opt.image_size, transpose=True) * 2 - 1.0
-            img = torch.FloatTensor(img).cuda()[None, ...]
+            img = torch.FloatTensor(img).to(self._device)[None, ...]
 
             if src_smpl is None:
                 img_hmr = cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
-                img_hmr = torch.FloatTensor(img_hmr).cuda()[None, ...]
+                img_hmr = torch.FloatTensor(img_hmr).to(self._device)[None, ...]
                 src_smpl = self.hmr(img_hmr)[-1]
             else:
-                src_smpl = to_tensor(src_smpl).cuda()[None, ...]
+                src_smpl = to_tensor(src_smpl).to(self._device)[None, ...]
 
             # source process, {'theta', 'cam', 'pose', 'shape', 'verts', 'j2d', 'j3d'}
             src_info = self.hmr.get_details(src_smpl)
@@ -261,7 +263,7 @@ class Animator(BaseModel):
 
     def morph(self, src_bg_mask, ks, mode='erode'):
         n_ks = ks ** 2
-        kernel = torch.ones(1, 1, ks, ks, dtype=torch.float32).cuda()
+        kernel = torch.ones(1, 1, ks, ks, dtype=torch.float32).to(self._device)
         out = F.conv2d(src_bg_mask, kernel, padding=ks // 2)
 
         if mode == 'erode':
@@ -6,9 +6,10 @@ from tqdm import tqdm
 from .models import BaseModel
 from networks.networks import NetworksFactory, HumanModelRecovery
 from utils.nmr import SMPLRenderer
+from utils.fold_bn import fold_batch_norms
 from utils.detectors import PersonMaskRCNNDetector
+from utils.video import read_frame_batches
 import utils.cv_utils as cv_utils
-import utils.util as util
 
 
 class Imitator(BaseModel):
@@ -23,25 +24,31 @@ class Imitator(BaseModel):
         self.tsf_info = None
         self.first_cam = None
 
+        # the last keyframe and the [# keyframes, # frames] counts of the keyframe mode.
+        self.keyframe = None
+        self.keyframe_counts = [0, 0]
+
     def _create_networks(self):
         # 0. create generator
-        self.generator = self._create_generator().cuda()
+        self.generator = self._create_generator().to(self._device)
 
         # 0. create bgnet
         if self._opt.bg_model != 'ORIGINAL':
-            self.bgnet = self._create_bgnet().cuda()
+            self.bgnet = self._create_bgnet().to(self._device)
         else:
             self.bgnet = self.generator.bg_model
 
         # 2. create hmr
-        self.hmr = self._create_hmr().cuda()
+        self.hmr = self._create_hmr().to(self._device)
 
         # 3. create render
         self.render = SMPLRenderer(image_size=self._opt.image_size, tex_size=self._opt.tex_size,
-                                   has_front=self._opt.front_warp, fill_back=False).cuda()
+                                   has_front=self._opt.front_warp, fill_back=False,
+                                   backend=self._opt.rasterizer).to(self._device)
+        self.render.set_incremental(self._opt.incremental_raster)
         # 4. pre-processor
         if self._opt.has_detector:
-            self.detector = PersonMaskRCNNDetector(ks=self._opt.bg_ks, threshold=0.5, to_gpu=True)
+            self.detector = PersonMaskRCNNDetector(ks=self._opt.bg_ks, threshold=0.5, device=self._device)
         else:
             self.detector = None
 
@@ -68,9 +75,12 @@ class Imitator(BaseModel):
 
     def _create_hmr(self):
         hmr = HumanModelRecovery(self._opt.smpl_model)
-        saved_data = torch.load(self._opt.hmr_model)
+        saved_data = torch.load(self._opt.hmr_model, map_location='cpu')
         hmr.load_state_dict(saved_data)
         hmr.eval()
+        fold_batch_norms(hmr)
+        # the transferred smpls always use the source shape, cache its shape blend shapes and joints.
+        hmr.smpl.set_shape_cache(True)
         return hmr
 
     def visualize(self, *args, **kwargs):
@@ -81,44 +91,78 @@ class Imitator(BaseModel):
 
     @torch.no_grad()
     def personalize(self, src_path, src_smpl=None, output_path='', visualizer=None):
+        src_info = self._cached_personalize(src_path, src_smpl)
+        self.src_info = src_info
 
-        ori_img = cv_utils.read_cv2_img(src_path)
+        if visualizer is not None:
+            visualizer.vis_named_img('src', src_info['img'])
+            visualizer.vis_named_img('bg', src_info['bg'])
 
-        # resize image and convert the color space from [0, 255] to [-1, 1]
-        img = cv_utils.transform_img(ori_img, self._opt.image_size, transpose=True) * 2 - 1.0
-        img = torch.tensor(img, dtype=torch.float32).cuda()[None, ...]
+        if output_path:
+            cv_utils.save_cv2_img(src_info['image'], output_path, image_size=self._opt.image_size)
 
-        if src_smpl is None:
-            img_hmr = cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
-            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).cuda()[None, ...]
-            src_smpl = self.hmr(img_hmr)
-        else:
-            src_smpl = torch.tensor(src_smpl, dtype=torch.float32).cuda()[None, ...]
+    @torch.no_grad()
+    def personalize_batch(self, src_paths, src_smpls=None, batch_size=8):
+        """
+        Personalizes many sources, hmr, render, the detector, bgnet and the source encoder run on batches of
+        batch_size sources. The current source (self.src_info) is not changed.
+
+        Args:
+            src_paths (list of str or list of frames): the paths of the source images, or the in-memory frames,
+                see `cv_utils.read_img`.
+            src_smpls (list or None): the (85,) smpl of every source, or None to estimate it by hmr.
+            batch_size (int):
+
+        Returns:
+            src_infos (list of dict): the src_info of every source, the same as the one of `personalize`.
+        """
+        return self._cached_personalize_batch(src_paths, src_smpls, batch_size=batch_size)
+
+    def _personalize(self, src_path, src_smpl=None):
+        return self._personalize_batch([src_path], [src_smpl])[0]
+
+    def _personalize_batch(self, src_paths, src_smpls=None):
+        bs = len(src_paths)
+        if src_smpls is None:
+            src_smpls = [None] * bs
+
+        ori_imgs = [cv_utils.read_img(src_path) for src_path in src_paths]
+
+        # resize image and convert the color space from [0, 255] to [-1, 1]
+        img = np.stack([cv_utils.transform_img(ori_img, self._opt.image_size, transpose=True) * 2 - 1.0
+                        for ori_img in ori_imgs])
+        img = torch.tensor(img, dtype=torch.float32).to(self._device)
+
+        # the smpls which are not given are estimated by hmr together
+        src_smpl = torch.zeros(bs, self.hmr.theta_dim, dtype=torch.float32, device=self._device)
+        hmr_ids = [i for i in range(bs) if src_smpls[i] is None]
+        given_ids = [i for i in range(bs) if src_smpls[i] is not None]
+        if hmr_ids:
+            img_hmr = np.stack([cv_utils.transform_img(ori_imgs[i], 224, transpose=True) * 2 - 1.0 for i in hmr_ids])
+            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).to(self._device)
+            src_smpl[hmr_ids] = self.hmr(img_hmr)
+        if given_ids:
+            src_smpl[given_ids] = torch.tensor(np.stack([src_smpls[i] for i in given_ids]),
+                                               dtype=torch.float32).to(self._device)
 
         # source process, {'theta', 'cam', 'pose', 'shape', 'verts', 'j2d', 'j3d'}
         src_info = self.hmr.get_details(src_smpl)
-        src_f2verts, src_fim, src_wim = self.render.render_fim_wim(src_info['cam'], src_info['verts'])
-        # src_f2pts = src_f2verts[:, :, :, 0:2]
-        src_info['fim'] = src_fim
-        src_info['wim'] = src_wim
-        src_info['cond'], _ = self.render.encode_fim(src_info['cam'], src_info['verts'], fim=src_fim, transpose=True)
-        src_info['f2verts'] = src_f2verts
-        src_info['p2verts'] = src_f2verts[:, :, :, 0:2]
-        src_info['p2verts'][:, :, :, 1] *= -1
-
-        if self._opt.only_vis:
-            src_info['p2verts'] = self.render.get_vis_f2pts(src_info['p2verts'], src_fim)
+        # {'f2verts', 'p2verts', 'fim', 'wim', 'cond'} and the eroded background masks
+        plan = self.render.plan_warp(src_info['cam'], src_info['verts'], erode_ks=(self._opt.bg_ks, self._opt.ft_ks),
+                                     only_vis=self._opt.only_vis)
+        bg_erode, ft_erode = plan.pop('masks')
+        src_info.update(plan)
+
         # add image to source info
         src_info['img'] = img
-        src_info['image'] = ori_img
 
         # 2. process the src inputs
         if self.detector is not None:
-            bbox, body_mask = self.detector.inference(img[0])
+            bbox, body_mask = self.detector.batch_inference(img)
             bg_mask = 1 - body_mask
         else:
             # bg is 1, ft is 0
-            bg_mask = util.morph(src_info['cond'][:, -1:, :, :], ks=self._opt.bg_ks, mode='erode')
+            bg_mask = bg_erode
             body_mask = 1 - bg_mask
 
         if self._opt.bg_model != 'ORIGINAL':
@@ -130,106 +174,156 @@ class Imitator(BaseModel):
             # src_info['bg'] = bg_inputs[:, 0:3] + img_bg * bg_inputs[:, -1:]
             src_info['bg'] = img_bg
 
-        ft_mask = 1 - util.morph(src_info['cond'][:, -1:, :, :], ks=self._opt.ft_ks, mode='erode')
+        ft_mask = 1 - ft_erode
         src_inputs = torch.cat([img * ft_mask, src_info['cond']], dim=1)
 
         src_info['feats'] = self.generator.encode_src(src_inputs)
 
-        self.src_info = src_info
-
-        if visualizer is not None:
-            visualizer.vis_named_img('src', img)
-            visualizer.vis_named_img('bg', src_info['bg'])
-
-        if output_path:
-            cv_utils.save_cv2_img(src_info['image'], output_path, image_size=self._opt.image_size)
+        # split the batch into the src_info of every source
+        src_infos = []
+        for i in range(bs):
+            info = self._select_source(src_info, i)
+            info['image'] = ori_imgs[i]
+            src_infos.append(info)
+
+        return src_infos
+
+    @staticmethod
+    def _select_source(value, i):
+        if torch.is_tensor(value):
+            # a copy, so that the src_info does not hold the memory of the whole batch.
+            return value[i:i + 1].clone()
+        elif isinstance(value, dict):
+            return {k: Imitator._select_source(v, i) for k, v in value.items()}
+        elif isinstance(value, (list, tuple)):
+            return type(value)(Imitator._select_source(v, i) for v in value)
+        else:
+            return value
 
     @torch.no_grad()
     def _extract_smpls(self, input_file):
-        img = cv_utils.read_cv2_img(input_file)
+        img = cv_utils.read_img(input_file)
         img = cv_utils.transform_img(img, image_size=224) * 2 - 1.0  # hmr receive [-1, 1]
         img = img.transpose((2, 0, 1))
-        img = torch.tensor(img, dtype=torch.float32).cuda()[None, ...]
+        img = torch.tensor(img, dtype=torch.float32).to(self._device)[None, ...]
         theta = self.hmr(img)[-1]
 
         return theta
 
     @torch.no_grad()
     def inference(self, tgt_paths, tgt_smpls=None, cam_strategy='smooth',
-                  output_dir='', visualizer=None, verbose=True):
-
-        length = len(tgt_paths)
-
+                  output_dir='', visualizer=None, verbose=True, batch_size=1, video_writer=None, to_uint8=False):
+        """
+        Args:
+            tgt_paths (list of str or utils.video.VideoReader or sequence of frames): the paths of the target
+                frames, or a reference video whose frames are decoded on the fly, or the in-memory frames, e.g,
+                a (n, h, w, 3) uint8 array or a (n, 3, h, w) float tensor in [0, 1], see `cv_utils.read_img`.
+            tgt_smpls (np.ndarray or None): (n, 85), if it is None, they are estimated by hmr.
+            cam_strategy (str):
+            output_dir (str): the folder to save `pred_*` and `gt_*` images, nothing is saved if it is empty.
+            visualizer:
+            verbose (bool):
+            batch_size (int):
+            video_writer (utils.video.VideoWriter or None): the predictions are encoded into it frame by frame.
+            to_uint8 (bool): return the predictions as RGB uint8 frames or not.
+
+        Returns:
+            outputs (list of np.ndarray): the (h, w, 3) predictions in [-1, 1], or in uint8 if to_uint8 is True.
+        """
         outputs = []
-        process_bar = tqdm(range(length)) if verbose else range(length)
+        process_bar = tqdm(total=len(tgt_paths)) if verbose else None
 
-        for t in process_bar:
-            tgt_path = tgt_paths[t]
-            tgt_smpl = tgt_smpls[t] if tgt_smpls is not None else None
+        for t, names, ori_imgs in read_frame_batches(tgt_paths, batch_size):
+            batch_smpls = tgt_smpls[t:t + len(names)] if tgt_smpls is not None else None
 
-            tsf_inputs = self.transfer_params(tgt_path, tgt_smpl, cam_strategy, t=t)
-            preds = self.forward(tsf_inputs, self.tsf_info['T'])
+            tsf_inputs = self.transfer_params_by_imgs(ori_imgs, batch_smpls, cam_strategy, t=t)
+            if self._opt.key_pose_thresh > 0:
+                preds = self.forward_keyframes(tsf_inputs, self.tsf_info['T'], t=t)
+            else:
+                preds = self.forward(tsf_inputs, self.tsf_info['T'])
 
             if visualizer is not None:
-                gt = cv_utils.transform_img(self.tsf_info['image'], image_size=self._opt.image_size, transpose=True)
+                gt = np.stack([cv_utils.transform_img(image, image_size=self._opt.image_size, transpose=True)
+                               for image in self.tsf_info['images']])
                 visualizer.vis_named_img('pred_' + cam_strategy, preds)
-                visualizer.vis_named_img('gt', gt[None, ...], denormalize=False)
+                visualizer.vis_named_img('gt', gt, denormalize=False)
 
-            preds = preds[0].permute(1, 2, 0)
+            preds = preds.permute(0, 2, 3, 1)
             preds = preds.cpu().numpy()
-            outputs.append(preds)
 
-            if output_dir:
-                filename = os.path.split(tgt_path)[-1]
+            for filename, pred, image in zip(names, preds, self.tsf_info['images']):
+                outputs.append(cv_utils.to_uint8_img(pred) if to_uint8 else pred)
+
+                if video_writer is not None:
+                    video_writer.write(pred, normalize=True)
+
+                if output_dir:
+                    cv_utils.save_cv2_img(pred, os.path.join(output_dir, 'pred_' + filename), normalize=True)
+                    cv_utils.save_cv2_img(image, os.path.join(output_dir, 'gt_' + filename),
+                                          image_size=self._opt.image_size)
+
+            if process_bar is not None:
+                process_bar.update(len(names))
+
+        if process_bar is not None:
+            process_bar.close()
 
-                cv_utils.save_cv2_img(preds, os.path.join(output_dir, 'pred_' + filename), normalize=True)
-                cv_utils.save_cv2_img(self.tsf_info['image'], os.path.join(output_dir, 'gt_' + filename),
-                                      image_size=self._opt.image_size)
+        if self._opt.key_pose_thresh > 0 and verbose:
+            print('keyframe ratio: {:.3f} ({} / {})'.format(self.keyframe_ratio, *self.keyframe_counts))
 
         return outputs
     
     @torch.no_grad()
-    def inference_by_smpls(self, tgt_smpls, cam_strategy='smooth', output_dir='', visualizer=None):
+    def inference_by_smpls(self, tgt_smpls, cam_strategy='smooth', output_dir='', visualizer=None, batch_size=1,
+                           video_writer=None, to_uint8=False):
         length = len(tgt_smpls)
 
         outputs = []
-        for t in tqdm(range(length)):
-            tgt_smpl = tgt_smpls[t] if tgt_smpls is not None else None
+        for t in tqdm(range(0, length, batch_size)):
+            tgt_smpl = tgt_smpls[t:t + batch_size]
+            if isinstance(tgt_smpl, np.ndarray):
+                tgt_smpl = torch.tensor(tgt_smpl).float().to(self._device)
+            elif not torch.is_tensor(tgt_smpl):
+                tgt_smpl = torch.tensor(np.stack(tgt_smpl)).float().to(self._device)
 
             tsf_inputs = self.transfer_params_by_smpl(tgt_smpl, cam_strategy, t=t)
             preds = self.forward(tsf_inputs, self.tsf_info['T'])
 
             if visualizer is not None:
-                gt = cv_utils.transform_img(self.tsf_info['image'], image_size=self._opt.image_size, transpose=True)
                 visualizer.vis_named_img('pred_' + cam_strategy, preds)
-                visualizer.vis_named_img('gt', gt[None, ...], denormalize=False)
 
-            preds = preds[0].permute(1, 2, 0)
+            preds = preds.permute(0, 2, 3, 1)
             preds = preds.cpu().numpy()
-            outputs.append(preds)
 
-            if output_dir:
-                cv_utils.save_cv2_img(preds, os.path.join(output_dir, 'pred_%.8d.jpg' % t), normalize=True)
+            for i, pred in enumerate(preds):
+                outputs.append(cv_utils.to_uint8_img(pred) if to_uint8 else pred)
+
+                if video_writer is not None:
+                    video_writer.write(pred, normalize=True)
+
+                if output_dir:
+                    cv_utils.save_cv2_img(pred, os.path.join(output_dir, 'pred_%.8d.jpg' % (t + i)), normalize=True)
 
         return outputs
 
     def swap_smpl(self, src_cam, src_shape, tgt_smpl, cam_strategy='smooth'):
+        bs = tgt_smpl.shape[0]
         tgt_cam = tgt_smpl[:, 0:3].contiguous()
         pose = tgt_smpl[:, 3:75].contiguous()
 
         # TODO, need more tricky ways
         if cam_strategy == 'smooth':
 
-            cam = src_cam.clone()
+            cam = src_cam.repeat(bs, 1)
             delta_xy = tgt_cam[:, 1:] - self.first_cam[:, 1:]
             cam[:, 1:] += delta_xy
 
         elif cam_strategy == 'source':
-            cam = src_cam
+            cam = src_cam.expand(bs, -1)
         else:
             cam = tgt_cam
 
-        tsf_smpl = torch.cat([cam, pose, src_shape], dim=1)
+        tsf_smpl = torch.cat([cam, pose, src_shape.expand(bs, -1)], dim=1)
 
         return tsf_smpl
 
@@ -238,44 +332,95 @@ class Imitator(BaseModel):
         src_info = self.src_info
 
         if isinstance(tgt_smpl, np.ndarray):
-            tgt_smpl = torch.tensor(tgt_smpl).float().cuda()[None, ...]
+            tgt_smpl = torch.tensor(tgt_smpl).float().to(self._device)
+            if tgt_smpl.dim() == 1:
+                tgt_smpl = tgt_smpl[None, ...]
 
         if t == 0 and cam_strategy == 'smooth':
-            self.first_cam = tgt_smpl[:, 0:3].clone()
+            self.first_cam = tgt_smpl[0:1, 0:3].clone()
 
         # get transfer smpl
         tsf_smpl = self.swap_smpl(src_info['cam'], src_info['shape'], tgt_smpl, cam_strategy=cam_strategy)
-        # transfer process, {'theta', 'cam', 'pose', 'shape', 'verts', 'j2d', 'j3d'}
-        tsf_info = self.hmr.get_details(tsf_smpl)
 
-        tsf_f2verts, tsf_fim, tsf_wim = self.render.render_fim_wim(tsf_info['cam'], tsf_info['verts'])
-        # src_f2pts = src_f2verts[:, :, :, 0:2]
-        tsf_info['fim'] = tsf_fim
-        tsf_info['wim'] = tsf_wim
-        tsf_info['cond'], _ = self.render.encode_fim(tsf_info['cam'], tsf_info['verts'], fim=tsf_fim, transpose=True)
-        # tsf_info['sil'] = util.morph((tsf_fim != -1).float(), ks=self._opt.ft_ks, mode='dilate')
+        return self.transfer_params_by_tsf_smpl(tsf_smpl, src_info['p2verts'], src_info['img'])
+
+    def transfer_params_by_tsf_smpl(self, tsf_smpl, src_p2verts, src_img, pose_blend=None):
+        """
+        Args:
+            tsf_smpl (torch.Tensor): (bs, 85), the transferred smpls, see `swap_smpl`.
+            src_p2verts (torch.Tensor): (1 or bs, nf, 3, 2), the projected faces of the source(s).
+            src_img (torch.Tensor): (1 or bs, 3, h, w), the source image(s).
+            pose_blend (tuple or None): the pose-dependent terms of SMPL, see `SMPL.pose_blend`.
 
-        T = self.render.cal_bc_transform(src_info['p2verts'], tsf_fim, tsf_wim)
-        tsf_img = F.grid_sample(src_info['img'], T)
-        tsf_inputs = torch.cat([tsf_img, tsf_info['cond']], dim=1)
+        Returns:
+            tsf_inputs (torch.Tensor): (bs, 3 + cond_nc, h, w)
+        """
+        # transfer process, {'theta', 'cam', 'pose', 'shape', 'verts', 'j2d', 'j3d'}
+        tsf_info = self.hmr.get_details(tsf_smpl, pose_blend=pose_blend)
 
-        # add target image to tsf info
-        tsf_info['tsf_img'] = tsf_img
-        tsf_info['T'] = T
+        # {'f2verts', 'p2verts', 'fim', 'wim', 'cond', 'T', 'tsf_img'}, a single source is broadcast to the (bs)
+        # target frames without copying.
+        tsf_info.update(self.render.plan_warp(tsf_info['cam'], tsf_info['verts'], src_f2pts=src_p2verts,
+                                              src_img=src_img, incremental=True))
+        tsf_inputs = torch.cat([tsf_info['tsf_img'], tsf_info['cond']], dim=1)
 
         self.tsf_info = tsf_info
 
         return tsf_inputs
 
+    def transfer_params_batch(self, tgt_paths, tgt_smpls=None, cam_strategy='smooth', t=0):
+        """
+        Batched version of transfer_params, all the target frames go through hmr, render and warping together.
+
+        Args:
+            tgt_paths (list of str or sequence of frames): the paths of the (bs) target images, or the frames.
+            tgt_smpls (np.ndarray or list or None): (bs, 85), the smpls of the target images, if it is None,
+                they are estimated by hmr.
+            cam_strategy (str):
+            t (int): the time step of the first frame.
+
+        Returns:
+            tsf_inputs (torch.Tensor): (bs, 3 + cond_nc, image_size, image_size)
+        """
+        ori_imgs = [cv_utils.read_img(tgt_path) for tgt_path in tgt_paths]
+        return self.transfer_params_by_imgs(ori_imgs, tgt_smpls, cam_strategy, t=t)
+
+    def transfer_params_by_imgs(self, ori_imgs, tgt_smpls=None, cam_strategy='smooth', t=0, imgs_hmr=None):
+        """
+        Args:
+            ori_imgs (list of np.ndarray): the (bs) decoded target images, (h, w, 3), RGB, [0, 255].
+            tgt_smpls (np.ndarray or list or None): (bs, 85), if it is None, they are estimated by hmr.
+            cam_strategy (str):
+            t (int): the time step of the first frame.
+            imgs_hmr (np.ndarray or None): (bs, 3, 224, 224), the pre-processed hmr inputs in [-1, 1] of ori_imgs,
+                if it is None, they are computed here.
+
+        Returns:
+            tsf_inputs (torch.Tensor): (bs, 3 + cond_nc, image_size, image_size)
+        """
+        if tgt_smpls is None:
+            if imgs_hmr is None:
+                imgs_hmr = np.stack([cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
+                                     for ori_img in ori_imgs])
+            imgs_hmr = torch.tensor(imgs_hmr, dtype=torch.float32).to(self._device)
+            tgt_smpls = self.hmr(imgs_hmr)
+        elif not torch.is_tensor(tgt_smpls):
+            tgt_smpls = torch.tensor(np.stack(tgt_smpls), dtype=torch.float32).to(self._device)
+
+        tsf_inputs = self.transfer_params_by_smpl(tgt_smpl=tgt_smpls, cam_strategy=cam_strategy, t=t)
+        self.tsf_info['images'] = ori_imgs
+
+        return tsf_inputs
+
     def transfer_params(self, tgt_path, tgt_smpl=None, cam_strategy='smooth', t=0):
-        ori_img = cv_utils.read_cv2_img(tgt_path)
+        ori_img = cv_utils.read_img(tgt_path)
         if tgt_smpl is None:
             img_hmr = cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
-            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).cuda()[None, ...]
+            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).to(self._device)[None, ...]
             tgt_smpl = self.hmr(img_hmr)
         else:
             if isinstance(tgt_smpl, np.ndarray):
-                tgt_smpl = torch.tensor(tgt_smpl, dtype=torch.float32).cuda()[None, ...]
+                tgt_smpl = torch.tensor(tgt_smpl, dtype=torch.float32).to(self._device)[None, ...]
 
         tsf_inputs = self.transfer_params_by_smpl(tgt_smpl=tgt_smpl, cam_strategy=cam_strategy, t=t)
         self.tsf_info['image'] = ori_img
@@ -323,11 +468,39 @@ class Imitator(BaseModel):
     #
     #     return tsf_inputs
 
-    def forward(self, tsf_inputs, T):
-        bg_img = self.src_info['bg']
-        src_encoder_outs, src_resnet_outs = self.src_info['feats']
+    def forward(self, tsf_inputs, T, src_feats=None, bg_img=None):
+        """
+        Args:
+            tsf_inputs (torch.Tensor): (bs, 3 + cond_nc, h, w)
+            T (torch.Tensor): (bs, h, w, 2)
+            src_feats (tuple or None): (src_encoder_outs, src_resnet_outs) with batch size 1 or bs,
+                if it is None, use self.src_info['feats'].
+            bg_img (torch.Tensor or None): (1 or bs, 3, h, w), if it is None, use self.src_info['bg'].
+
+        Returns:
+            pred_imgs (torch.Tensor): (bs, 3, h, w)
+        """
+        bs = tsf_inputs.shape[0]
+        bg_img = self.src_info['bg'] if bg_img is None else bg_img
+        src_encoder_outs, src_resnet_outs = self.src_info['feats'] if src_feats is None else src_feats
+
+        # broadcast the source features to the (bs) target frames without copying.
+        src_encoder_outs = [x.expand(bs, -1, -1, -1) for x in src_encoder_outs]
+        src_resnet_outs = [x.expand(bs, -1, -1, -1) for x in src_resnet_outs]
+
+        if self._opt.roi:
+            # the generator only runs on the body crop, the rest is the background (mask = 1).
+            y0, y1, x0, x1 = self.body_roi(self.tsf_info['fim'], pad=self._opt.roi_pad)
+            crop_color, crop_mask = self.generator.inference(src_encoder_outs, src_resnet_outs,
+                                                             tsf_inputs[:, :, y0:y1, x0:x1], T[:, y0:y1, x0:x1])
+            h, w = tsf_inputs.shape[2:]
+            tsf_color = crop_color.new_zeros(bs, 3, h, w)
+            tsf_mask = crop_mask.new_ones(bs, 1, h, w)
+            tsf_color[:, :, y0:y1, x0:x1] = crop_color
+            tsf_mask[:, :, y0:y1, x0:x1] = crop_mask
+        else:
+            tsf_color, tsf_mask = self.generator.inference(src_encoder_outs, src_resnet_outs, tsf_inputs, T)
 
-        tsf_color, tsf_mask = self.generator.inference(src_encoder_outs, src_resnet_outs, tsf_inputs, T)
         pred_imgs = tsf_mask * bg_img + (1 - tsf_mask) * tsf_color
 
         if self._opt.front_warp:
@@ -335,12 +508,221 @@ class Imitator(BaseModel):
 
         return pred_imgs
 
+    def forward_keyframes(self, tsf_inputs, T, t=0):
+        """
+        Keyframe mode of forward for smooth reference motions. The generator only runs on the keyframes, whose
+        pose or camera differs from the ones of the last keyframe by more than `key_pose_thresh` or
+        `key_cam_thresh`. The other frames are synthesized by warping the prediction of their last keyframe with
+        the barycentric transform from its mesh to theirs, the body parts hidden in the keyframe are filled by
+        the warped source image.
+
+        Args:
+            tsf_inputs (torch.Tensor): (bs, 3 + cond_nc, h, w)
+            T (torch.Tensor): (bs, h, w, 2)
+            t (int): the time step of the first frame, the keyframes are reset at 0.
+
+        Returns:
+            pred_imgs (torch.Tensor): (bs, 3, h, w)
+        """
+        tsf_info = self.tsf_info
+        bs, _, h, w = tsf_inputs.shape
+
+        if t == 0:
+            self.keyframe = None
+            self.keyframe_counts = [0, 0]
+
+        # 1. select the keyframes, refs[i] is the index of the keyframe of frame i in the keyframes of this batch,
+        # or -1 for the last keyframe of the previous batches.
+        poses = tsf_info['pose'].cpu().numpy()
+        cams = tsf_info['cam'].cpu().numpy()
+        ref_pose, ref_cam = (self.keyframe['pose'], self.keyframe['cam']) if self.keyframe is not None else (None, None)
+
+        key_ids, refs = [], []
+        for i in range(bs):
+            if ref_pose is None or np.abs(poses[i] - ref_pose).max() > self._opt.key_pose_thresh \
+                    or np.abs(cams[i] - ref_cam).max() > self._opt.key_cam_thresh:
+                ref_pose, ref_cam = poses[i], cams[i]
+                key_ids.append(i)
+            refs.append(len(key_ids) - 1)
+
+        # 2. run the generator on the keyframes
+        # the visibility table of a keyframe is computed once and reused by all its in-between frames.
+        key_preds, key_p2verts, key_fims, key_vis = [], [], [], []
+        if self.keyframe is not None:
+            key_preds.append(self.keyframe['pred'])
+            key_p2verts.append(self.keyframe['p2verts'])
+            key_fims.append(self.keyframe['fim'])
+            key_vis.append(self.keyframe['vis'])
+            refs = [ref + 1 for ref in refs]
+
+        if key_ids:
+            p2verts = tsf_info['p2verts'][key_ids]
+            fims = tsf_info['fim'][key_ids]
+
+            self.tsf_info = {'fim': fims, 'tsf_img': tsf_info['tsf_img'][key_ids]}
+            key_preds.append(self.forward(tsf_inputs[key_ids], T[key_ids]))
+            key_p2verts.append(p2verts)
+            key_fims.append(fims)
+            key_vis.append(self.render.visible_faces(fims, p2verts.shape[1]))
+            self.tsf_info = tsf_info
+
+        key_preds = torch.cat(key_preds, dim=0)
+        key_p2verts = torch.cat(key_p2verts, dim=0)
+        key_fims = torch.cat(key_fims, dim=0)
+        key_vis = torch.cat(key_vis, dim=0)
+
+        # 3. warp the keyframes to the in-between frames
+        pred_imgs = key_preds[refs]
+        inter_ids = sorted(set(range(bs)) - set(key_ids))
+        if inter_ids:
+            n = len(inter_ids)
+            inter_refs = [refs[i] for i in inter_ids]
+            fims = tsf_info['fim'][inter_ids].long()
+
+            T_key = self.render.cal_bc_transform(key_p2verts[inter_refs], fims, tsf_info['wim'][inter_ids])
+            warped = F.grid_sample(key_preds[inter_refs], T_key)
+
+            # the pixels of the faces visible in the keyframes, and the body pixels of the keyframes.
+            body = (fims != -1)[:, None]
+            ref_body = (key_fims[inter_refs] != -1)[:, None]
+            covered = torch.gather(key_vis[inter_refs], 1, fims.clamp(min=0).view(n, -1)).view(n, 1, h, w) & body
+            bg = self.src_info['bg'].expand(n, -1, -1, -1)
+            inter_preds = torch.where(ref_body, bg, pred_imgs[inter_ids])
+            inter_preds = torch.where(body, tsf_info['tsf_img'][inter_ids], inter_preds)
+            pred_imgs[inter_ids] = torch.where(covered, warped, inter_preds)
+
+        self.keyframe = {'pred': key_preds[-1:], 'p2verts': key_p2verts[-1:], 'fim': key_fims[-1:],
+                         'vis': key_vis[-1:], 'pose': ref_pose, 'cam': ref_cam}
+        self.keyframe_counts[0] += len(key_ids)
+        self.keyframe_counts[1] += bs
+
+        return pred_imgs
+
+    @property
+    def keyframe_ratio(self):
+        num_keys, num_frames = self.keyframe_counts
+        return num_keys / max(num_frames, 1)
+
+    def body_roi(self, fims, pad=32):
+        """
+        Args:
+            fims (torch.Tensor): (bs, h, w), the face index maps of the target frames, -1 is the background.
+            pad (int): the padding of the bounding box, in pixels.
+
+        Returns:
+            y0, y1, x0, x1 (int): the bounding box of the bodies of all the frames, its sides are multiples of
+            2 ** n_down of the generator, the whole frame if there is no body.
+        """
+        h, w = fims.shape[1:]
+        body = fims != -1
+        ys = torch.nonzero(body.any(dim=2).any(dim=0)).view(-1)
+        xs = torch.nonzero(body.any(dim=1).any(dim=0)).view(-1)
+        if len(ys) == 0:
+            return 0, h, 0, w
+
+        ys, xs = ys[[0, -1]].tolist(), xs[[0, -1]].tolist()
+        unit = 2 ** self.generator.n_down
+
+        def align(start, end, length):
+            start = max(0, start - pad) // unit * unit
+            end = min(length, -(-(end + 1 + pad) // unit) * unit)
+            return start, end
+
+        y0, y1 = align(ys[0], ys[1], h)
+        x0, x1 = align(xs[0], xs[1], w)
+        return y0, y1, x0, x1
+
     def warp_front(self, preds, mask):
         front_mask = self.render.encode_front_fim(self.tsf_info['fim'], transpose=True, front_fn=True)
         preds = (1 - front_mask) * preds + self.tsf_info['tsf_img'] * front_mask * (1 - mask)
         # preds = torch.clamp(preds + self.tsf_info['tsf_img'] * front_mask, -1, 1)
         return preds
 
+    @torch.no_grad()
+    def quantize(self, src_path, calib_paths, guard_paths=(), min_psnr=30.0, batch_size=1):
+        """
+        INT8 quantization of the resnets and decoders of the transfer generator, of hmr and of the deepfillv2
+        background inpaintor for cpu inference. It must be called after the (post) personalization.
+
+        Args:
+            src_path (str): the personalized source image, used to calibrate hmr and the inpaintor.
+            calib_paths (list of str): the frames to calibrate the quantized layers.
+            guard_paths (list of str): the frames to measure the drift against fp32, empty to skip the guard.
+            min_psnr (float): falls back to fp32 if the PSNR of the int8 outputs against the fp32 ones is lower.
+            batch_size (int):
+
+        Returns:
+            drift (dict or None): {'psnr': float, 'ssim': float}, None if there is no guard frame.
+        """
+        from utils.quantize import Int8Quantizer, check_quantization, measure_drift
+
+        assert self._device.type == 'cpu', 'the int8 kernels only run on cpu, please set --device cpu.'
+        check_quantization()
+
+        tsf_model = 'generator.tsf_model'
+        static_names = ['%s.resnets.%d' % (tsf_model, i) for i in range(self._opt.repeat_num)]
+        for i in range(len(self.generator.tsf_model.decoders)):
+            static_names += ['%s.decoders.%d' % (tsf_model, i), '%s.skippers.%d' % (tsf_model, i)]
+        static_names += ['%s.img_reg' % tsf_model, '%s.attetion_reg' % tsf_model]
+        static_names += ['hmr.resnet.conv1'] + ['hmr.resnet.layer%d' % i for i in range(1, 5)]
+        if self._opt.bg_model != 'ORIGINAL':
+            static_names += ['bgnet.coarse_net', 'bgnet.refine_conv_net', 'bgnet.refine_upsample_net']
+
+        quantizer = Int8Quantizer(self, static_names, dynamic_names=['hmr.regressor'])
+
+        def calibrate():
+            self._personalize(src_path)
+            self.inference(calib_paths, verbose=False, batch_size=batch_size)
+
+        # the calibration and the guard frames change the per-source state, it is restored at the end.
+        state = self._source_state()
+        ref_preds = self.inference(guard_paths, verbose=False, batch_size=batch_size) if guard_paths else None
+
+        quantizer.quantize(calibrate)
+
+        # the source is personalized again by the int8 hmr and inpaintor.
+        int8_src_info = self._personalize(src_path)
+        self.src_info = int8_src_info
+
+        drift = None
+        if ref_preds is not None:
+            preds = self.inference(guard_paths, verbose=False, batch_size=batch_size)
+            psnr, ssim = measure_drift(ref_preds, preds)
+            print('INT8 drift against FP32 on {} frames: PSNR = {:.2f} dB, SSIM = {:.4f}'.format(
+                len(guard_paths), psnr, ssim))
+            drift = {'psnr': psnr, 'ssim': ssim}
+
+            if psnr < min_psnr:
+                print('PSNR {:.2f} < {:.2f}, falling back to FP32.'.format(psnr, min_psnr))
+                quantizer.restore()
+                int8_src_info = None
+
+        self._restore_source_state(state)
+        if int8_src_info is not None:
+            self.src_info = int8_src_info
+
+        return drift
+
+    def _source_state(self):
+        """
+        Returns:
+            state (dict): the per-source state, the personalized source, the transferred info, the first camera
+                of the smooth strategy and the keyframe cache.
+        """
+        return {'src_info': self.src_info, 'tsf_info': self.tsf_info, 'first_cam': self.first_cam,
+                'keyframe': self.keyframe, 'keyframe_counts': list(self.keyframe_counts)}
+
+    def _restore_source_state(self, state):
+        self.src_info = state['src_info']
+        self.tsf_info = state['tsf_info']
+        self.first_cam = state['first_cam']
+        self.keyframe = state['keyframe']
+        self.keyframe_counts = list(state['keyframe_counts'])
+
+        # the previous frame of the incremental rasterizer is a calibration or guard frame.
+        if self.render.incremental_rasterizer is not None:
+            self.render.incremental_rasterizer.reset()
+
     def post_personalize(self, out_dir, data_loader, visualizer, verbose=True):
         from networks.networks import FaceLoss
 
@@ -348,19 +730,19 @@ class Imitator(BaseModel):
 
         @torch.no_grad()
         def set_gen_inputs(sample):
-            j2ds = sample['j2d'].cuda()  # (N, 4)
-            T = sample['T'].cuda()  # (N, h, w, 2)
-            T_cycle = sample['T_cycle'].cuda()  # (N, h, w, 2)
-            src_inputs = sample['src_inputs'].cuda()  # (N, 6, h, w)
-            tsf_inputs = sample['tsf_inputs'].cuda()  # (N, 6, h, w)
-            src_fim = sample['src_fim'].cuda()
-            tsf_fim = sample['tsf_fim'].cuda()
-            init_preds = sample['preds'].cuda()
+            j2ds = sample['j2d'].to(self._device)  # (N, 4)
+            T = sample['T'].to(self._device)  # (N, h, w, 2)
+            T_cycle = sample['T_cycle'].to(self._device)  # (N, h, w, 2)
+            src_inputs = sample['src_inputs'].to(self._device)  # (N, 6, h, w)
+            tsf_inputs = sample['tsf_inputs'].to(self._device)  # (N, 6, h, w)
+            src_fim = sample['src_fim'].to(self._device)
+            tsf_fim = sample['tsf_fim'].to(self._device)
+            init_preds = sample['preds'].to(self._device)
             images = sample['images']
-            images = torch.cat([images[:, 0, ...], images[:, 1, ...]], dim=0).cuda()  # (2N, 3, h, w)
+            images = torch.cat([images[:, 0, ...], images[:, 1, ...]], dim=0).to(self._device)  # (2N, 3, h, w)
             pseudo_masks = sample['pseudo_masks']
             pseudo_masks = torch.cat([pseudo_masks[:, 0, ...], pseudo_masks[:, 1, ...]],
-                                     dim=0).cuda()  # (2N, 1, h, w)
+                                     dim=0).to(self._device)  # (2N, 1, h, w)
 
             return src_fim, tsf_fim, j2ds, T, T_cycle, \
                    src_inputs, tsf_inputs, images, init_preds, pseudo_masks
@@ -406,7 +788,7 @@ class Imitator(BaseModel):
             return fake_src_imgs, fake_tsf_imgs, cycle_src_imgs, cycle_tsf_imgs, fake_src_mask, fake_tsf_mask
 
         def create_criterion():
-            face_criterion = FaceLoss(pretrained_path=self._opt.face_model).cuda()
+            face_criterion = FaceLoss(pretrained_path=self._opt.face_model).to(self._device)
             idt_criterion = torch.nn.L1Loss()
             mask_criterion = torch.nn.BCELoss()
 
@@ -470,3 +852,6 @@ class Imitator(BaseModel):
                 step += 1
 
         self.generator.eval()
+
+        # the generator has been fine-tuned, the cached sources of the checkpoint do not match it any more.
+        self._src_cache = None
@@ -46,16 +46,13 @@ class BodyRecoveryFlow(torch.nn.Module):
         ref_info = self._hmr.get_details(ref_smpl)
 
         # process source inputs
-        src_f2verts, src_fim, _ = self._render.render_fim_wim(src_info['cam'], src_info['verts'])
-        src_f2verts = src_f2verts[:, :, :, 0:2]
-        src_f2verts[:, :, :, 1] *= -1
-        src_cond, _ = self._render.encode_fim(src_info['cam'], src_info['verts'], fim=src_fim, transpose=True)
-        src_crop_mask = util.morph(src_cond[:, -1:, :, :], ks=3, mode='erode')
+        src_plan = self._render.plan_warp(src_info['cam'], src_info['verts'], erode_ks=(3, 15))
+        src_cond = src_plan['cond']
+        src_crop_mask, src_bg_mask = src_plan['masks']
 
-        _, ref_fim, ref_wim = self._render.render_fim_wim(ref_info['cam'], ref_info['verts'])
-        ref_cond, _ = self._render.encode_fim(ref_info['cam'], ref_info['verts'], fim=ref_fim, transpose=True)
-        T = self._render.cal_bc_transform(src_f2verts, ref_fim, ref_wim)
-        syn_img = F.grid_sample(src_img, T)
+        ref_plan = self._render.plan_warp(ref_info['cam'], ref_info['verts'], src_f2pts=src_plan['p2verts'],
+                                          src_img=src_img, erode_ks=(3, 15) if self._opt.bg_both else (3,))
+        ref_cond, T, syn_img = ref_plan['cond'], ref_plan['T'], ref_plan['tsf_img']
 
         # src input
         input_G_src = torch.cat([src_img * (1 - src_crop_mask), src_cond], dim=1)
@@ -64,17 +61,16 @@ class BodyRecoveryFlow(torch.nn.Module):
         input_G_tsf = torch.cat([syn_img, ref_cond], dim=1)
 
         # bg input
-        src_bg_mask = util.morph(src_cond[:, -1:, :, :], ks=15, mode='erode')
         input_G_src_bg = torch.cat([src_img * src_bg_mask, src_bg_mask], dim=1)
 
         if self._opt.bg_both:
-            ref_bg_mask = util.morph(ref_cond[:, -1:, :, :], ks=15, mode='erode')
+            ref_bg_mask = ref_plan['masks'][1]
             input_G_tsf_bg = torch.cat([ref_img * ref_bg_mask, ref_bg_mask], dim=1)
         else:
             input_G_tsf_bg = None
 
         # masks
-        tsf_crop_mask = util.morph(ref_cond[:, -1:, :, :], ks=3, mode='erode')
+        tsf_crop_mask = ref_plan['masks'][0]
 
         head_bbox = self.cal_head_bbox(ref_info['j2d'])
         body_bbox = self.cal_body_bbox(ref_info['j2d'])
@@ -2,6 +2,7 @@ import os
 import torch
 from torch.optim import lr_scheduler
 from collections import OrderedDict
+from utils.src_cache import SourceCache
 
 
 class ModelsFactory(object):
@@ -69,11 +70,18 @@ class BaseModel(object):
         self._gpu_ids = opt.gpu_ids
         self._is_train = opt.is_train
 
-        self._Tensor = torch.cuda.FloatTensor if self._gpu_ids else torch.Tensor
+        # `cuda` or `cpu`, see BaseOptions._set_device_and_threads
+        self._device = torch.device(getattr(opt, 'device', 'cuda'))
+
+        self._Tensor = torch.cuda.FloatTensor if self._device.type == 'cuda' else torch.Tensor
         self._save_dir = os.path.join(opt.checkpoints_dir, opt.name)
 
         self._G_cond_nc, self._D_cond_nc = self.cond_nc()
 
+        # on-disk cache of the personalized source information, see `_cached_personalize`.
+        src_cache_dir = getattr(opt, 'src_cache_dir', '')
+        self._src_cache = SourceCache(src_cache_dir, opt.src_cache_size) if src_cache_dir else None
+
     @property
     def name(self):
         return self._name
@@ -93,6 +101,60 @@ class BaseModel(object):
 
         return _G_cond_nc, _D_cond_nc
 
+    def _personalize(self, src_path, src_smpl=None):
+        assert False, "_personalize not implemented"
+
+    def _personalize_batch(self, src_paths, src_smpls=None):
+        """
+        Returns the list of src_info of `_personalize` of every source, the models which can personalize
+        several sources at once override it.
+        """
+        if src_smpls is None:
+            src_smpls = [None] * len(src_paths)
+        return [self._personalize(src_path, src_smpl) for src_path, src_smpl in zip(src_paths, src_smpls)]
+
+    def _cached_personalize(self, src_path, src_smpl=None):
+        """
+        Returns the src_info of `_personalize`, from the source cache if it has been computed with the same
+        source image, checkpoints and options.
+        """
+        if self._src_cache is None:
+            return self._personalize(src_path, src_smpl)
+
+        key = self._src_cache.key(src_path, self._opt, self._name, src_smpl)
+        src_info = self._src_cache.load(key, device=self._device)
+        if src_info is None:
+            src_info = self._personalize(src_path, src_smpl)
+            self._src_cache.save(key, src_info)
+
+        return src_info
+
+    def _cached_personalize_batch(self, src_paths, src_smpls=None, batch_size=8):
+        """
+        Batched version of `_cached_personalize`, the sources missing in the cache are personalized by
+        `_personalize_batch` in batches of batch_size.
+        """
+        if src_smpls is None:
+            src_smpls = [None] * len(src_paths)
+
+        src_infos = [None] * len(src_paths)
+        keys = [None] * len(src_paths)
+        if self._src_cache is not None:
+            for i, (src_path, src_smpl) in enumerate(zip(src_paths, src_smpls)):
+                keys[i] = self._src_cache.key(src_path, self._opt, self._name, src_smpl)
+                src_infos[i] = self._src_cache.load(keys[i], device=self._device)
+
+        missing = [i for i, src_info in enumerate(src_infos) if src_info is None]
+        for start in range(0, len(missing), batch_size):
+            ids = missing[start:start + batch_size]
+            batch_infos = self._personalize_batch([src_paths[i] for i in ids], [src_smpls[i] for i in ids])
+            for i, src_info in zip(ids, batch_infos):
+                src_infos[i] = src_info
+                if self._src_cache is not None:
+                    self._src_cache.save(keys[i], src_info)
+
+        return src_infos
+
     def set_input(self, input):
         assert False, "set_input not implemented"
 
@@ -170,7 +232,7 @@ class BaseModel(object):
             # load params
             model.load_state_dict(state_dict)
 
-        save_data = torch.load(load_path)
+        save_data = torch.load(load_path, map_location='cpu')
         if need_module:
             network.load_state_dict(save_data)
         else:
@@ -5,6 +5,7 @@ from .models import BaseModel
 from networks.networks import NetworksFactory, HumanModelRecovery
 from utils.detectors import PersonMaskRCNNDetector
 from utils.nmr import SMPLRenderer
+from utils.fold_bn import fold_batch_norms
 import utils.cv_utils as cv_utils
 import utils.util as util
 import utils.mesh as mesh
@@ -31,31 +32,32 @@ class Swapper(BaseModel):
         self.T = None
         self.T12 = None
         self.T21 = None
-        self.grid = self.render.create_meshgrid(self._opt.image_size).cuda()
+        self.grid = self.render.create_meshgrid(self._opt.image_size).to(self._device)
         self.part_fn = torch.tensor(mesh.create_mapping('par', self._opt.uv_mapping,
-                                                        contain_bg=True, fill_back=False)).float().cuda()
+                                                        contain_bg=True, fill_back=False)).float().to(self._device)
         self.part_faces_dict = mesh.get_part_face_ids(part_type='par', fill_back=False)
         self.part_faces = list(self.part_faces_dict.values())
 
     def _create_networks(self):
         # 0. create generator
-        self.generator = self._create_generator().cuda()
+        self.generator = self._create_generator().to(self._device)
 
         # 0. create bgnet
         if self._opt.bg_model != 'ORIGINAL':
-            self.bgnet = self._create_bgnet().cuda()
+            self.bgnet = self._create_bgnet().to(self._device)
         else:
             self.bgnet = self.generator.bg_model
 
         # 2. create hmr
-        self.hmr = self._create_hmr().cuda()
+        self.hmr = self._create_hmr().to(self._device)
 
         # 3. create render
         self.render = SMPLRenderer(image_size=self._opt.image_size, tex_size=self._opt.tex_size,
-                                   has_front=self._opt.front_warp, fill_back=False).cuda()
+                                   has_front=self._opt.front_warp, fill_back=False,
+                                   backend=self._opt.rasterizer).to(self._device)
         # 4. pre-processor
         if self._opt.has_detector:
-            self.detector = PersonMaskRCNNDetector(ks=self._opt.bg_ks, threshold=0.5, to_gpu=True)
+            self.detector = PersonMaskRCNNDetector(ks=self._opt.bg_ks, threshold=0.5, device=self._device)
         else:
             self.detector = None
 
@@ -82,9 +84,10 @@ class Swapper(BaseModel):
 
     def _create_hmr(self):
         hmr = HumanModelRecovery(self._opt.smpl_model)
-        saved_data = torch.load(self._opt.hmr_model)
+        saved_data = torch.load(self._opt.hmr_model, map_location='cpu')
         hmr.load_state_dict(saved_data)
         hmr.eval()
+        fold_batch_norms(hmr)
         return hmr
 
     @staticmethod
@@ -97,36 +100,41 @@ class Swapper(BaseModel):
     # TODO it dose not support mini-batch inputs currently.
     @torch.no_grad()
     def personalize(self, src_path, src_smpl=None, output_path='', visualizer=None):
+        src_info = self._cached_personalize(src_path, src_smpl)
 
-        ori_img = cv_utils.read_cv2_img(src_path)
+        # if visualizer is not None:
+        #     self.visualize(visualizer, src=src_info['img'], bg=src_info['bg'])
+
+        if output_path:
+            cv_utils.save_cv2_img(src_info['image'], output_path, image_size=self._opt.image_size)
+
+        return src_info
+
+    def _personalize(self, src_path, src_smpl=None):
+
+        ori_img = cv_utils.read_img(src_path)
 
         # resize image and convert the color space from [0, 255] to [-1, 1]
         img = cv_utils.transform_img(ori_img, self._opt.image_size, transpose=True) * 2 - 1.0
-        img = torch.tensor(img, dtype=torch.float32).cuda()[None, ...]
+        img = torch.tensor(img, dtype=torch.float32).to(self._device)[None, ...]
 
         if src_smpl is None:
             img_hmr = cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
-            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).cuda()[None, ...]
+            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).to(self._device)[None, ...]
             src_smpl = self.hmr(img_hmr)
         else:
-            src_smpl = torch.tensor(src_smpl, dtype=torch.float32).cuda()[None, ...]
+            src_smpl = torch.tensor(src_smpl, dtype=torch.float32).to(self._device)[None, ...]
 
         # source process, {'theta', 'cam', 'pose', 'shape', 'verts', 'j2d', 'j3d'}
         src_info = self.hmr.get_details(src_smpl)
-        src_f2verts, src_fim, src_wim = self.render.render_fim_wim(src_info['cam'], src_info['verts'])
-        # src_f2pts = src_f2verts[:, :, :, 0:2]
-        src_info['fim'] = src_fim
-        src_info['wim'] = src_wim
-        src_info['cond'], _ = self.render.encode_fim(src_info['cam'], src_info['verts'], fim=src_fim, transpose=True)
-        src_info['f2verts'] = src_f2verts
-        src_info['p2verts'] = src_f2verts[:, :, :, 0:2]
-        src_info['p2verts'][:, :, :, 1] *= -1
-
-        if self._opt.only_vis:
-            src_info['p2verts'] = self.render.get_vis_f2pts(src_info['p2verts'], src_fim)
+        # {'f2verts', 'p2verts', 'fim', 'wim', 'cond'} and the eroded background masks
+        plan = self.render.plan_warp(src_info['cam'], src_info['verts'], erode_ks=(self._opt.bg_ks, self._opt.ft_ks),
+                                     only_vis=self._opt.only_vis)
+        bg_erode, ft_erode = plan.pop('masks')
+        src_info.update(plan)
 
         src_info['part'], _ = self.render.encode_fim(src_info['cam'], src_info['verts'],
-                                                     fim=src_fim, transpose=True, map_fn=self.part_fn)
+                                                     fim=src_info['fim'], transpose=True, map_fn=self.part_fn)
         # add image to source info
         src_info['img'] = img
         src_info['image'] = ori_img
@@ -136,7 +144,7 @@ class Swapper(BaseModel):
             bbox, body_mask = self.detector.inference(img[0])
             bg_mask = 1 - body_mask
         else:
-            bg_mask = util.morph(src_info['cond'][:, -1:, :, :], ks=self._opt.bg_ks, mode='erode')
+            bg_mask = bg_erode
             body_mask = 1 - bg_mask
 
         if self._opt.bg_model != 'ORIGINAL':
@@ -149,27 +157,19 @@ class Swapper(BaseModel):
             src_info['bg'] = img_bg
             # src_info['bg'] = incomp_img + img_bg * body_mask
 
-        ft_mask = 1 - util.morph(src_info['cond'][:, -1:, :, :], ks=self._opt.ft_ks, mode='erode')
+        ft_mask = 1 - ft_erode
         src_inputs = torch.cat([img * ft_mask, src_info['cond']], dim=1)
 
         src_info['feats'] = self.generator.encode_src(src_inputs)
         src_info['src_inputs'] = src_inputs
 
-        src_info = src_info
-
-        # if visualizer is not None:
-        #     self.visualize(visualizer, src=img, bg=src_info['bg'])
-
-        if output_path:
-            cv_utils.save_cv2_img(src_info['image'], output_path, image_size=self._opt.image_size)
-
         return src_info
 
     def _extract_smpls(self, input_file):
-        img = cv_utils.read_cv2_img(input_file)
+        img = cv_utils.read_img(input_file)
         img = cv_utils.transform_img(img, image_size=224) * 2 - 1.0  # hmr receive [-1, 1]
         img = img.transpose((2, 0, 1))
-        img = torch.FloatTensor(img).cuda()[None, ...]
+        img = torch.FloatTensor(img).to(self._device)[None, ...]
         theta = self.hmr(img)[-1]
 
         return theta
@@ -248,7 +248,9 @@ class Swapper(BaseModel):
         # calculate T21
         tsf_f2p = self.tsf_info['p2verts'].clone()
         tsf_f2p[0, left_faces] = -2
-        T21 = self.render.cal_bc_transform(tsf_f2p, self.src_info['fim'], self.src_info['wim'])
+        src_info = self.src_info
+        T21 = self.render.plan_warp(src_info['cam'], src_info['verts'], src_f2pts=tsf_f2p,
+                                    rendered=(src_info['f2verts'], src_info['fim'], src_info['wim']))['T']
         T21.clamp_(-2, 2)
         return T11, T21
 
@@ -279,14 +281,14 @@ class Swapper(BaseModel):
         @torch.no_grad()
         def initialize(src_info, tsf_info):
             src_encoder_outs, src_resnet_outs = src_info['feats']
-            src_f2p = src_info['p2verts']
 
             tsf_fim = tsf_info['fim']
-            tsf_wim = tsf_info['wim']
             tsf_cond = tsf_info['cond']
 
-            T = self.render.cal_bc_transform(src_f2p, tsf_fim, tsf_wim)
-            tsf_img = F.grid_sample(src_info['img'], T)
+            plan = self.render.plan_warp(tsf_info['cam'], tsf_info['verts'], src_f2pts=src_info['p2verts'],
+                                         src_img=src_info['img'],
+                                         rendered=(tsf_info['f2verts'], tsf_fim, tsf_info['wim']))
+            T, tsf_img = plan['T'], plan['tsf_img']
             tsf_inputs = torch.cat([tsf_img, tsf_cond], dim=1)
 
             tsf_color, tsf_mask = self.generator.inference(
@@ -365,7 +367,7 @@ class Swapper(BaseModel):
             return fake_src_imgs, fake_tsf_imgs, cycle_src_imgs, cycle_tsf_imgs, fake_src_mask, fake_tsf_mask, cycle_tsf_inputs
 
         def create_criterion():
-            face_criterion = FaceLoss(pretrained_path=self._opt.face_model).cuda()
+            face_criterion = FaceLoss(pretrained_path=self._opt.face_model).to(self._device)
             idt_criterion = torch.nn.L1Loss()
             mask_criterion = torch.nn.BCELoss()
 
@@ -5,9 +5,10 @@ from tqdm import tqdm
 from .models import BaseModel
 from networks.networks import NetworksFactory, HumanModelRecovery
 from utils.nmr import SMPLRenderer
+from utils.fold_bn import fold_batch_norms
 from utils.detectors import PersonMaskRCNNDetector
 import utils.cv_utils as cv_utils
-import utils.util as util
+from utils.video import frame_name
 
 
 class Viewer(BaseModel):
@@ -25,23 +26,24 @@ class Viewer(BaseModel):
 
     def _create_networks(self):
         # 0. create generator
-        self.generator = self._create_generator().cuda()
+        self.generator = self._create_generator().to(self._device)
 
         # 0. create bgnet
         if self._opt.bg_model != 'ORIGINAL':
-            self.bgnet = self._create_bgnet().cuda()
+            self.bgnet = self._create_bgnet().to(self._device)
         else:
             self.bgnet = self.generator.bg_model
 
         # 2. create hmr
-        self.hmr = self._create_hmr().cuda()
+        self.hmr = self._create_hmr().to(self._device)
 
         # 3. create render
         self.render = SMPLRenderer(image_size=self._opt.image_size, tex_size=self._opt.tex_size,
-                                   has_front=self._opt.front_warp, fill_back=False).cuda()
+                                   has_front=self._opt.front_warp, fill_back=False,
+                                   backend=self._opt.rasterizer).to(self._device)
         # 4. pre-processor
         if self._opt.has_detector:
-            self.detector = PersonMaskRCNNDetector(ks=self._opt.bg_ks, threshold=0.5, to_gpu=True)
+            self.detector = PersonMaskRCNNDetector(ks=self._opt.bg_ks, threshold=0.5, device=self._device)
         else:
             self.detector = None
 
@@ -68,9 +70,10 @@ class Viewer(BaseModel):
 
     def _create_hmr(self):
         hmr = HumanModelRecovery(self._opt.smpl_model)
-        saved_data = torch.load(self._opt.hmr_model)
+        saved_data = torch.load(self._opt.hmr_model, map_location='cpu')
         hmr.load_state_dict(saved_data)
         hmr.eval()
+        fold_batch_norms(hmr)
         return hmr
 
     def visualize(self, *args, **kwargs):
@@ -81,33 +84,39 @@ class Viewer(BaseModel):
 
     @torch.no_grad()
     def personalize(self, src_path, src_smpl=None, output_path='', visualizer=None):
+        src_info = self._cached_personalize(src_path, src_smpl)
+        self.src_info = src_info
 
-        ori_img = cv_utils.read_cv2_img(src_path)
+        if visualizer is not None:
+            visualizer.vis_named_img('src', src_info['img'])
+            visualizer.vis_named_img('bg', src_info['bg'])
+
+        if output_path:
+            cv_utils.save_cv2_img(src_info['image'], output_path, image_size=self._opt.image_size)
+
+    def _personalize(self, src_path, src_smpl=None):
+
+        ori_img = cv_utils.read_img(src_path)
 
         # resize image and convert the color space from [0, 255] to [-1, 1]
         img = cv_utils.transform_img(ori_img, self._opt.image_size, transpose=True) * 2 - 1.0
-        img = torch.tensor(img, dtype=torch.float32).cuda()[None, ...]
+        img = torch.tensor(img, dtype=torch.float32).to(self._device)[None, ...]
 
         if src_smpl is None:
             img_hmr = cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
-            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).cuda()[None, ...]
+            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).to(self._device)[None, ...]
             src_smpl = self.hmr(img_hmr)
         else:
-            src_smpl = torch.tensor(src_smpl, dtype=torch.float32).cuda()[None, ...]
+            src_smpl = torch.tensor(src_smpl, dtype=torch.float32).to(self._device)[None, ...]
 
         # source process, {'theta', 'cam', 'pose', 'shape', 'verts', 'j2d', 'j3d'}
         src_info = self.hmr.get_details(src_smpl)
-        src_f2verts, src_fim, src_wim = self.render.render_fim_wim(src_info['cam'], src_info['verts'])
-        # src_f2pts = src_f2verts[:, :, :, 0:2]
-        src_info['fim'] = src_fim
-        src_info['wim'] = src_wim
-        src_info['cond'], _ = self.render.encode_fim(src_info['cam'], src_info['verts'], fim=src_fim, transpose=True)
-        src_info['f2verts'] = src_f2verts
-        src_info['p2verts'] = src_f2verts[:, :, :, 0:2]
-        src_info['p2verts'][:, :, :, 1] *= -1
-
-        if self._opt.only_vis:
-            src_info['p2verts'] = self.render.get_vis_f2pts(src_info['p2verts'], src_fim)
+        # {'f2verts', 'p2verts', 'fim', 'wim', 'cond'} and the eroded background masks
+        plan = self.render.plan_warp(src_info['cam'], src_info['verts'], erode_ks=(self._opt.bg_ks, self._opt.ft_ks),
+                                     only_vis=self._opt.only_vis)
+        bg_erode, ft_erode = plan.pop('masks')
+        src_info.update(plan)
+
         # add image to source info
         src_info['img'] = img
         src_info['image'] = ori_img
@@ -117,7 +126,7 @@ class Viewer(BaseModel):
             bbox, body_mask = self.detector.inference(img[0])
             bg_mask = 1 - body_mask
         else:
-            bg_mask = util.morph(src_info['cond'][:, -1:, :, :], ks=self._opt.bg_ks, mode='erode')
+            bg_mask = bg_erode
             body_mask = 1 - bg_mask
 
         if self._opt.bg_model != 'ORIGINAL':
@@ -128,32 +137,26 @@ class Viewer(BaseModel):
             img_bg = self.bgnet(bg_inputs)
             src_info['bg'] = bg_inputs[:, 0:3] + img_bg * bg_inputs[:, -1:]
 
-        ft_mask = 1 - util.morph(src_info['cond'][:, -1:, :, :], ks=self._opt.ft_ks, mode='erode')
+        ft_mask = 1 - ft_erode
         src_inputs = torch.cat([img * ft_mask, src_info['cond']], dim=1)
 
         src_info['feats'] = self.generator.encode_src(src_inputs)
 
-        self.src_info = src_info
-
-        if visualizer is not None:
-            visualizer.vis_named_img('src', img)
-            visualizer.vis_named_img('bg', src_info['bg'])
-
-        if output_path:
-            cv_utils.save_cv2_img(src_info['image'], output_path, image_size=self._opt.image_size)
+        return src_info
 
     @torch.no_grad()
     def _extract_smpls(self, input_file):
-        img = cv_utils.read_cv2_img(input_file)
+        img = cv_utils.read_img(input_file)
         img = cv_utils.transform_img(img, image_size=224) * 2 - 1.0  # hmr receive [-1, 1]
         img = img.transpose((2, 0, 1))
-        img = torch.tensor(img, dtype=torch.float32).cuda()[None, ...]
+        img = torch.tensor(img, dtype=torch.float32).to(self._device)[None, ...]
         theta = self.hmr(img)[-1]
 
         return theta
 
     @torch.no_grad()
-    def inference(self, tgt_paths, tgt_smpls=None, cam_strategy='smooth', output_dir='', visualizer=None, verbose=True):
+    def inference(self, tgt_paths, tgt_smpls=None, cam_strategy='smooth', output_dir='', visualizer=None, verbose=True,
+                  to_uint8=False):
         length = len(tgt_paths)
 
         outputs = []
@@ -181,10 +184,10 @@ class Viewer(BaseModel):
 
             preds = preds[0].permute(1, 2, 0)
             preds = preds.cpu().numpy()
-            outputs.append(preds)
+            outputs.append(cv_utils.to_uint8_img(preds) if to_uint8 else preds)
 
             if output_dir:
-                filename = os.path.split(tgt_path)[-1]
+                filename = frame_name(tgt_path, t)
 
                 cv_utils.save_cv2_img(preds, os.path.join(output_dir, 'pred_' + filename), normalize=True)
                 cv_utils.save_cv2_img(self.tsf_info['image'], os.path.join(output_dir, 'gt_' + filename),
@@ -218,13 +221,13 @@ class Viewer(BaseModel):
         # get source info
         src_info = self.src_info
 
-        ori_img = cv_utils.read_cv2_img(tgt_path)
+        ori_img = cv_utils.read_img(tgt_path)
         if tgt_smpl is None:
             img_hmr = cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
-            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).cuda()[None, ...]
+            img_hmr = torch.tensor(img_hmr, dtype=torch.float32).to(self._device)[None, ...]
             tgt_smpl = self.hmr(img_hmr)
         else:
-            tgt_smpl = torch.tensor(tgt_smpl, dtype=torch.float32).cuda()[None, ...]
+            tgt_smpl = torch.tensor(tgt_smpl, dtype=torch.float32).to(self._device)[None, ...]
 
         if t == 0 and cam_strategy == 'smooth':
             self.first_cam = tgt_smpl[:, 0:3].clone()
@@ -234,23 +237,15 @@ class Viewer(BaseModel):
         # transfer process, {'theta', 'cam', 'pose', 'shape', 'verts', 'j2d', 'j3d'}
         tsf_info = self.hmr.get_details(tsf_smpl)
 
-        tsf_f2verts, tsf_fim, tsf_wim = self.render.render_fim_wim(tsf_info['cam'], tsf_info['verts'])
-        # src_f2pts = src_f2verts[:, :, :, 0:2]
-        tsf_info['fim'] = tsf_fim
-        tsf_info['wim'] = tsf_wim
-        tsf_info['cond'], _ = self.render.encode_fim(tsf_info['cam'], tsf_info['verts'], fim=tsf_fim, transpose=True)
-        # tsf_info['sil'] = util.morph((tsf_fim != -1).float(), ks=self._opt.ft_ks, mode='dilate')
-
-        T = self.render.cal_bc_transform(src_info['p2verts'], tsf_fim, tsf_wim)
-        tsf_img = F.grid_sample(src_info['img'], T)
-        tsf_inputs = torch.cat([tsf_img, tsf_info['cond']], dim=1)
+        # {'f2verts', 'p2verts', 'fim', 'wim', 'cond', 'T', 'tsf_img'}
+        tsf_info.update(self.render.plan_warp(tsf_info['cam'], tsf_info['verts'], src_f2pts=src_info['p2verts'],
+                                              src_img=src_info['img']))
+        tsf_inputs = torch.cat([tsf_info['tsf_img'], tsf_info['cond']], dim=1)
 
         # add target image to tsf info
-        tsf_info['tsf_img'] = tsf_img
         tsf_info['image'] = ori_img
-        tsf_info['T'] = T
 
-        self.T = T
+        self.T = tsf_info['T']
         self.tsf_info = tsf_info
 
         return tsf_inputs
@@ -264,8 +259,8 @@ class Viewer(BaseModel):
     def rotate_trans(self, rt, t, X):
         R = cv_utils.euler2matrix(rt)    # (3 x 3)
 
-        R = torch.FloatTensor(R)[None, :, :].cuda()
-        t = torch.FloatTensor(t)[None, None, :].cuda()
+        R = torch.FloatTensor(R)[None, :, :].to(self._device)
+        t = torch.FloatTensor(t)[None, None, :].to(self._device)
 
         # (bs, Nv, 3) + (bs, 1, 3)
         return torch.bmm(X, R) + t
@@ -276,11 +271,8 @@ class Viewer(BaseModel):
         src_mesh = self.src_info['verts']
         tsf_mesh = self.rotate_trans(rt, t, src_mesh)
 
-        tsf_f2verts, tsf_fim, tsf_wim = self.render.render_fim_wim(src_info['cam'], tsf_mesh)
-        tsf_cond, _ = self.render.encode_fim(src_info['cam'], tsf_mesh, fim=tsf_fim, transpose=True)
-
-        T = self.render.cal_bc_transform(src_info['p2verts'], tsf_fim, tsf_wim)
-        tsf_img = F.grid_sample(src_info['img'], T)
+        plan = self.render.plan_warp(src_info['cam'], tsf_mesh, src_f2pts=src_info['p2verts'], src_img=src_info['img'])
+        tsf_fim, tsf_cond, T, tsf_img = plan['fim'], plan['cond'], plan['T'], plan['tsf_img']
         tsf_inputs = torch.cat([tsf_img, tsf_cond], dim=1)
 
         if not self._opt.bg_replace:
@@ -320,19 +312,19 @@ class Viewer(BaseModel):
 
         @torch.no_grad()
         def set_gen_inputs(sample):
-            j2ds = sample['j2d'].cuda()  # (N, 4)
-            T = sample['T'].cuda()  # (N, h, w, 2)
-            T_cycle = sample['T_cycle'].cuda()  # (N, h, w, 2)
-            src_inputs = sample['src_inputs'].cuda()  # (N, 6, h, w)
-            tsf_inputs = sample['tsf_inputs'].cuda()  # (N, 6, h, w)
-            src_fim = sample['src_fim'].cuda()
-            tsf_fim = sample['tsf_fim'].cuda()
-            init_preds = sample['preds'].cuda()
+            j2ds = sample['j2d'].to(self._device)  # (N, 4)
+            T = sample['T'].to(self._device)  # (N, h, w, 2)
+            T_cycle = sample['T_cycle'].to(self._device)  # (N, h, w, 2)
+            src_inputs = sample['src_inputs'].to(self._device)  # (N, 6, h, w)
+            tsf_inputs = sample['tsf_inputs'].to(self._device)  # (N, 6, h, w)
+            src_fim = sample['src_fim'].to(self._device)
+            tsf_fim = sample['tsf_fim'].to(self._device)
+            init_preds = sample['preds'].to(self._device)
             images = sample['images']
-            images = torch.cat([images[:, 0, ...], images[:, 1, ...]], dim=0).cuda()  # (2N, 3, h, w)
+            images = torch.cat([images[:, 0, ...], images[:, 1, ...]], dim=0).to(self._device)  # (2N, 3, h, w)
             pseudo_masks = sample['pseudo_masks']
             pseudo_masks = torch.cat([pseudo_masks[:, 0, ...], pseudo_masks[:, 1, ...]],
-                                     dim=0).cuda()  # (2N, 1, h, w)
+                                     dim=0).to(self._device)  # (2N, 1, h, w)
 
             return src_fim, tsf_fim, j2ds, T, T_cycle, \
                    src_inputs, tsf_inputs, images, init_preds, pseudo_masks
@@ -378,7 +370,7 @@ class Viewer(BaseModel):
             return fake_src_imgs, fake_tsf_imgs, cycle_src_imgs, cycle_tsf_imgs, fake_src_mask, fake_tsf_mask
 
         def create_criterion():
-            face_criterion = FaceLoss(pretrained_path=self._opt.face_model).cuda()
+            face_criterion = FaceLoss(pretrained_path=self._opt.face_model).to(self._device)
             idt_criterion = torch.nn.L1Loss()
             mask_criterion = torch.nn.BCELoss()
 
@@ -10,6 +10,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
+from collections import OrderedDict
 
 from utils.util import load_pickle_file
 
@@ -282,27 +283,37 @@ class SMPL(nn.Module):
 
         self.register_buffer('joint_regressor', joint_regressor)
 
-    def forward(self, beta, theta, get_skin=False):
+        # cache of the shape-dependent terms (v_shaped, J) per beta, disabled by default.
+        self.shape_cache = None
+        self.shape_cache_size = 0
+
+        # sparse skinning table, built from self.weights on the first call of skinning.
+        self.skin_chunk = 1024
+        self._skin_table = None
+        self._skin_table_key = None
+
+    def set_shape_cache(self, enable=True, max_size=16):
         """
-        Obtain SMPL with shape (beta) & pose (theta) inputs.
-        Theta includes the global rotation.
-        Args:
-          beta: N x 10
-          theta: N x 72 (with 3-D axis-angle rep)
-          get_skin: boolean, return skin or not
+        Caches the shape-dependent terms (v_shaped, J) per beta, so that a sequence with a fixed identity only
+        runs the pose blend shapes and the skinning per frame. The cache is bypassed when gradients w.r.t beta
+        are required.
 
-        Updates:
-        self.J_transformed: N x 24 x 3 joint location after shaping
-                 & posing with beta and theta
-        Returns:
-          - joints: N x 19 or 14 x 3 joint locations depending on joint_type
-        If get_skin is True, also returns
-          - Verts: N x 6980 x 3
+        Args:
+            enable (bool): enable the cache or not, the cache is cleared in both cases.
+            max_size (int): the maximum number of betas kept in the cache (least recently used first out).
         """
-        device = beta.device
+        self.shape_cache = OrderedDict() if enable else None
+        self.shape_cache_size = max_size
 
-        num_batch = beta.shape[0]
+    def shape_blend(self, beta):
+        """
+        Args:
+            beta: N x 10
 
+        Returns:
+            v_shaped: N x 6890 x 3, vertices after the shape blend shapes.
+            J: N x 24 x 3, shape-dependent joint locations.
+        """
         # 1. Add shape blend shapes
         #       matmul  : (N, 10) x (10, 6890*3) = (N, 6890*3)
         #       reshape : (N, 6890*3) -> (N, 6890, 3)
@@ -318,7 +329,111 @@ class SMPL(nn.Module):
         Jz = torch.matmul(v_shaped[:, :, 2], self.J_regressor)
         J = torch.stack([Jx, Jy, Jz], dim=2)
 
-        # 3. Add pose blend shapes
+        return v_shaped, J
+
+    def cached_shape_blend(self, beta):
+        """
+        The same as shape_blend, but the terms of every distinct beta are looked up in (or added to) the cache.
+        If all the betas are the same, the outputs are expanded views of the cached (1, 6890, 3) and (1, 24, 3).
+
+        Args:
+            beta: N x 10
+
+        Returns:
+            v_shaped: N x 6890 x 3
+            J: N x 24 x 3
+        """
+        if self.shape_cache is None or (torch.is_grad_enabled() and beta.requires_grad):
+            return self.shape_blend(beta)
+
+        num_batch = beta.shape[0]
+        uniq_beta, inverse = torch.unique(beta.detach(), dim=0, return_inverse=True)
+
+        keys = [(str(beta.device), b.tobytes()) for b in uniq_beta.cpu().numpy()]
+        missing = [i for i, key in enumerate(keys) if key not in self.shape_cache]
+        if missing:
+            with torch.no_grad():
+                v_shaped, J = self.shape_blend(uniq_beta[missing])
+            for i, v, j in zip(missing, v_shaped, J):
+                self.shape_cache[keys[i]] = (v, j)
+
+        v_shaped, J = [], []
+        for key in keys:
+            self.shape_cache.move_to_end(key)
+            v_shaped.append(self.shape_cache[key][0])
+            J.append(self.shape_cache[key][1])
+
+        while len(self.shape_cache) > self.shape_cache_size:
+            self.shape_cache.popitem(last=False)
+
+        if len(keys) == 1:
+            v_shaped = v_shaped[0][None].expand(num_batch, -1, -1)
+            J = J[0][None].expand(num_batch, -1, -1)
+        else:
+            v_shaped = torch.stack(v_shaped)[inverse]
+            J = torch.stack(J)[inverse]
+
+        return v_shaped, J
+
+    def skin_table(self):
+        """
+        Top-k (index, weight) table of the LBS weights. Each vertex is bound to a few joints, and k is the maximum
+        number of non-zero weights of a vertex, so the table is exact.
+
+        Returns:
+            indices: (6890, k), long, the joint ids of each vertex.
+            weights: (6890, k), the weights of the joints.
+        """
+        key = (self.weights.device, self.weights.data_ptr(), self.weights._version)
+        if self._skin_table_key != key:
+            k = max(int((self.weights != 0).sum(dim=1).max()), 1)
+            weights, indices = torch.topk(self.weights, k, dim=1)
+            self._skin_table = (indices, weights)
+            self._skin_table_key = key
+
+        return self._skin_table
+
+    def skinning(self, A, v_posed):
+        """
+        Linear blend skinning with the sparse top-k table. The blended transforms are built and applied per chunk
+        of vertices, so the (N, 6890, 4, 4) transform stack is never materialized.
+
+        Args:
+            A: N x 24 x 4 x 4, relative joint transformations.
+            v_posed: N x 6890 x 3, vertices after the shape and pose blend shapes.
+
+        Returns:
+            verts: N x 6890 x 3
+        """
+        indices, weights = self.skin_table()
+
+        # the last row of A is always (0, 0, 0, 1), (N, 24, 3, 4)
+        A = A[:, :, :3, :]
+
+        verts = []
+        for start in range(0, v_posed.shape[1], self.skin_chunk):
+            end = start + self.skin_chunk
+            # (N, c, k, 3, 4) x (c, k, 1, 1) -> sum -> (N, c, 3, 4)
+            T = (A[:, indices[start:end]] * weights[start:end, :, None, None]).sum(dim=2)
+            # (N, c, 3, 3) x (N, c, 3, 1) + (N, c, 3) -> (N, c, 3)
+            v = torch.matmul(T[:, :, :, :3], v_posed[:, start:end, :, None])[:, :, :, 0] + T[:, :, :, 3]
+            verts.append(v)
+
+        return torch.cat(verts, dim=1)
+
+    def pose_blend(self, theta):
+        """
+        The pose-dependent terms, they do not depend on the shape and can be shared by several identities.
+
+        Args:
+            theta: N x 72
+
+        Returns:
+            Rs: N x 24 x 3 x 3, the rotations of the joints.
+            v_pose_offsets: N x 6890 x 3, the offsets of the pose blend shapes.
+        """
+        device = theta.device
+
         # ------- theta    : (N, 72)
         # ------- reshape  : (N*24, 3)
         # ------- rodrigues: (N*24, 9)
@@ -331,7 +446,37 @@ class SMPL(nn.Module):
         pose_feature = (Rs[:, 1:, :, :] - torch.eye(3).to(device)).view(-1, 207)
 
         # (N, 207) x (207, 6890*3) -> (N, 6890, 3)
-        v_posed = torch.matmul(pose_feature, self.posedirs).view(-1, self.size[0], self.size[1]) + v_shaped
+        v_pose_offsets = torch.matmul(pose_feature, self.posedirs).view(-1, self.size[0], self.size[1])
+
+        return Rs, v_pose_offsets
+
+    def forward(self, beta, theta, get_skin=False, pose_blend=None):
+        """
+        Obtain SMPL with shape (beta) & pose (theta) inputs.
+        Theta includes the global rotation.
+        Args:
+          beta: N x 10
+          theta: N x 72 (with 3-D axis-angle rep)
+          get_skin: boolean, return skin or not
+          pose_blend: (Rs, v_pose_offsets) of `pose_blend(theta)` if they are computed already, or None.
+
+        Updates:
+        self.J_transformed: N x 24 x 3 joint location after shaping
+                 & posing with beta and theta
+        Returns:
+          - joints: N x 19 or 14 x 3 joint locations depending on joint_type
+        If get_skin is True, also returns
+          - Verts: N x 6980 x 3
+        """
+        device = beta.device
+
+        # 1. Add shape blend shapes, v_shaped: (N, 6890, 3)
+        # 2. Infer shape-dependent joint locations, J: (N, 24, 3)
+        v_shaped, J = self.cached_shape_blend(beta)
+
+        # 3. Add pose blend shapes, Rs: (N, 24, 3, 3), v_posed: (N, 6890, 3)
+        Rs, v_pose_offsets = self.pose_blend(theta) if pose_blend is None else pose_blend
+        v_posed = v_pose_offsets + v_shaped
 
         # 4. Get the global joint location
         # ------- Rs is (N, 24, 3, 3),         J is (N, 24, 3)
@@ -339,29 +484,8 @@ class SMPL(nn.Module):
         J_transformed, A = batch_global_rigid_transformation(Rs, J, self.parents, device=device,
                                                              rotate_base=self.rotate)
 
-        # 5. Do skinning:
-        # ------- weights is (6890, 24)
-        # ---------- tile is (N*6890, 24)
-        # --- W = reshape is (N, 6890, 24)
-        W = self.weights.repeat(num_batch, 1).view(num_batch, -1, 24)
-
-        # ------ reshape A is (N, 24, 16)
-        # --------- matmul is (N, 6890, 24) x (N, 24, 16) -> (N, 6890, 16)
-        # -------- reshape is (N, 6890, 4, 4)
-        T = torch.matmul(W, A.view(num_batch, 24, 16)).view(num_batch, -1, 4, 4)
-
-        # axis is 2, (N, 6890, 3) concatenate (N, 6890, 1) -> (N, 6890, 4)
-        v_posed_homo = torch.cat(
-            [v_posed, torch.ones(num_batch, v_posed.shape[1], 1, dtype=torch.float32).to(device)], dim=2)
-
-        # -unsqueeze_ is (N, 6890, 4, 1)
-        # --------- T is (N, 6890, 4, 4)
-        # ---- matmul is (N, 6890, 4, 4) x (N, 6890, 4, 1) -> (N, 6890, 4, 1)
-        v_posed_homo = v_posed_homo.unsqueeze(-1)
-        v_homo = torch.matmul(T, v_posed_homo)
-
-        # (N, 6890, 3)
-        verts = v_homo[:, :, :3, 0]
+        # 5. Do skinning, verts: (N, 6890, 3)
+        verts = self.skinning(A, v_posed)
 
         # Get cocoplus or lsp joints: (N, 6890) x (6890, 19)
         joint_x = torch.matmul(verts[:, :, 0], self.joint_regressor)
@@ -33,6 +33,8 @@ class SEModule(nn.Module):
 
 class BasicBlock(nn.Module):
     expansion = 1
+    # the conv -> bn pairs of the forward, see `fold_batch_norms`.
+    fold_pairs = [('conv1', 'bn1'), ('conv2', 'bn2')]
 
     def __init__(self, inplanes, planes, stride=1, downsample=None):
         super(BasicBlock, self).__init__()
@@ -65,6 +67,8 @@ class BasicBlock(nn.Module):
 
 class Bottleneck(nn.Module):
     expansion = 4
+    # the conv -> bn pairs of the forward, see `fold_batch_norms`.
+    fold_pairs = [('conv1', 'bn1'), ('conv2', 'bn2'), ('conv3', 'bn3')]
 
     def __init__(self, inplanes, planes, stride=1, downsample=None):
         super(Bottleneck, self).__init__()
@@ -117,6 +121,8 @@ class Bottleneck(nn.Module):
 
 
 class SENet(nn.Module):
+    # the conv -> bn pairs of the forward, see `fold_batch_norms`.
+    fold_pairs = [('conv1', 'bn1')]
 
     def __init__(self, block, layers, num_classes=8631, include_top=True):
         self.inplanes = 64
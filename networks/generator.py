@@ -1,10 +1,16 @@
 import torch.nn as nn
 import torch.nn.functional as F
+from collections import namedtuple
 from .networks import NetworkBase
 import torch
 import ipdb
 
 
+# the flow of the pixels whose samples are not all zero, grid: (bs, 1, n, 2), index: (bs, n) in [0, h * w),
+# size: (h, w) of the flow, map_size: the smallest (h, w) of the feature maps it may warp.
+SparseFlow = namedtuple('SparseFlow', ['grid', 'index', 'size', 'map_size'])
+
+
 class ResidualBlock(nn.Module):
     """Residual Block."""
     def __init__(self, dim_in, dim_out):
@@ -215,21 +221,23 @@ class ImpersonatorGenerator(NetworkBase):
 
     def infer_front(self, src_inputs, tsf_inputs, T):
         # encoder
-        src_x = self.src_model.encoders[0](src_inputs)
+        src_encoder_outs = self.src_model.encode(src_inputs)
         tsf_x = self.tsf_model.encoders[0](tsf_inputs)
 
-        src_encoder_outs = [src_x]
+        # the flows of all the levels are interpolated once
+        pyramid = self.flow_pyramid(T, src_encoder_outs[1:])
+
         tsf_encoder_outs = [tsf_x]
         for i in range(1, self.n_down + 1):
-            src_x = self.src_model.encoders[i](src_x)
-            warp = self.transform(src_x, T)
+            src_x = src_encoder_outs[i]
+            warp = self.stn(src_x, self.level_flow(pyramid, src_x))
             tsf_x = self.tsf_model.encoders[i](tsf_x) + warp
 
-            src_encoder_outs.append(src_x)
             tsf_encoder_outs.append(tsf_x)
 
-        # resnets
-        T_scale = self.resize_trans(src_x, T)
+        # resnets, the same resolution as the last encoder
+        src_x = src_encoder_outs[-1]
+        T_scale = self.level_flow(pyramid, src_x)
         for i in range(self.repeat_num):
             src_x = self.src_model.resnets[i](src_x)
             warp = self.stn(src_x, T_scale)
@@ -243,6 +251,10 @@ class ImpersonatorGenerator(NetworkBase):
         return src_img, src_mask, tsf_img, tsf_mask
 
     def swap(self, tsf_inputs, src_encoder_outs12, src_encoder_outs21, src_resnet_outs12, src_resnet_outs21, T12, T21):
+        # the flows of all the levels are interpolated once
+        pyramid12 = self.flow_pyramid(T12, src_encoder_outs12[1:], sparse=True)
+        pyramid21 = self.flow_pyramid(T21, src_encoder_outs21[1:], sparse=True)
+
         # encoder
         src_x12 = src_encoder_outs12[0]
         src_x21 = src_encoder_outs21[0]
@@ -252,15 +264,15 @@ class ImpersonatorGenerator(NetworkBase):
         for i in range(1, self.n_down + 1):
             src_x12 = src_encoder_outs12[i]
             src_x21 = src_encoder_outs21[i]
-            warp12 = self.transform(src_x12, T12)
-            warp21 = self.transform(src_x21, T21)
+            warp12 = self.stn(src_x12, self.level_flow(pyramid12, src_x12))
+            warp21 = self.stn(src_x21, self.level_flow(pyramid21, src_x21))
 
             tsf_x = self.tsf_model.encoders[i](tsf_x) + warp12 + warp21
             tsf_encoder_outs.append(tsf_x)
 
         # resnets
-        T_scale12 = self.resize_trans(src_x12, T12)
-        T_scale21 = self.resize_trans(src_x21, T21)
+        T_scale12 = self.level_flow(pyramid12, src_x12)
+        T_scale21 = self.level_flow(pyramid21, src_x21)
         for i in range(self.repeat_num):
             src_x12 = src_resnet_outs12[i]
             src_x21 = src_resnet_outs21[i]
@@ -275,6 +287,16 @@ class ImpersonatorGenerator(NetworkBase):
         return tsf_img, tsf_mask
 
     def inference(self, src_encoder_outs, src_resnet_outs, tsf_inputs, T):
+        """
+        The target inputs and T may be a crop of the target frame (see `Imitator.forward`), whose sides are
+        multiples of 2 ** n_down, while the source features are the ones of the whole source image.
+        """
+        # the flows of all the levels are interpolated once, at the sizes of the target features,
+        # only the foreground pixels are warped. The source features they sample may be larger (roi mode).
+        sizes = self.level_sizes(T)
+        map_sizes = {size: tuple(x.shape[-2:]) for size, x in zip(sizes, src_encoder_outs[1:])}
+        pyramid = self.flow_pyramid(T, sizes, sparse=True, map_sizes=map_sizes)
+
         # encoder
         src_x = src_encoder_outs[0]
         tsf_x = self.tsf_model.encoders[0](tsf_inputs)
@@ -282,13 +304,14 @@ class ImpersonatorGenerator(NetworkBase):
         tsf_encoder_outs = [tsf_x]
         for i in range(1, self.n_down + 1):
             src_x = src_encoder_outs[i]
-            warp = self.transform(src_x, T)
+            tsf_x = self.tsf_model.encoders[i](tsf_x)
+            warp = self.stn(src_x, self.level_flow(pyramid, tsf_x))
 
-            tsf_x = self.tsf_model.encoders[i](tsf_x) + warp
+            tsf_x = tsf_x + warp
             tsf_encoder_outs.append(tsf_x)
 
         # resnets
-        T_scale = self.resize_trans(src_x, T)
+        T_scale = self.level_flow(pyramid, tsf_x)
         for i in range(self.repeat_num):
             src_x = src_resnet_outs[i]
             warp = self.stn(src_x, T_scale)
@@ -300,20 +323,142 @@ class ImpersonatorGenerator(NetworkBase):
         # print(front_rgb.shape, front_mask.shape)
         return tsf_img, tsf_mask
 
-    def resize_trans(self, x, T):
-        _, _, h, w = x.shape
+    def flow_pyramid(self, T, feats, sparse=False, map_sizes=None):
+        """
+        Interpolates the flow once for every resolution of the features, instead of once per warped feature map.
+        The flows are interpolated in NCHW and stored in the (bs, h_i, w_i, 2) layout of grid_sample.
+
+        Args:
+            T (torch.Tensor): (bs, h, w, 2)
+            feats (list of torch.Tensor or tuple): the features to warp, (bs, c, h_i, w_i), or their sizes.
+            sparse (bool): keep only the foreground pixels of the flows, see `sparse_flows`.
+            map_sizes (dict or None): {(h_i, w_i): (mh_i, mw_i)}, the sizes of the feature maps warped by the sparse
+                flows, if they differ from the sizes of the flows.
+
+        Returns:
+            pyramid (dict): {(h_i, w_i): (bs, h_i, w_i, 2) contiguous flow or SparseFlow}
+        """
+        T_chw = None
+        pyramid = dict()
+        for x in feats:
+            size = tuple(x.shape[-2:]) if torch.is_tensor(x) else tuple(x)
+            if size in pyramid:
+                continue
+
+            if size == tuple(T.shape[1:3]):
+                pyramid[size] = T.contiguous()
+                continue
+
+            if T_chw is None:
+                # the (bs, 2, h, w) view of T for F.interpolate, it is permuted once, not copied.
+                T_chw = T.permute(0, 3, 1, 2)
+
+            # every level is interpolated from T in NCHW, and copied back to the (bs, h_i, w_i, 2) layout of
+            # grid_sample once.
+            T_scale = F.interpolate(T_chw, size=size, mode='bilinear', align_corners=True)
+            pyramid[size] = T_scale.permute(0, 2, 3, 1).contiguous()  # (bs, h_i, w_i, 2)
+
+        if sparse:
+            sizes = list(pyramid.keys())
+            map_sizes = [size if map_sizes is None else map_sizes.get(size, size) for size in sizes]
+            flows = self.sparse_flows([pyramid[size] for size in sizes], map_sizes)
+            pyramid = dict(zip(sizes, flows))
+
+        return pyramid
+
+    @staticmethod
+    def sparse_flows(flows, map_sizes=None, max_ratio=0.75):
+        """
+        The background pixels of the flow are -2 (see `SMPLRenderer.cal_bc_transform`), all the bilinear taps
+        of their samples are out of the feature map, so their warped features are exactly 0. Only the pixels
+        whose samples may touch the feature map are kept, including the interpolated ones around the silhouette.
+
+        The culling bound depends on the size of the sampled feature map, not on the size of the flow, a sparse
+        flow may only warp the maps at least as large as its map_size (see `sparse_stn`). The numbers of kept pixels
+        of all the flows are read back to the host at once.
+
+        Args:
+            flows (list of torch.Tensor): (bs, h_i, w_i, 2)
+            map_sizes (list of tuple or None): the (mh_i, mw_i) of the feature maps warped by every flow, None for
+                the sizes of the flows.
+            max_ratio (float): keep the dense flow if more pixels are kept, the gathering does not pay off.
+
+        Returns:
+            sparse_flows (list of SparseFlow or torch.Tensor): the SparseFlow or the dense flow of every flow.
+        """
+        if map_sizes is None:
+            map_sizes = [tuple(T.shape[1:3]) for T in flows]
+
+        actives = []
+        for T, (mh, mw) in zip(flows, map_sizes):
+            bs, h, w = T.shape[0:3]
+
+            # the samples touch the map if |T| < 1 + 1 / mw (align_corners=False) or 1 + 2 / (mw - 1) (True).
+            bound = T.new_tensor([1 + 2.0 / max(mw - 1, 1), 1 + 2.0 / max(mh - 1, 1)])
+            actives.append((T.abs() < bound).all(dim=-1).view(bs, h * w))
+
+        counts = torch.stack([active.sum(dim=1).max() for active in actives]).tolist()
+
+        sparse_flows = []
+        for T, active, n, map_size in zip(flows, actives, counts, map_sizes):
+            bs, h, w = T.shape[0:3]
+            if n > max_ratio * h * w:
+                sparse_flows.append(T)
+                continue
+
+            # the n first pixels of every sample contain all its active pixels, the others sample zeros.
+            index = torch.topk(active.to(T.dtype), max(n, 1), dim=1, sorted=False)[1]
+            grid = torch.gather(T.view(bs, h * w, 2), 1, index[:, :, None].expand(-1, -1, 2))
+            sparse_flows.append(SparseFlow(grid=grid[:, None], index=index, size=(h, w), map_size=tuple(map_size)))
+
+        return sparse_flows
+
+    def level_sizes(self, T):
+        """
+        Returns:
+            sizes (list of tuple): the (h_i, w_i) of the features of the down-sampling levels of the flow T.
+        """
+        h, w = T.shape[1:3]
+        sizes = []
+        for i in range(self.n_down):
+            # the encoders are 3x3 convolutions with stride 2 and padding 1.
+            h, w = (h + 1) // 2, (w + 1) // 2
+            sizes.append((h, w))
+        return sizes
 
-        T_scale = T.permute(0, 3, 1, 2)  # (bs, 2, h, w)
-        T_scale = F.interpolate(T_scale, size=(h, w), mode='bilinear', align_corners=True)
-        T_scale = T_scale.permute(0, 2, 3, 1)  # (bs, h, w, 2)
+    def level_flow(self, pyramid, x):
+        return pyramid[tuple(x.shape[-2:])]
 
-        return T_scale
+    def resize_trans(self, x, T):
+        return self.level_flow(self.flow_pyramid(T, [x]), x)
 
     def stn(self, x, T):
+        if isinstance(T, SparseFlow):
+            return self.sparse_stn(x, T)
+
         x_trans = F.grid_sample(x, T)
 
         return x_trans
 
+    def sparse_stn(self, x, T):
+        """
+        Samples the pixels of the sparse flow and scatters them into zeros, the same as grid_sample with the
+        dense flow.
+        """
+        bs, c = x.shape[0:2]
+        h, w = T.size
+        n = T.index.shape[1]
+
+        # the dropped pixels only sample zeros from the maps at least as large as map_size.
+        assert x.shape[2] >= T.map_size[0] and x.shape[3] >= T.map_size[1], \
+            'the sparse flow is culled for {} maps, but warps a {} map.'.format(T.map_size, tuple(x.shape[2:]))
+
+        samples = F.grid_sample(x, T.grid).view(bs, c, n)   # (bs, c, 1, n) -> (bs, c, n)
+        x_trans = samples.new_zeros(bs, c, h * w)
+        x_trans.scatter_(2, T.index[:, None, :].expand(-1, c, -1), samples)
+
+        return x_trans.view(bs, c, h, w)
+
     def transform(self, x, T):
         T_scale = self.resize_trans(x, T)
         x_trans = self.stn(x, T_scale)
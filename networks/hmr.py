@@ -38,6 +38,8 @@ def subsample(inputs, factor):
 class PreActBlock(nn.Module):
     '''Pre-activation version of the BasicBlock.'''
     expansion = 1
+    # the conv -> bn pairs of the forward, see `fold_batch_norms`.
+    fold_pairs = [('conv1', 'bn2')]
 
     def __init__(self, in_planes, planes, stride=1):
         super(PreActBlock, self).__init__()
@@ -65,6 +67,8 @@ class PreActBlock(nn.Module):
 class PreActBottleneck(nn.Module):
     '''Pre-activation version of the original Bottleneck module.'''
     expansion = 4
+    # the conv -> bn pairs of the forward, see `fold_batch_norms`.
+    fold_pairs = [('conv1', 'bn2'), ('conv2', 'bn3')]
 
     def __init__(self, in_planes, planes, stride=1):
         super(PreActBottleneck, self).__init__()
@@ -299,13 +303,14 @@ class HumanModelRecovery(nn.Module):
 
         return thetas
 
-    def get_details(self, theta):
+    def get_details(self, theta, pose_blend=None):
         """
             purpose:
                 calc verts, joint2d, joint3d, Rotation matrix
 
             inputs:
                 theta: N X (3 + 72 + 10)
+                pose_blend: the pose-dependent terms of SMPL.pose_blend if they are computed already, or None.
 
             return:
                 thetas, verts, j2d, j3d, Rs
@@ -314,7 +319,7 @@ class HumanModelRecovery(nn.Module):
         cam = theta[:, 0:3].contiguous()
         pose = theta[:, 3:75].contiguous()
         shape = theta[:, 75:].contiguous()
-        verts, j3d, rs = self.smpl(beta=shape, theta=pose, get_skin=True)
+        verts, j3d, rs = self.smpl(beta=shape, theta=pose, get_skin=True, pose_blend=pose_blend)
         j2d = batch_orth_proj_idrot(j3d, cam)
 
         detail_info = {
@@ -5,6 +5,7 @@ from torchvision import models
 import functools
 from .hmr import HumanModelRecovery
 from .facenet import Sphere20a, senet50
+from utils.fold_bn import fold_batch_norms
 
 
 class NetworksFactory(object):
@@ -172,7 +173,7 @@ class VGGLoss(nn.Module):
     def __init__(self, vgg=None, before_relu=False):
         super(VGGLoss, self).__init__()
         if vgg is None:
-            self.vgg = Vgg19(before_relu=before_relu).cuda()
+            self.vgg = Vgg19(before_relu=before_relu)
         else:
             self.vgg = vgg
         self.criterion = nn.L1Loss()
@@ -203,7 +204,7 @@ class HMRLoss(nn.Module):
         return loss
 
     def load_model(self, pretrain_model):
-        saved_data = torch.load(pretrain_model)
+        saved_data = torch.load(pretrain_model, map_location='cpu')
         self.hmr.load_state_dict(saved_data)
         print('load hmr model from {}'.format(pretrain_model))
 
@@ -221,6 +222,8 @@ class FaceLoss(nn.Module):
             self.height, self.width = 112, 96
 
         self.net.eval()
+        # Sphere20a has no BatchNorm layer, only SENet is folded.
+        fold_batch_norms(self.net)
         self.criterion = nn.L1Loss()
         self.weights = [1.0 / 32, 1.0 / 16, 1.0 / 8, 1.0 / 4, 1.0]
 
@@ -385,7 +388,7 @@ class FaceLoss(nn.Module):
         print('load face model from {}'.format(pretrain_model))
 
     def load_sphere_model(self, pretrain_model):
-        saved_data = torch.load(pretrain_model)
+        saved_data = torch.load(pretrain_model, map_location='cpu')
         save_weights_dict = dict()
 
         for key, val in saved_data.items():
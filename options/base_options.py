@@ -43,6 +43,15 @@ class BaseOptions(object):
         self._parser.add_argument('--repeat_num', type=int, default=6, help='number of residual blocks.')
         self._parser.add_argument('--cond_nc', type=int, default=3, help='# of conditions')
         self._parser.add_argument('--gpu_ids', type=str, default='0', help='gpu ids: e.g. 0  0,1,2, 0,2. use -1 for CPU')
+        self._parser.add_argument('--device', type=str, default='auto', choices=['auto', 'cuda', 'cpu'],
+                                  help='device of the models, auto uses cuda if it is available and gpu_ids is not -1.')
+        self._parser.add_argument('--num_threads', type=int, default=0,
+                                  help='# intra-op threads of torch on cpu, 0 keeps the default of torch.')
+        self._parser.add_argument('--num_interop_threads', type=int, default=0,
+                                  help='# inter-op threads of torch on cpu, 0 keeps the default of torch.')
+        self._parser.add_argument('--rasterizer', type=str, default='auto', choices=['auto', 'cuda', 'cpu'],
+                                  help='rasterizer backend of fim/wim, auto uses cuda if neural_renderer is built '
+                                       'with cuda and the renderer is on gpu, otherwise the pure pytorch cpu one.')
         self._parser.add_argument('--model', type=str, default='impersonator', help='model to run')
         self._parser.add_argument('--name', type=str, default='running',
                                   help='name of the experiment. It decides where to store samples and models')
@@ -86,6 +95,9 @@ class BaseOptions(object):
         # get and set gpus
         self._get_set_gpus()
 
+        # resolve the device and set the threads of torch
+        self._set_device_and_threads()
+
         args = vars(self._opt)
 
         # print in terminal args
@@ -124,6 +136,22 @@ class BaseOptions(object):
         else:
             os.environ['CUDA_VISIBLE_DEVICES'] = '0'
 
+    def _set_device_and_threads(self):
+        import torch
+
+        if self._opt.device == 'auto':
+            use_cuda = self._opt.gpu_ids != '-1' and torch.cuda.is_available()
+            self._opt.device = 'cuda' if use_cuda else 'cpu'
+        elif self._opt.device == 'cuda':
+            assert self._opt.gpu_ids != '-1', '--device cuda conflicts with --gpu_ids -1'
+
+        if self._opt.num_threads > 0:
+            torch.set_num_threads(self._opt.num_threads)
+
+        # it must be set before any inter-op parallel work has started.
+        if self._opt.num_interop_threads > 0:
+            torch.set_num_interop_threads(self._opt.num_interop_threads)
+
     def _print(self, args):
         print('------------ Options -------------')
         for k, v in sorted(args.items()):
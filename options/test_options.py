@@ -7,7 +7,11 @@ class TestOptions(BaseOptions):
         self._parser.add_argument('--output_dir', type=str, default='./outputs/results/',
                                   help='output directory to save the results')
         self._parser.add_argument('--src_path', type=str, default='', help='source image path')
-        self._parser.add_argument('--tgt_path', type=str, default='', help='target image path')
+        self._parser.add_argument('--tgt_path', type=str, default='',
+                                  help='target image path, a folder of frames or a video (decoded on the fly).')
+        self._parser.add_argument('--decode_size', type=int, default=0,
+                                  help='decode the target video at a reduced resolution, whose longer side is at most '
+                                       'decode_size, 0 to keep the original resolution.')
         self._parser.add_argument('--pri_path', type=str, default='./assets/samples/A_priors/imgs',
                                   help='prior image path')
 
@@ -26,11 +30,41 @@ class TestOptions(BaseOptions):
                                   help='use the body segmentation estimated by mask rcnn.')
         self._parser.add_argument('--front_warp', action="store_true", default=False, help='front warp or not')
         self._parser.add_argument('--post_tune', action="store_true", default=False, help='post tune or not')
+        self._parser.add_argument('--src_cache_dir', type=str, default='',
+                                  help='folder of the on-disk cache of the personalized sources, empty to disable it.')
+        self._parser.add_argument('--src_cache_size', type=float, default=10.0,
+                                  help='maximum size (GB) of the source cache, least recently used entries are evicted.')
+
+        self._parser.add_argument('--roi', action='store_true', default=False,
+                                  help='run the generator on the crop of the target body bounding box, and composite '
+                                       'it onto the inpainted background, for large image_size.')
+        self._parser.add_argument('--roi_pad', type=int, default=32,
+                                  help='the padding (pixels) of the body bounding box in the roi mode.')
+
+        # int8 inference on cpu
+        self._parser.add_argument('--quantize', action='store_true', default=False,
+                                  help='quantize the generator, hmr and the inpaintor to int8, only with --device cpu '
+                                       'and torch >= 1.13.')
+        self._parser.add_argument('--quant_frames', type=int, default=8,
+                                  help='# prior frames to calibrate the int8 layers, and as many to measure the drift.')
+        self._parser.add_argument('--quant_min_psnr', type=float, default=30.0,
+                                  help='fall back to fp32 if the PSNR of the int8 outputs against fp32 is lower.')
 
         # Human motion imitation
         self._parser.add_argument('--cam_strategy', type=str, default='smooth', choices=['smooth', 'source', 'copy'],
                                   help='the strategy to control the camera pameters (s, x, y) '
                                        'betwwen the source and reference image.')
+        self._parser.add_argument('--key_pose_thresh', type=float, default=0.0,
+                                  help='keyframe mode, the generator only runs on the frames whose pose differs from '
+                                       'the last keyframe by more than it (radians), the other frames are warped '
+                                       'from their keyframes. 0 to run the generator on every frame.')
+        self._parser.add_argument('--key_cam_thresh', type=float, default=0.01,
+                                  help='the camera (s, x, y) difference from the last keyframe to run the generator.')
+        self._parser.add_argument('--incremental_raster', action='store_true', default=False,
+                                  help='rasterize the target meshes incrementally, only the screen tiles touched by '
+                                       'the faces moved since the previous frame are rasterized again, by the pytorch '
+                                       'tile rasterizer on any device. It pays off for the frames of one reference '
+                                       'in order.')
 
         # Human appearance transfer
         self._parser.add_argument('--swap_part', type=str, default='body', help='part to swap')
@@ -43,6 +77,16 @@ class TestOptions(BaseOptions):
         self._parser.add_argument('--ip', type=str, default='', help='visdom ip')
         self._parser.add_argument('--port', type=int, default=31100, help='visdom port')
 
+        # inference service
+        self._parser.add_argument('--service_host', type=str, default='127.0.0.1', help='host of the service.')
+        self._parser.add_argument('--service_port', type=int, default=8800, help='port of the service.')
+        self._parser.add_argument('--service_socket', type=str, default='',
+                                  help='unix socket of the service, if it is set, host and port are ignored.')
+        self._parser.add_argument('--max_batch', type=int, default=8,
+                                  help='maximum number of frames of a shared generator batch of the service.')
+        self._parser.add_argument('--max_latency', type=float, default=0.05,
+                                  help='maximum waiting time (seconds) to fill a generator batch of the service.')
+
         # save results or not
         self._parser.add_argument('--save_res', action='store_true', default=False,
                                   help='save images or not, if true, the results are saved in `${output_dir}/preds`.')
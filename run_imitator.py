@@ -9,6 +9,8 @@ from data.dataset import PairSampleDataset
 from models.imitator import Imitator
 from options.test_options import TestOptions
 from utils.visdom_visualizer import VisdomVisualizer
+from utils.pipeline import ImitatorPipeline
+from utils.video import VideoReader, is_video_file
 from utils.util import load_pickle_file, write_pickle_file, mkdirs, mkdir, clear_dir
 import utils.cv_utils as cv_utils
 
@@ -37,11 +39,9 @@ def write_pair_info(src_info, tsf_info, out_file, imitator, only_vis):
     pair_data['smpls'] = torch.cat([src_info['theta'], tsf_info['theta']], dim=0).cpu().numpy()
     pair_data['j2d'] = torch.cat([src_info['j2d'], tsf_info['j2d']], dim=0).cpu().numpy()
 
-    tsf_f2verts, tsf_fim, tsf_wim = imitator.render.render_fim_wim(tsf_info['cam'], tsf_info['verts'])
-    tsf_p2verts = tsf_f2verts[:, :, :, 0:2]
-    tsf_p2verts[:, :, :, 1] *= -1
-
-    T_cycle = imitator.render.cal_bc_transform(tsf_p2verts, src_info['fim'], src_info['wim'])
+    # the warp from the transferred mesh back to the source one, without rendering them again.
+    T_cycle = imitator.render.plan_warp(src_info['cam'], src_info['verts'], src_f2pts=tsf_info['p2verts'],
+                                        rendered=(src_info['f2verts'], src_info['fim'], src_info['wim']))['T']
     pair_data['T_cycle'] = T_cycle[0].cpu().numpy()
 
     # back_face_ids = mesh.get_part_face_ids(part_type='head_back')
@@ -55,11 +55,14 @@ def write_pair_info(src_info, tsf_info, out_file, imitator, only_vis):
     write_pickle_file(out_file, pair_data)
 
 
-def scan_tgt_paths(tgt_path, itv=20):
+def scan_tgt_paths(tgt_path, itv=20, max_size=0):
     if os.path.isdir(tgt_path):
         all_tgt_paths = glob.glob(os.path.join(tgt_path, '*'))
         all_tgt_paths.sort()
         all_tgt_paths = all_tgt_paths[::itv]
+    elif is_video_file(tgt_path):
+        # the frames are decoded lazily, without extracting them to the disk.
+        all_tgt_paths = VideoReader(tgt_path, itv=itv, max_size=max_size)
     else:
         all_tgt_paths = [tgt_path]
 
@@ -74,6 +77,10 @@ def meta_imitate(opt, imitator, prior_tgt_path, save_imgs=True, visualizer=None)
 
     out_img_dir, out_pair_dir = mkdirs([os.path.join(output_dir, 'imgs'), os.path.join(output_dir, 'pairs')])
 
+    if isinstance(all_tgt_paths, VideoReader):
+        # the pairs refer to the prior frames by path, only the sampled frames are saved.
+        all_tgt_paths = all_tgt_paths.save_frames(out_img_dir)
+
     img_pair_list = []
 
     for t in tqdm(range(len(all_tgt_paths))):
@@ -229,6 +236,17 @@ if __name__ == "__main__":
     imitator.personalize(test_opt.src_path, visualizer=visualizer)
     print('\n\t\t\tPersonalization: completed...')
 
+    if test_opt.quantize:
+        # the prior frames are split into the calibration frames and the frames to measure the drift.
+        prior_paths = scan_tgt_paths(test_opt.pri_path, itv=20, max_size=test_opt.decode_size)
+        if isinstance(prior_paths, VideoReader):
+            prior_paths = prior_paths.save_frames(mkdir(os.path.join(test_opt.output_dir, 'quant_frames')))
+
+        num = test_opt.quant_frames
+        imitator.quantize(test_opt.src_path, calib_paths=prior_paths[0::2][:num], guard_paths=prior_paths[1::2][:num],
+                          min_psnr=test_opt.quant_min_psnr, batch_size=test_opt.batch_size)
+        print('\n\t\t\tQuantization: completed...')
+
     if test_opt.save_res:
         pred_output_dir = mkdir(os.path.join(test_opt.output_dir, 'imitators'))
         pred_output_dir = clear_dir(pred_output_dir)
@@ -236,9 +254,11 @@ if __name__ == "__main__":
         pred_output_dir = None
 
     print('\n\t\t\tImitating `{}`'.format(test_opt.tgt_path))
-    tgt_paths = scan_tgt_paths(test_opt.tgt_path, itv=1)
-    imitator.inference(tgt_paths, tgt_smpls=None, cam_strategy='smooth',
-                       output_dir=pred_output_dir, visualizer=visualizer, verbose=True)
+    tgt_paths = scan_tgt_paths(test_opt.tgt_path, itv=1, max_size=test_opt.decode_size)
+    pipeline = ImitatorPipeline(imitator, batch_size=test_opt.batch_size,
+                                num_readers=test_opt.n_threads_test, num_writers=test_opt.n_threads_test)
+    pipeline.run(tgt_paths, tgt_smpls=None, cam_strategy='smooth',
+                 output_dir=pred_output_dir, visualizer=visualizer, verbose=True)
 
 
 
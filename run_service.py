@@ -0,0 +1,27 @@
+from models.imitator import Imitator
+from options.test_options import TestOptions
+from utils.service import ImitationService, make_server
+
+
+if __name__ == "__main__":
+    opt = TestOptions().parse()
+
+    # the imitator is loaded once and kept warm, sources are personalized on demand.
+    imitator = Imitator(opt)
+
+    service = ImitationService(imitator, max_batch=opt.max_batch, max_latency=opt.max_latency)
+    service.start()
+
+    server = make_server(service, host=opt.service_host, port=opt.service_port, unix_socket=opt.service_socket)
+    if opt.service_socket:
+        print('\n\t\t\tServing on unix socket {}'.format(opt.service_socket))
+    else:
+        print('\n\t\t\tServing on http://{}:{}'.format(opt.service_host, opt.service_port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
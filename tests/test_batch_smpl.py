@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.sparse
+import torch
+
+from networks.batch_smpl import SMPL, batch_global_rigid_transformation
+from utils.util import write_pickle_file
+
+# the kinematic tree of SMPL, -1 for the root.
+PARENTS = [-1, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9, 9, 12, 13, 14, 16, 17, 18, 19, 20, 21]
+
+
+def create_smpl_params(num_verts=500, num_betas=10, seed=0):
+    """A random SMPL model with the layout of the official pickle, every vertex is bound to 1 ~ 4 joints."""
+    rng = np.random.RandomState(seed)
+
+    weights = np.zeros((num_verts, 24), dtype=np.float32)
+    for v in range(num_verts):
+        joints = rng.choice(24, rng.randint(1, 5), replace=False)
+        weights[v, joints] = rng.rand(len(joints)) + 0.1
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    J_regressor = rng.rand(24, num_verts) * (rng.rand(24, num_verts) < 0.05)
+    J_regressor /= J_regressor.sum(axis=1, keepdims=True) + 1e-8
+
+    return {
+        'f': rng.randint(0, num_verts, (num_verts * 2, 3)),
+        'v_template': rng.randn(num_verts, 3).astype(np.float32),
+        'shapedirs': rng.randn(num_verts, 3, num_betas).astype(np.float32) * 0.01,
+        'J_regressor': scipy.sparse.csc_matrix(J_regressor),
+        'posedirs': rng.randn(num_verts, 3, 207).astype(np.float32) * 0.01,
+        'kintree_table': np.array([PARENTS, list(range(24))], dtype=np.int64),
+        'weights': weights,
+        'cocoplus_regressor': scipy.sparse.csc_matrix(rng.rand(19, num_verts) / num_verts)
+    }
+
+
+class TestSMPL(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        pkl_path = os.path.join(self.tmp_dir, 'smpl_model.pkl')
+        write_pickle_file(pkl_path, create_smpl_params())
+        self.smpl = SMPL(pkl_path)
+
+        rng = np.random.RandomState(1)
+        self.theta = torch.tensor(rng.randn(4, 72) * 0.3, dtype=torch.float32)
+        self.beta = torch.tensor(rng.randn(4, 10), dtype=torch.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_shape_cache(self):
+        """The outputs with the shape cache equal the uncached ones, for distinct, repeated and equal betas."""
+
+        betas = [self.beta, self.beta[[0, 1, 0, 1]], self.beta[0:1].expand(4, -1)]
+
+        with torch.no_grad():
+            self.smpl.set_shape_cache(False)
+            uncached = [self.smpl(beta, self.theta, get_skin=True) for beta in betas]
+
+            self.smpl.set_shape_cache(True, max_size=2)
+            for _ in range(2):
+                # the second round hits the cache.
+                for beta, ref in zip(betas, uncached):
+                    outs = self.smpl(beta, self.theta, get_skin=True)
+                    for out, ref_out in zip(outs, ref):
+                        self.assertTrue(torch.allclose(out, ref_out, atol=1e-6))
+
+        self.assertLessEqual(len(self.smpl.shape_cache), 2)
+
+    def test_shape_cache_grad(self):
+        """The cache is bypassed when beta requires grad."""
+
+        self.smpl.set_shape_cache(True)
+        beta = self.beta.clone().requires_grad_()
+        verts, _, _ = self.smpl(beta, self.theta, get_skin=True)
+        verts.sum().backward()
+
+        self.assertIsNotNone(beta.grad)
+        self.assertEqual(len(self.smpl.shape_cache), 0)
+
+    def test_sparse_skinning(self):
+        """The top-k sparse skinning equals the dense W x A skinning, also across the vertex chunks."""
+
+        smpl = self.smpl
+        smpl.skin_chunk = 64
+
+        indices, weights = smpl.skin_table()
+        self.assertEqual(indices.shape[1], 4)
+
+        num_batch = self.beta.shape[0]
+        with torch.no_grad():
+            v_shaped, J = smpl.shape_blend(self.beta)
+            Rs, v_pose_offsets = smpl.pose_blend(self.theta)
+            v_posed = v_shaped + v_pose_offsets
+            _, A = batch_global_rigid_transformation(Rs, J, smpl.parents)
+
+            verts = smpl.skinning(A, v_posed)
+
+            # the dense skinning, (N, 6890, 24) x (N, 24, 16) -> (N, 6890, 4, 4)
+            W = smpl.weights.repeat(num_batch, 1).view(num_batch, -1, 24)
+            T = torch.matmul(W, A.view(num_batch, 24, 16)).view(num_batch, -1, 4, 4)
+            v_posed_homo = torch.cat([v_posed, torch.ones(num_batch, v_posed.shape[1], 1)], dim=2)
+            dense_verts = torch.matmul(T, v_posed_homo.unsqueeze(-1))[:, :, :3, 0]
+
+        self.assertTrue(torch.allclose(verts, dense_verts, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
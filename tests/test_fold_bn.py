@@ -0,0 +1,88 @@
+import os
+import unittest
+
+import torch
+import torch.nn as nn
+
+from networks.hmr import PreActBottleneck
+from utils.fold_bn import FX_AVAILABLE, fold_batch_norms
+
+root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def randomize_batch_norms(model):
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-1, 1)
+            module.running_var.uniform_(0.5, 2)
+            module.weight.data.uniform_(0.5, 2)
+            module.bias.data.uniform_(-1, 1)
+    return model.eval()
+
+
+class TestFoldBN(unittest.TestCase):
+    def test_shared_copy(self):
+        """The copy of his_evaluators is identical."""
+
+        paths = [os.path.join(root_dir, 'utils', 'fold_bn.py'),
+                 os.path.join(root_dir, 'thirdparty', 'his_evaluators', 'his_evaluators', 'utils', 'fold_bn.py')]
+        contents = []
+        for path in paths:
+            with open(path) as f:
+                contents.append(f.read())
+
+        self.assertEqual(contents[0], contents[1])
+
+    def test_structural(self):
+        """The declared pairs of PreActBottleneck and the conv -> bn of nn.Sequential are folded without torch.fx."""
+
+        torch.manual_seed(0)
+        model = randomize_batch_norms(nn.Sequential(
+            nn.Conv2d(3, 16, 3, padding=1), nn.BatchNorm2d(16), nn.ReLU(),
+            PreActBottleneck(16, 8, stride=2)))
+
+        x = torch.randn(2, 3, 16, 16)
+        with torch.no_grad():
+            ref = model(x)
+            num_folded = fold_batch_norms(model)
+            out = model(x)
+
+        self.assertEqual(num_folded, 3)
+        self.assertIsInstance(model[1], nn.Identity)
+        self.assertIsInstance(model[3].bn1, nn.BatchNorm2d)
+        self.assertIsInstance(model[3].bn2, nn.Identity)
+        self.assertIsInstance(model[3].bn3, nn.Identity)
+        self.assertTrue(torch.allclose(out, ref, atol=1e-5))
+
+    @unittest.skipUnless(FX_AVAILABLE, 'folding the undeclared pairs requires torch.fx')
+    def test_traced(self):
+        """The conv -> bn pairs of a traced forward are folded, the pre-activation bn -> relu -> conv is not."""
+
+        class Block(nn.Module):
+            def __init__(self):
+                super(Block, self).__init__()
+                self.conv1 = nn.Conv2d(3, 8, 3, padding=1)
+                self.bn1 = nn.BatchNorm2d(8)
+                self.bn2 = nn.BatchNorm2d(8)
+                self.conv2 = nn.Conv2d(8, 8, 3, padding=1)
+
+            def forward(self, x):
+                return self.conv2(torch.relu(self.bn2(torch.relu(self.bn1(self.conv1(x))))))
+
+        torch.manual_seed(0)
+        model = randomize_batch_norms(Block())
+
+        x = torch.randn(2, 3, 16, 16)
+        with torch.no_grad():
+            ref = model(x)
+            num_folded = fold_batch_norms(model)
+            out = model(x)
+
+        self.assertEqual(num_folded, 1)
+        self.assertIsInstance(model.bn1, nn.Identity)
+        self.assertIsInstance(model.bn2, nn.BatchNorm2d)
+        self.assertTrue(torch.allclose(out, ref, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
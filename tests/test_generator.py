@@ -0,0 +1,71 @@
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from networks.generator import ImpersonatorGenerator, SparseFlow
+
+
+class TestSparseFlow(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.generator = ImpersonatorGenerator(bg_dim=4, src_dim=6, tsf_dim=6, conv_dim=8, repeat_num=1).eval()
+
+        # the background is -2, the foregrounds are two boxes of different sizes, some of their samples are
+        # slightly out of [-1, 1].
+        T = torch.full((2, 64, 64, 2), -2.)
+        T[0, 10:40, 20:50] = torch.rand(30, 30, 2) * 2.2 - 1.1
+        T[1, 30:38, 5:21] = torch.rand(8, 16, 2) * 2.2 - 1.1
+        self.T = T
+
+    def test_sparse_equals_dense(self):
+        """The warped features of the sparse flows equal the ones of grid_sample with the dense flows."""
+
+        sizes = self.generator.level_sizes(self.T) + [tuple(self.T.shape[1:3])]
+        dense = self.generator.flow_pyramid(self.T, sizes)
+        sparse = self.generator.flow_pyramid(self.T, sizes, sparse=True)
+
+        self.assertEqual(set(dense.keys()), set(sparse.keys()))
+        self.assertTrue(any(isinstance(flow, SparseFlow) for flow in sparse.values()))
+
+        for size in sizes:
+            x = torch.randn(2, 5, *size)
+            with torch.no_grad():
+                ref = F.grid_sample(x, dense[size])
+                out = self.generator.stn(x, sparse[size])
+
+            self.assertEqual(out.shape, ref.shape)
+            self.assertTrue(torch.allclose(out, ref, atol=1e-6))
+
+    def test_larger_maps(self):
+        """The sparse flows culled for larger maps (roi mode) warp them like the dense ones, not the smaller maps."""
+
+        sizes = self.generator.level_sizes(self.T)
+        map_sizes = {size: (size[0] * 2, size[1] * 2) for size in sizes}
+        dense = self.generator.flow_pyramid(self.T, sizes)
+        sparse = self.generator.flow_pyramid(self.T, sizes, sparse=True, map_sizes=map_sizes)
+
+        for size in sizes:
+            x = torch.randn(2, 5, *map_sizes[size])
+            with torch.no_grad():
+                ref = F.grid_sample(x, dense[size])
+                out = self.generator.stn(x, sparse[size])
+            self.assertTrue(torch.allclose(out, ref, atol=1e-6))
+
+            if isinstance(sparse[size], SparseFlow):
+                with self.assertRaises(AssertionError):
+                    self.generator.stn(torch.randn(2, 5, size[0] // 2, size[1] // 2), sparse[size])
+
+    def test_dense_fallback(self):
+        """A flow whose pixels are almost all foreground stays dense."""
+
+        T = torch.rand(2, 32, 32, 2) * 2 - 1
+        T[:, 0, 0] = -2
+        flows = self.generator.sparse_flows([T, self.T])
+
+        self.assertIs(flows[0], T)
+        self.assertIsInstance(flows[1], SparseFlow)
+
+
+if __name__ == '__main__':
+    unittest.main()
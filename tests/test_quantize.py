@@ -0,0 +1,35 @@
+import unittest
+
+import torch
+import torch.nn as nn
+
+from utils.quantize import check_quantization, get_submodule, set_submodule
+
+
+class TestQuantize(unittest.TestCase):
+    def test_check_quantization(self):
+        """It returns if torch.ao.quantization is available, otherwise it raises a RuntimeError naming torch."""
+
+        try:
+            import torch.ao.quantization
+            available = True
+        except ImportError:
+            available = False
+
+        if available:
+            self.assertIsNone(check_quantization())
+        else:
+            with self.assertRaises(RuntimeError) as context:
+                check_quantization()
+            self.assertIn(torch.__version__, str(context.exception))
+
+    def test_submodule(self):
+        model = nn.Sequential(nn.Sequential(nn.Conv2d(3, 3, 1), nn.ReLU()))
+        self.assertIs(get_submodule(model, '0.1'), model[0][1])
+
+        set_submodule(model, '0.1', nn.Identity())
+        self.assertIsInstance(model[0][1], nn.Identity)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import unittest
+from unittest import mock
+
+import torch
+
+from utils.service import ImitationJob, ImitationService
+
+
+class StubImitator(object):
+    """
+    The interface of Imitator used by ImitationService. The prediction of the frame t of the source s is
+    (1000 * s + t, s, s), the first channel comes from the transferred inputs, the others from the source
+    background and the source features, so that a frame mixed up with another job is detected.
+    """
+
+    def __init__(self, fail_src=None):
+        self.src_info = None
+        self.tsf_info = None
+        self.first_cam = None
+        self.fail_src = fail_src
+        self.batch_sizes = []
+        self.batch_sources = []
+
+    def _cached_personalize(self, src_path, src_smpl=None):
+        s = float(src_path.split('_')[-1])
+        feat = torch.full((1, 1, 2, 2), s)
+        return {'id': s, 'feats': ([feat], [feat]), 'bg': torch.full((1, 1, 2, 2), s)}
+
+    def transfer_params_batch(self, tgt_paths, tgt_smpls=None, cam_strategy='smooth', t=0):
+        s = self.src_info['id']
+        if s == self.fail_src:
+            raise ValueError('the frames of source {} can not be read.'.format(s))
+
+        frames = [float(os.path.splitext(os.path.basename(path))[0]) for path in tgt_paths]
+        self.tsf_info = {'T': torch.zeros(len(frames), 2, 2, 2), 'fim': torch.zeros(len(frames), 2, 2),
+                         'tsf_img': torch.zeros(len(frames), 3, 2, 2)}
+        self.batch_sources.append(s)
+        return torch.tensor([1000 * s + frame for frame in frames]).view(-1, 1, 1, 1).expand(-1, 1, 2, 2)
+
+    def forward(self, tsf_inputs, T, src_feats=None, bg_img=None):
+        self.batch_sizes.append(len(tsf_inputs))
+        return torch.cat([tsf_inputs, bg_img, src_feats[0][0]], dim=1)
+
+
+class TestImitationService(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict()
+
+        def save_cv2_img(img, path, normalize=False):
+            self.saved[path] = img.copy()
+
+        self.patch = mock.patch('utils.service.cv_utils.save_cv2_img', side_effect=save_cv2_img)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    @staticmethod
+    def create_job(s, num_frames):
+        tgt_paths = ['/frames/%.8d.jpg' % t for t in range(num_frames)]
+        return ImitationJob('src_%d' % s, tgt_paths, output_dir='/outputs/%d' % s)
+
+    def check_outputs(self, job, s):
+        self.assertIsNone(job.error)
+        self.assertEqual(job.outputs, ['/outputs/%d/pred_%.8d.jpg' % (s, t) for t in range(len(job.tgt_paths))])
+        for t, path in enumerate(job.outputs):
+            pred = self.saved[path]
+            self.assertTrue((pred[:, :, 0] == 1000 * s + t).all())
+            self.assertTrue((pred[:, :, 1:] == s).all())
+
+    def test_coalesce(self):
+        """The frames of concurrent jobs share batches of at most max_batch, every job gets its frames in order."""
+
+        imitator = StubImitator()
+        service = ImitationService(imitator, max_batch=4, max_latency=0.5)
+
+        # the jobs are pending before the worker starts, so the first batches are full.
+        jobs = [service.submit(self.create_job(s, num_frames)) for s, num_frames in [(1, 5), (2, 3), (3, 2)]]
+        service.start()
+        try:
+            for job in jobs:
+                self.assertTrue(job.done.wait(5))
+        finally:
+            service.stop()
+
+        for s, job in enumerate(jobs, 1):
+            self.check_outputs(job, s)
+
+        self.assertEqual(imitator.batch_sizes, [4, 4, 2])
+        self.assertEqual(sum(imitator.batch_sizes), 10)
+        # the second batch contains the last frame of the first job and the frames of the second one.
+        self.assertEqual(imitator.batch_sources[1:3], [1, 2])
+
+    def test_max_latency(self):
+        """A batch which is not full is run after max_latency."""
+
+        service = ImitationService(StubImitator(), max_batch=8, max_latency=0.05)
+        service.start()
+        try:
+            job = service.submit(self.create_job(1, 2))
+            self.assertTrue(job.done.wait(5))
+        finally:
+            service.stop()
+
+        self.check_outputs(job, 1)
+
+    def test_error(self):
+        """A failing job gets the error, the other jobs of the batch too, the later jobs are run."""
+
+        imitator = StubImitator(fail_src=2)
+        service = ImitationService(imitator, max_batch=4, max_latency=0.05)
+
+        jobs = [service.submit(self.create_job(s, 2)) for s in [1, 2]]
+        service.start()
+        try:
+            for job in jobs:
+                self.assertTrue(job.done.wait(5))
+
+            later = service.submit(self.create_job(3, 3))
+            self.assertTrue(later.done.wait(5))
+        finally:
+            service.stop()
+
+        self.assertIn('ValueError', jobs[1].error)
+        self.assertIsNotNone(jobs[0].error)
+        self.check_outputs(later, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from utils.mesh import compute_uv_image, optimize_uv_image
+
+
+def sample_texture(uv_image, uv):
+    """The texture sampled from the uv image, the same as UVImageModel.forward."""
+    f, t = uv.shape[0:2]
+    texture = F.grid_sample(uv_image[None], uv.view(1, f, t * t, 2))
+    return texture.view(3, f, t, t).permute(1, 2, 3, 0)
+
+
+class TestUVImage(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        torch.manual_seed(0)
+
+        self.uv_size = 32
+        # (f, t, t, 2) texels of a random layout, and a smooth uv image.
+        self.uv = torch.tensor(rng.uniform(-0.95, 0.95, (400, 3, 3, 2)), dtype=torch.float32)
+        self.gt_uv_image = torch.tanh(F.interpolate(torch.randn(1, 3, 4, 4) * 0.8, size=(self.uv_size, self.uv_size),
+                                                    mode='bilinear', align_corners=False))[0]
+        self.texture = sample_texture(self.gt_uv_image, self.uv)
+
+    def test_compare_optimized(self):
+        """The splatted uv image matches the one optimized by Adam on the pixels with texels."""
+
+        splat = compute_uv_image(self.uv, self.texture, uv_size=self.uv_size)
+        adam = optimize_uv_image(self.uv, self.texture, uv_size=self.uv_size)
+
+        covered = compute_uv_image(self.uv, torch.ones_like(self.texture), uv_size=self.uv_size,
+                                   fill_holes=False)[0] > 0
+        self.assertGreater(covered.float().mean().item(), 0.9)
+
+        self.assertLess((splat - adam).abs()[:, covered].mean().item(), 0.05)
+        self.assertLess((splat - self.gt_uv_image).abs()[:, covered].mean().item(), 0.05)
+
+        splat_error = ((sample_texture(splat, self.uv) - self.texture) ** 2).mean().item()
+        self.assertLess(splat_error, 2e-3)
+
+    def test_fill_holes(self):
+        """The pixels without texels are -1, or filled from their neighbours."""
+
+        # the texels only cover the left half of the uv image.
+        uv = self.uv.clone()
+        uv[..., 0] = (uv[..., 0] - 1) / 2
+        texture = sample_texture(self.gt_uv_image, uv)
+
+        holes = compute_uv_image(uv, texture, uv_size=self.uv_size, fill_holes=False)
+        filled = compute_uv_image(uv, texture, uv_size=self.uv_size, fill_holes=True)
+
+        right = slice(self.uv_size * 3 // 4, None)
+        self.assertTrue((holes[:, :, right] == -1).all())
+        self.assertTrue((filled[:, :, right] >= texture.min() - 1e-6).all())
+        self.assertTrue((filled[:, :, right] <= texture.max() + 1e-6).all())
+
+        covered = holes[0] > -1
+        self.assertTrue(torch.equal(filled[:, covered], holes[:, covered]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,6 +41,8 @@ def subsample(inputs, factor):
 class PreActBlock(nn.Module):
     '''Pre-activation version of the BasicBlock.'''
     expansion = 1
+    # the conv -> bn pairs of the forward, see `fold_batch_norms`.
+    fold_pairs = [('conv1', 'bn2')]
 
     def __init__(self, in_planes, planes, stride=1):
         super(PreActBlock, self).__init__()
@@ -68,6 +70,8 @@ class PreActBlock(nn.Module):
 class PreActBottleneck(nn.Module):
     '''Pre-activation version of the original Bottleneck module.'''
     expansion = 4
+    # the conv -> bn pairs of the forward, see `fold_batch_norms`.
+    fold_pairs = [('conv1', 'bn2'), ('conv2', 'bn3')]
 
     def __init__(self, in_planes, planes, stride=1):
         super(PreActBottleneck, self).__init__()
@@ -9,6 +9,8 @@ import numpy as np
 import skimage.metrics
 from scipy import linalg
 
+from ..utils.fold_bn import fold_batch_norms
+
 
 MODEL_ZOOS = dict()
 
@@ -242,6 +244,7 @@ class BaseMetric(object):
                     norm_mean=[0.485, 0.456, 0.406],
                     norm_std=[0.229, 0.224, 0.225],
                     GPU=True)
+                fold_batch_norms(model._model)
                 self.model_zoos[key] = model
 
             elif key == self.PCBreID:
@@ -250,6 +253,7 @@ class BaseMetric(object):
                 data_dir = self.resource_dir
 
                 model = PCBReIDMetric(name="PCB", pretrain_path=os.path.join(data_dir, "pcb_net_last.pth"))
+                fold_batch_norms(model.model)
                 model = model.to(self.device)
 
                 self.model_zoos[key] = model
@@ -264,6 +268,7 @@ class BaseMetric(object):
                 model.load_state_dict(model_dict)
                 model = model.to(self.device)
                 model.eval()
+                fold_batch_norms(model)
 
                 self.model_zoos[key] = model
 
@@ -0,0 +1,173 @@
+"""
+Folding of the eval-mode BatchNorm layers into the convolutions they follow.
+
+This module is shared verbatim by impersonator (utils/fold_bn.py) and his_evaluators
+(his_evaluators/utils/fold_bn.py). his_evaluators is installed as a separate package (thirdparty/his_evaluators/setup.py)
+and impersonator only needs it for the evaluation, so neither can import the other, keep the two copies identical.
+
+The conv -> bn pairs are found in two ways:
+    1. structurally, without torch.fx: the modules declare their pairs in a `fold_pairs` class attribute, e.g,
+       `fold_pairs = [('conv1', 'bn2'), ('conv2', 'bn3')]` of the PreActBottleneck of hmr, and the adjacent
+       Conv -> BatchNorm layers of the plain nn.Sequential are folded;
+    2. generically, with torch.fx (torch >= 1.8) if it is available, by tracing the forward of the modules.
+"""
+import collections
+import torch
+import torch.nn as nn
+
+try:
+    import torch.fx
+    FX_AVAILABLE = True
+except ImportError:
+    FX_AVAILABLE = False
+
+
+CONV_TYPES = (nn.Conv1d, nn.Conv2d, nn.Conv3d)
+BN_TYPES = (nn.BatchNorm1d, nn.BatchNorm2d, nn.BatchNorm3d)
+
+
+def _get_submodule(root, name):
+    module = root
+    for attr in name.split('.'):
+        module = getattr(module, attr)
+    return module
+
+
+def _set_submodule(root, name, module):
+    parent_name, _, attr = name.rpartition('.')
+    parent = _get_submodule(root, parent_name) if parent_name else root
+    setattr(parent, attr, module)
+
+
+def find_structural_pairs(module):
+    """
+    Finds the conv -> bn pairs declared by the `fold_pairs` attributes of the submodules, and the adjacent
+    Conv -> BatchNorm layers of the plain nn.Sequential, whose forward applies the layers one after the other.
+
+    Args:
+        module (nn.Module):
+
+    Returns:
+        pairs (list of tuple): the (conv name, bn name) pairs, relative to `module`.
+    """
+    pairs = []
+    for name, child in module.named_modules():
+        prefix = name + '.' if name else ''
+
+        if type(child) is nn.Sequential:
+            layers = list(child.named_children())
+            for (conv_name, conv), (bn_name, bn) in zip(layers[:-1], layers[1:]):
+                if isinstance(conv, CONV_TYPES) and isinstance(bn, BN_TYPES):
+                    pairs.append((prefix + conv_name, prefix + bn_name))
+
+        for conv_name, bn_name in getattr(child, 'fold_pairs', []):
+            pairs.append((prefix + conv_name, prefix + bn_name))
+
+    return pairs
+
+
+def find_conv_bn_pairs(module):
+    """
+    Traces the forward of `module` with torch.fx and finds the BatchNorm layers which are directly applied on
+    the output of a convolution, and only on it. The other BatchNorm layers, e.g, the pre-activation ones
+    (bn -> relu -> conv) of hmr, can not be folded.
+
+    Args:
+        module (nn.Module):
+
+    Returns:
+        pairs (list of tuple or None): the (conv name, bn name) pairs, None if the module can not be traced.
+    """
+    try:
+        graph = torch.fx.Tracer().trace(module)
+    except Exception:
+        return None
+
+    modules = dict(module.named_modules())
+    num_calls = collections.Counter(node.target for node in graph.nodes if node.op == 'call_module')
+
+    pairs = []
+    for node in graph.nodes:
+        if node.op != 'call_module' or not isinstance(modules[node.target], BN_TYPES):
+            continue
+
+        src = node.args[0]
+        if not isinstance(src, torch.fx.Node) or src.op != 'call_module' \
+                or not isinstance(modules[src.target], CONV_TYPES):
+            continue
+
+        # the conv output must not be used by anything else, and the layers must not be shared.
+        if len(src.users) == 1 and num_calls[src.target] == 1 and num_calls[node.target] == 1:
+            pairs.append((src.target, node.target))
+
+    return pairs
+
+
+def fold_conv_bn(conv, bn):
+    """
+    Folds the eval-mode `bn` into the weight and the bias of `conv` in place, bn(conv(x)) == conv(x) afterwards.
+
+    Args:
+        conv (nn.Conv1d or nn.Conv2d or nn.Conv3d):
+        bn (nn.BatchNorm1d or nn.BatchNorm2d or nn.BatchNorm3d): with running statistics.
+    """
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    shift = -bn.running_mean * scale
+    if bn.affine:
+        scale = scale * bn.weight
+        shift = shift * bn.weight + bn.bias
+
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(scale)
+
+    conv.weight.data.mul_(scale.view([-1] + [1] * (conv.weight.dim() - 1)))
+    conv.bias = nn.Parameter(bias * scale + shift)
+
+
+def _fold_pairs(module, pairs):
+    num_folded = 0
+    for conv_name, bn_name in pairs:
+        conv = _get_submodule(module, conv_name)
+        bn = _get_submodule(module, bn_name)
+        if not isinstance(conv, CONV_TYPES) or not isinstance(bn, BN_TYPES) or bn.running_var is None:
+            continue
+
+        fold_conv_bn(conv, bn)
+        _set_submodule(module, bn_name, nn.Identity())
+        num_folded += 1
+
+    return num_folded
+
+
+def _fold_traced(module):
+    pairs = find_conv_bn_pairs(module)
+    if pairs is None:
+        return sum(_fold_traced(child) for child in module.children())
+
+    return _fold_pairs(module, pairs)
+
+
+@torch.no_grad()
+def fold_batch_norms(module):
+    """
+    Folds the eval-mode BatchNorm layers into the convolutions they follow, the convolutions are updated in place
+    and the BatchNorm layers are replaced by nn.Identity, so the forward is unchanged and the outputs are
+    numerically the same.
+
+    The pairs declared by the modules are always folded. The other ones are found by torch.fx (torch >= 1.8) if it
+    is available, the modules which can not be traced are folded child by child.
+
+    It must be called after loading the weights, and the folded model must not be trained.
+
+    Args:
+        module (nn.Module): in eval mode.
+
+    Returns:
+        num_folded (int): the number of folded BatchNorm layers.
+    """
+    assert not module.training, 'only the BatchNorm layers in eval mode can be folded.'
+
+    num_folded = _fold_pairs(module, find_structural_pairs(module))
+    if FX_AVAILABLE:
+        num_folded += _fold_traced(module)
+
+    return num_folded
@@ -8,7 +8,8 @@ from .perspective import perspective
 from .projection import projection, projection_by_params
 from .rasterize import (rasterize_rgbad, rasterize, rasterize_rgb_and_face_index_map, rasterize_silhouettes,
                         rasterize_depth, rasterize_face_index_map, rasterize_face_index_map_and_weight_map,
-                        rasterize_weight_map, Rasterize)
+                        rasterize_weight_map, Rasterize, select_backend)
+from .rasterize_cpu import rasterize_face_index_map_cpu, IncrementalRasterizer
 from .renderer import Renderer
 from .save_obj import save_obj
 from .vertices_to_faces import vertices_to_faces
@@ -6,7 +6,10 @@ import numpy as np
 import cv2
 
 
-import neural_renderer.cuda.load_textures as load_textures_cuda
+try:
+    import neural_renderer.cuda.load_textures as load_textures_cuda
+except ImportError:
+    load_textures_cuda = None
 
 def load_mtl(filename_mtl):
     '''
@@ -3,7 +3,12 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Function
 
-import neural_renderer.cuda.rasterize as rasterize_cuda
+try:
+    import neural_renderer.cuda.rasterize as rasterize_cuda
+except ImportError:
+    rasterize_cuda = None
+
+from .rasterize_cpu import rasterize_face_index_map_cpu
 
 DEFAULT_IMAGE_SIZE = 256
 DEFAULT_ANTI_ALIASING = True
@@ -11,6 +16,8 @@ DEFAULT_NEAR = 0.1
 DEFAULT_FAR = 100
 DEFAULT_EPS = 1e-4
 DEFAULT_BACKGROUND_COLOR = (0, 0, 0)
+DEFAULT_BACKEND = 'auto'
+BACKENDS = ('auto', 'cuda', 'cpu')
 
 
 class RasterizeFunction(Function):
@@ -228,6 +235,29 @@ class RasterizeFunction(Function):
                                                      face_inv_map, weight_map,
                                                      grad_depth_map, grad_faces, ctx.image_size)
 
+def select_backend(faces, backend=DEFAULT_BACKEND):
+    '''
+    Resolves the rasterizer backend.
+
+    Args:
+        faces (torch.Tensor): the faces to rasterize.
+        backend (str): 'auto', 'cuda' or 'cpu'. 'auto' uses the cuda kernels if the extension is built and
+            the faces are cuda Tensors, otherwise the pure PyTorch rasterizer of `rasterize_cpu`.
+
+    Returns:
+        str: 'cuda' or 'cpu'
+    '''
+    if backend not in BACKENDS:
+        raise ValueError('backend must be one of {}, but got {}'.format(BACKENDS, backend))
+
+    if backend == 'auto':
+        backend = 'cuda' if (rasterize_cuda is not None and faces.is_cuda) else 'cpu'
+    elif backend == 'cuda' and rasterize_cuda is None:
+        raise ImportError('neural_renderer.cuda.rasterize is not built, use backend=\'cpu\' instead.')
+
+    return backend
+
+
 class Rasterize(nn.Module):
     '''
     Wrapper around the autograd function RasterizeFunction
@@ -267,7 +297,8 @@ def rasterize_rgbad(
         return_alpha=True,
         return_depth=True,
         return_fim=True,
-        return_weight=True
+        return_weight=True,
+        backend=DEFAULT_BACKEND
 ):
     """
     Generate RGB, alpha channel, and depth images from faces and textures (for RGB).
@@ -287,6 +318,8 @@ def rasterize_rgbad(
         return_depth (bool): generate depth images or not.
         return_fim (bool): generate face index map or not.
         return_weight (bool): generate weight map or not
+        backend (str): 'auto', 'cuda' or 'cpu', see `select_backend`. The cpu backend does not support RGB images
+            and is not differentiable.
 
     Returns:
         dict:
@@ -304,7 +337,18 @@ def rasterize_rgbad(
     else:
         inputs = [faces, textures]
 
-    if anti_aliasing:
+    backend = select_backend(faces, backend)
+
+    if backend == 'cpu':
+        if return_rgb:
+            raise NotImplementedError('the cpu rasterizer only supports alpha, depth, face index map and weight map.')
+
+        rgb = None
+        face_index_map, weight_map, depth = rasterize_face_index_map_cpu(
+            faces, image_size * 2 if anti_aliasing else image_size, near, far)
+        alpha = (face_index_map >= 0).to(depth.dtype) if return_alpha else None
+
+    elif anti_aliasing:
         # 2x super-sampling
         # rgb, alpha, depth, face_index_map = Rasterize(
         #     image_size * 2, near, far, eps, background_color, return_rgb, return_alpha, return_depth)(*inputs)
@@ -432,6 +476,7 @@ def rasterize_silhouettes(
         near=DEFAULT_NEAR,
         far=DEFAULT_FAR,
         eps=DEFAULT_EPS,
+        backend=DEFAULT_BACKEND,
 ):
     """
     Generate alpha channels from faces.
@@ -443,13 +488,14 @@ def rasterize_silhouettes(
         near: see `rasterize_rgbad`.
         far: see `rasterize_rgbad`.
         eps: see `rasterize_rgbad`.
+        backend: see `rasterize_rgbad`.
 
     Returns:
         ~torch.Tensor: Alpha channels. The shape is [batch size, image_size, image_size].
 
     """
     return rasterize_rgbad(faces, None, image_size, anti_aliasing,
-                           near, far, eps, None, False, True, False, False)['alpha']
+                           near, far, eps, None, False, True, False, False, backend=backend)['alpha']
 
 
 def rasterize_depth(
@@ -459,6 +505,7 @@ def rasterize_depth(
         near=DEFAULT_NEAR,
         far=DEFAULT_FAR,
         eps=DEFAULT_EPS,
+        backend=DEFAULT_BACKEND,
 ):
     """
     Generate depth images from faces.
@@ -470,13 +517,14 @@ def rasterize_depth(
         near: see `rasterize_rgbad`.
         far: see `rasterize_rgbad`.
         eps: see `rasterize_rgbad`.
+        backend: see `rasterize_rgbad`.
 
     Returns:
         ~torch.Tensor: Depth images. The shape is [batch size, image_size, image_size].
 
     """
     return rasterize_rgbad(faces, None, image_size, anti_aliasing,
-                           near, far, eps, None, False, False, True, False)['depth']
+                           near, far, eps, None, False, False, True, False, backend=backend)['depth']
 
 
 def rasterize_face_index_map(
@@ -486,6 +534,7 @@ def rasterize_face_index_map(
         near=DEFAULT_NEAR,
         far=DEFAULT_FAR,
         eps=DEFAULT_EPS,
+        backend=DEFAULT_BACKEND,
 ):
     """
     Generate RGB images from faces and textures.
@@ -497,6 +546,7 @@ def rasterize_face_index_map(
         near: see `rasterize_rgbad`.
         far: see `rasterize_rgbad`.
         eps: see `rasterize_rgbad`.
+        backend: see `rasterize_rgbad`.
 
     Returns:
         ~torch.Tensor: RGB images. The shape is [batch size, 3, image_size, image_size].
@@ -504,7 +554,8 @@ def rasterize_face_index_map(
 
     """
 
-    res = rasterize_rgbad(faces, None, image_size, anti_aliasing, near, far, eps, None, False, False, False, True)
+    res = rasterize_rgbad(faces, None, image_size, anti_aliasing, near, far, eps, None, False, False, False, True,
+                          backend=backend)
 
     return res['face_index_map']
 
@@ -516,6 +567,7 @@ def rasterize_weight_map(
         near=DEFAULT_NEAR,
         far=DEFAULT_FAR,
         eps=DEFAULT_EPS,
+        backend=DEFAULT_BACKEND,
 ):
     """
     Generate RGB images from faces and textures.
@@ -527,6 +579,7 @@ def rasterize_weight_map(
         near: see `rasterize_rgbad`.
         far: see `rasterize_rgbad`.
         eps: see `rasterize_rgbad`.
+        backend: see `rasterize_rgbad`.
 
     Returns:
         ~torch.Tensor: RGB images. The shape is [batch size, 3, image_size, image_size].
@@ -535,7 +588,7 @@ def rasterize_weight_map(
     """
 
     res = rasterize_rgbad(faces, None, image_size, anti_aliasing, near, far, eps, None,
-                          False, False, False, return_fim=False, return_weight=True)
+                          False, False, False, return_fim=False, return_weight=True, backend=backend)
 
     return res['weight_map']
 
@@ -547,6 +600,7 @@ def rasterize_face_index_map_and_weight_map(
         near=DEFAULT_NEAR,
         far=DEFAULT_FAR,
         eps=DEFAULT_EPS,
+        backend=DEFAULT_BACKEND,
 ):
     """
     Generate RGB images from faces and textures.
@@ -558,6 +612,7 @@ def rasterize_face_index_map_and_weight_map(
         near: see `rasterize_rgbad`.
         far: see `rasterize_rgbad`.
         eps: see `rasterize_rgbad`.
+        backend: see `rasterize_rgbad`.
 
     Returns:
         ~torch.Tensor: RGB images. The shape is [batch size, 3, image_size, image_size].
@@ -566,7 +621,7 @@ def rasterize_face_index_map_and_weight_map(
     """
 
     res = rasterize_rgbad(faces, None, image_size, anti_aliasing, near, far, eps, None,
-                          False, False, False, return_fim=True, return_weight=True)
+                          False, False, False, return_fim=True, return_weight=True, backend=backend)
 
     return res['face_index_map'], res['weight_map']
 
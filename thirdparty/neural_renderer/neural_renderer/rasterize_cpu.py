@@ -0,0 +1,444 @@
+from __future__ import division
+
+import torch
+
+DEFAULT_TILE_SIZE = 16
+DEFAULT_CHUNK_ELEMENTS = 1 << 22
+
+
+def _face_inv(faces, image_size):
+    '''
+    Per-face inverse of the screen-space vertex matrix (same as forward_face_index_map_cuda_kernel_1).
+
+    Args:
+        faces (torch.Tensor): (N, 9), x0, y0, z0, x1, y1, z1, x2, y2, z2
+        image_size (int):
+
+    Returns:
+        face_inv (torch.Tensor): (N, 3, 3)
+    '''
+    p = 0.5 * (faces.view(-1, 3, 3)[:, :, 0:2] * image_size + image_size - 1)
+    p0x, p0y = p[:, 0, 0], p[:, 0, 1]
+    p1x, p1y = p[:, 1, 0], p[:, 1, 1]
+    p2x, p2y = p[:, 2, 0], p[:, 2, 1]
+
+    face_inv = torch.stack([
+        p1y - p2y, p2x - p1x, p1x * p2y - p2x * p1y,
+        p2y - p0y, p0x - p2x, p2x * p0y - p0x * p2y,
+        p0y - p1y, p1x - p0x, p0x * p1y - p1x * p0y
+    ], dim=1).view(-1, 3, 3)
+
+    denominator = p2x * (p0y - p1y) + p0x * (p1y - p2y) + p1x * (p2y - p0y)
+    return face_inv / denominator[:, None, None]
+
+
+def _pixel_boxes(faces, image_size):
+    '''
+    Conservative pixel bounding boxes of the faces.
+
+    Args:
+        faces (torch.Tensor): (bs, nf, 9)
+        image_size (int):
+
+    Returns:
+        x_min, x_max, y_min, y_max (torch.Tensor): (bs, nf) each;
+        finite (torch.Tensor): (bs, nf), the vertices of the face are finite.
+    '''
+    x = faces[:, :, 0::3]
+    y = faces[:, :, 1::3]
+    px = 0.5 * (x * image_size + image_size - 1)
+    py = 0.5 * (y * image_size + image_size - 1)
+
+    x_min = torch.floor(px.min(dim=2)[0]) - 1
+    x_max = torch.ceil(px.max(dim=2)[0]) + 1
+    y_min = torch.floor(py.min(dim=2)[0]) - 1
+    y_max = torch.ceil(py.max(dim=2)[0]) + 1
+    finite = torch.isfinite(px).all(dim=2) & torch.isfinite(py).all(dim=2)
+
+    return x_min, x_max, y_min, y_max, finite
+
+
+def _expand_tiles(x_min, x_max, y_min, y_max, image_size, tile_size):
+    '''
+    Expands the (finite) pixel bounding boxes into the screen tiles they overlap, the boxes are clamped to the
+    image.
+
+    Args:
+        x_min, x_max, y_min, y_max (torch.Tensor): (n,) each.
+        image_size (int):
+        tile_size (int):
+
+    Returns:
+        pair_box (torch.Tensor): (np,), the index of the box of every (box, tile) pair;
+        tx, ty (torch.Tensor): (np,), the tile of every pair.
+    '''
+    device = x_min.device
+
+    def _tile_range(v_min, v_max):
+        v_min = v_min.clamp(0, image_size - 1).long() // tile_size
+        v_max = v_max.clamp(0, image_size - 1).long() // tile_size
+        return v_min, v_max - v_min + 1
+
+    tx0, tw = _tile_range(x_min, x_max)
+    ty0, th = _tile_range(y_min, y_max)
+
+    counts = tw * th
+    pair_box = torch.repeat_interleave(torch.arange(counts.numel(), device=device), counts)
+    offsets = torch.cumsum(counts, dim=0) - counts
+    local = torch.arange(pair_box.numel(), device=device) - offsets[pair_box]
+    tx = tx0[pair_box] + local % tw[pair_box]
+    ty = ty0[pair_box] + local // tw[pair_box]
+
+    return pair_box, tx, ty
+
+
+def _bin_faces(faces, image_size, tile_size):
+    '''
+    Bins the front-facing, on-screen faces into square screen tiles.
+
+    Args:
+        faces (torch.Tensor): (bs, nf, 9)
+        image_size (int):
+        tile_size (int):
+
+    Returns:
+        tile_ids (torch.Tensor): (nt,), global ids (bn * tiles_per_image + ty * n_tiles + tx) of non-empty tiles;
+        tile_faces (torch.Tensor): (nt, fmax), face ids inside each image (ascending), -1 for padding.
+    '''
+    bs, nf = faces.shape[0:2]
+    device = faces.device
+    n_tiles = (image_size + tile_size - 1) // tile_size
+
+    x = faces[:, :, 0::3]
+    y = faces[:, :, 1::3]
+
+    # backside culling, the same test as the cuda kernel
+    front = (y[:, :, 2] - y[:, :, 0]) * (x[:, :, 1] - x[:, :, 0]) >= (y[:, :, 1] - y[:, :, 0]) * (x[:, :, 2] - x[:, :, 0])
+
+    # conservative pixel bounding box of each face
+    x_min, x_max, y_min, y_max, finite = _pixel_boxes(faces, image_size)
+
+    on_screen = (x_max >= 0) & (x_min <= image_size - 1) & (y_max >= 0) & (y_min <= image_size - 1)
+    keep = front & on_screen & finite
+
+    # nonzero(as_tuple=True) needs torch >= 1.3.
+    idx = keep.nonzero()
+    if idx.numel() == 0:
+        return None, None
+    bn, fn = idx[:, 0], idx[:, 1]
+
+    # expand every face into (face, tile) pairs
+    pair_face, tx, ty = _expand_tiles(x_min[bn, fn], x_max[bn, fn], y_min[bn, fn], y_max[bn, fn],
+                                      image_size, tile_size)
+
+    pair_tile = bn[pair_face] * (n_tiles * n_tiles) + ty * n_tiles + tx
+    pair_fn = fn[pair_face]
+
+    # sort by tile, then by face index, so that depth ties resolve to the lowest face index like the cuda kernel
+    order = torch.argsort(pair_tile * nf + pair_fn)
+    pair_tile = pair_tile[order]
+    pair_fn = pair_fn[order]
+
+    tile_ids, tile_counts = torch.unique_consecutive(pair_tile, return_counts=True)
+    starts = torch.cumsum(tile_counts, dim=0) - tile_counts
+    tile_idx = torch.repeat_interleave(torch.arange(tile_ids.numel(), device=device), tile_counts)
+    slot = torch.arange(pair_fn.numel(), device=device) - starts[tile_idx]
+
+    tile_faces = torch.full((tile_ids.numel(), int(tile_counts.max())), -1, dtype=torch.long, device=device)
+    tile_faces[tile_idx, slot] = pair_fn
+
+    return tile_ids, tile_faces
+
+
+def _rasterize_tiles(faces, tile_ids, tile_faces, image_size, near, far, tile_size, chunk_elements,
+                     face_index_map, weight_map, depth_map=None):
+    '''
+    Rasterizes the binned tiles into the flat buffers, only the covered pixels of the tiles are written.
+
+    Args:
+        faces (torch.Tensor): (bs, nf, 9)
+        tile_ids (torch.Tensor): (nt,), see `_bin_faces`.
+        tile_faces (torch.Tensor): (nt, fmax), see `_bin_faces`.
+        image_size (int):
+        near (float):
+        far (float):
+        tile_size (int):
+        chunk_elements (int):
+        face_index_map (torch.Tensor): (bs * image_size * image_size,), int32.
+        weight_map (torch.Tensor): (bs * image_size * image_size, 3).
+        depth_map (torch.Tensor or None): (bs * image_size * image_size,).
+    '''
+    bs, nf = faces.shape[0:2]
+    device = faces.device
+    dtype = faces.dtype
+    is_ = image_size
+    n_tiles = (is_ + tile_size - 1) // tile_size
+    tiles_per_image = n_tiles * n_tiles
+    num_pixels = tile_size * tile_size
+
+    flat_faces = faces.view(bs * nf, 9)
+    flat_inv = _face_inv(flat_faces, is_).view(bs * nf, 9)
+
+    # pixel offsets inside a tile
+    offset = torch.arange(num_pixels, device=device)
+    off_y = offset // tile_size
+    off_x = offset % tile_size
+
+    fmax = tile_faces.shape[1]
+    chunk = max(1, chunk_elements // (fmax * num_pixels))
+
+    for start in range(0, tile_ids.numel(), chunk):
+        ids = tile_ids[start:start + chunk]
+        cand = tile_faces[start:start + chunk]           # (C, F)
+        bn = ids // tiles_per_image
+        ty = (ids % tiles_per_image) // n_tiles
+        tx = ids % n_tiles
+
+        yi = ty[:, None] * tile_size + off_y[None, :]    # (C, P)
+        xi = tx[:, None] * tile_size + off_x[None, :]    # (C, P)
+        in_image = (yi < is_) & (xi < is_)
+
+        yp = ((2. * yi.double() + 1 - is_) / is_).to(dtype)[:, None, :]   # (C, 1, P)
+        xp = ((2. * xi.double() + 1 - is_) / is_).to(dtype)[:, None, :]   # (C, 1, P)
+        yi_f = yi.to(dtype)[:, None, :]
+        xi_f = xi.to(dtype)[:, None, :]
+
+        valid_face = cand >= 0
+        gid = bn[:, None] * nf + cand.clamp(min=0)       # (C, F)
+        f = flat_faces[gid][:, :, :, None]               # (C, F, 9, 1)
+        inv = flat_inv[gid][:, :, :, None]               # (C, F, 9, 1)
+
+        x0, y0, z0 = f[:, :, 0], f[:, :, 1], f[:, :, 2]
+        x1, y1, z1 = f[:, :, 3], f[:, :, 4], f[:, :, 5]
+        x2, y2, z2 = f[:, :, 6], f[:, :, 7], f[:, :, 8]
+
+        # check [py, px] is inside the face
+        inside = ~(((yp - y0) * (x1 - x0) < (xp - x0) * (y1 - y0)) |
+                   ((yp - y1) * (x2 - x1) < (xp - x1) * (y2 - y1)) |
+                   ((yp - y2) * (x0 - x2) < (xp - x2) * (y0 - y2)))
+
+        # w = face_inv * p, clamped to [0, 1] and normalized to sum(w) = 1
+        w0 = (inv[:, :, 0] * xi_f + inv[:, :, 1] * yi_f + inv[:, :, 2]).clamp(0, 1)
+        w1 = (inv[:, :, 3] * xi_f + inv[:, :, 4] * yi_f + inv[:, :, 5]).clamp(0, 1)
+        w2 = (inv[:, :, 6] * xi_f + inv[:, :, 7] * yi_f + inv[:, :, 8]).clamp(0, 1)
+        w_sum = w0 + w1 + w2
+        w0 = w0 / w_sum
+        w1 = w1 / w_sum
+        w2 = w2 / w_sum
+
+        # 1 / zp = sum(w / z)
+        zp = 1. / (w0 / z0 + w1 / z1 + w2 / z2)         # (C, F, P)
+
+        valid = inside & (zp > near) & (zp < far) & valid_face[:, :, None] & in_image[:, None, :]
+        zp = torch.where(valid, zp, torch.full_like(zp, float('inf')))
+
+        # z-test, min returns the first (lowest face index) candidate on ties
+        depth, arg = zp.min(dim=1)                       # (C, P)
+        hit = torch.isfinite(depth)
+        if not hit.any():
+            continue
+
+        arg = arg[:, None, :]
+        weights = torch.stack([w0.gather(1, arg)[:, 0], w1.gather(1, arg)[:, 0], w2.gather(1, arg)[:, 0]],
+                              dim=-1)                    # (C, P, 3)
+        fim = cand.gather(1, arg[:, 0, :])               # (C, P)
+
+        pix = (bn[:, None] * is_ + yi) * is_ + xi        # (C, P)
+        pix = pix[hit]
+        face_index_map[pix] = fim[hit].int()
+        weight_map[pix] = weights[hit]
+        if depth_map is not None:
+            depth_map[pix] = depth[hit]
+
+
+def rasterize_face_index_map_cpu(faces, image_size, near, far, tile_size=DEFAULT_TILE_SIZE,
+                                 chunk_elements=DEFAULT_CHUNK_ELEMENTS):
+    '''
+    Pure PyTorch version of forward_face_index_map in rasterize_cuda_kernel.cu. It works on any device,
+    but it is meant for CPU inference where the cuda extension is not available.
+
+    The faces are first binned into tile_size x tile_size screen tiles (bounding box culling and backside culling),
+    then every non-empty tile evaluates the edge functions, barycentric weights and depth of its candidate faces
+    for all its pixels at once, and the z-test is a min-reduction over the candidates.
+
+    Args:
+        faces (torch.Tensor): (bs, nf, 3, 3)
+        image_size (int):
+        near (float):
+        far (float):
+        tile_size (int): the size of the screen tiles.
+        chunk_elements (int): the maximum number of (tile, face, pixel) elements evaluated at once.
+
+    Returns:
+        face_index_map (torch.Tensor): (bs, image_size, image_size), int32, -1 for background;
+        weight_map (torch.Tensor): (bs, image_size, image_size, 3), 0 for background;
+        depth_map (torch.Tensor): (bs, image_size, image_size), far for background.
+
+        They are not vertically flipped, the same as the outputs of the cuda kernel.
+    '''
+    bs, nf = faces.shape[0:2]
+    device = faces.device
+    dtype = faces.dtype
+    is_ = image_size
+
+    face_index_map = torch.full((bs * is_ * is_,), -1, dtype=torch.int32, device=device)
+    weight_map = torch.zeros((bs * is_ * is_, 3), dtype=dtype, device=device)
+    depth_map = torch.full((bs * is_ * is_,), far, dtype=dtype, device=device)
+
+    faces = faces.detach().reshape(bs, nf, 9).contiguous()
+    tile_ids, tile_faces = _bin_faces(faces, is_, tile_size)
+
+    if tile_ids is not None:
+        _rasterize_tiles(faces, tile_ids, tile_faces, is_, near, far, tile_size, chunk_elements,
+                         face_index_map, weight_map, depth_map)
+
+    face_index_map = face_index_map.view(bs, is_, is_)
+    weight_map = weight_map.view(bs, is_, is_, 3)
+    depth_map = depth_map.view(bs, is_, is_)
+
+    return face_index_map, weight_map, depth_map
+
+
+class IncrementalRasterizer(object):
+    '''
+    Face index map and weight map of a sequence of frames (e.g, the smpls of a reference video), where only the
+    screen tiles touched by the moved faces are re-rasterized.
+
+    The samples of a batch are consecutive frames, and the first one follows the last frame of the previous call,
+    so the batches may have any size. It keeps the faces and the (not flipped) buffers of the last frame. For every
+    frame, the faces whose vertices changed since the previous frame are found, the tiles overlapped by their
+    previous or current bounding boxes are dirty, only the dirty tiles are rasterized with the tile rasterizer of
+    `rasterize_face_index_map_cpu`, and the clean tiles are copied from the previous frame. A pixel of a clean tile
+    is only covered by unchanged faces in both frames, and a tile is always rasterized with all its candidate faces,
+    so the outputs are identical to a full render by the tile rasterizer.
+
+    It pays off when the consecutive samples are consecutive frames of one sequence, the outputs are still correct
+    otherwise (e.g, when the batches interleave several sequences), but most tiles are dirty. The buffers are reset
+    when the number of faces, the dtype or the device changes.
+    '''
+
+    def __init__(self, image_size, near, far, tile_size=DEFAULT_TILE_SIZE, chunk_elements=DEFAULT_CHUNK_ELEMENTS):
+        self.image_size = image_size
+        self.near = near
+        self.far = far
+        self.tile_size = tile_size
+        self.chunk_elements = chunk_elements
+
+        # the faces (1, nf, 9) and the flat buffers of the last frame.
+        self.faces = None
+        self.face_index_map = None
+        self.weight_map = None
+
+        # the ratio of the dirty tiles of the last call, 1 for a full render.
+        self.dirty_ratio = 1.
+
+    def reset(self):
+        self.faces = None
+        self.face_index_map = None
+        self.weight_map = None
+        self.dirty_ratio = 1.
+
+    def _dirty_tiles(self, faces, prev_faces):
+        '''
+        Args:
+            faces (torch.Tensor): (bs, nf, 9), the faces of the frames.
+            prev_faces (torch.Tensor): (bs, nf, 9), the faces of their previous frames.
+
+        Returns:
+            dirty (torch.Tensor): (bs * tiles_per_image,), bool.
+        '''
+        bs = faces.shape[0]
+        is_ = self.image_size
+        n_tiles = (is_ + self.tile_size - 1) // self.tile_size
+        tiles_per_image = n_tiles * n_tiles
+
+        # the writes are done in uint8, torch 1.2 supports few in-place ops of bool tensors.
+        dirty = torch.zeros(bs * tiles_per_image, dtype=torch.uint8, device=faces.device)
+
+        moved = (faces != prev_faces).any(dim=2)
+        if not moved.any():
+            return dirty != 0
+
+        for prev_or_cur in [prev_faces, faces]:
+            x_min, x_max, y_min, y_max, finite = _pixel_boxes(prev_or_cur, is_)
+
+            # the boxes of the non-finite faces are unknown, the whole image is dirty.
+            broken = (moved & ~finite).any(dim=1)
+            dirty.view(bs, tiles_per_image)[broken] = 1
+
+            on_screen = (x_max >= 0) & (x_min <= is_ - 1) & (y_max >= 0) & (y_min <= is_ - 1)
+            idx = (moved & finite & on_screen).nonzero()
+            if idx.numel() == 0:
+                continue
+            bn, fn = idx[:, 0], idx[:, 1]
+
+            pair_face, tx, ty = _expand_tiles(x_min[bn, fn], x_max[bn, fn], y_min[bn, fn], y_max[bn, fn],
+                                              is_, self.tile_size)
+            dirty[bn[pair_face] * tiles_per_image + ty * n_tiles + tx] = 1
+
+        return dirty != 0
+
+    @torch.no_grad()
+    def __call__(self, faces):
+        '''
+        Args:
+            faces (torch.Tensor): (bs, nf, 3, 3), the consecutive frames.
+
+        Returns:
+            face_index_map (torch.Tensor): (bs, image_size, image_size), int32, -1 for background;
+            weight_map (torch.Tensor): (bs, image_size, image_size, 3), 0 for background.
+
+            They are vertically flipped, the same as `rasterize_face_index_map_and_weight_map` without anti-aliasing.
+        '''
+        bs, nf = faces.shape[0:2]
+        is_ = self.image_size
+        ts = self.tile_size
+        n_tiles = (is_ + ts - 1) // ts
+        faces = faces.detach().reshape(bs, nf, 9).contiguous()
+
+        if self.faces is None or self.faces.shape[1:] != faces.shape[1:] or self.faces.dtype != faces.dtype \
+                or self.faces.device != faces.device:
+            fim, wim, _ = rasterize_face_index_map_cpu(faces, is_, self.near, self.far, ts, self.chunk_elements)
+            fim = fim.view(bs, -1)
+            wim = wim.view(bs, -1, 3)
+            self.dirty_ratio = 1.
+        else:
+            # the previous frame of every sample.
+            dirty = self._dirty_tiles(faces, torch.cat([self.faces, faces[:-1]], dim=0))
+            self.dirty_ratio = dirty.float().mean().item()
+
+            fim = torch.full((bs * is_ * is_,), -1, dtype=torch.int32, device=faces.device)
+            wim = torch.zeros((bs * is_ * is_, 3), dtype=faces.dtype, device=faces.device)
+
+            # 1. rasterize the dirty tiles of all the frames at once.
+            if self.dirty_ratio > 0:
+                tile_ids, tile_faces = _bin_faces(faces, is_, ts)
+                if tile_ids is not None:
+                    keep = dirty[tile_ids]
+                    tile_ids = tile_ids[keep]
+                    tile_faces = tile_faces[keep]
+
+                if tile_ids is not None and tile_ids.numel() > 0:
+                    _rasterize_tiles(faces, tile_ids, tile_faces, is_, self.near, self.far, ts, self.chunk_elements,
+                                     fim, wim)
+
+            # 2. copy the clean tiles from the previous frames, in order.
+            fim = fim.view(bs, -1)
+            wim = wim.view(bs, -1, 3)
+            clean = ~dirty.view(bs, n_tiles, 1, n_tiles, 1).expand(bs, n_tiles, ts, n_tiles, ts)
+            clean = clean.reshape(bs, n_tiles * ts, n_tiles * ts)[:, :is_, :is_].reshape(bs, -1)
+
+            prev_fim, prev_wim = self.face_index_map, self.weight_map
+            for i in range(bs):
+                fim[i][clean[i]] = prev_fim[clean[i]]
+                wim[i][clean[i]] = prev_wim[clean[i]]
+                prev_fim, prev_wim = fim[i], wim[i]
+
+        self.faces = faces[-1:].clone()
+        self.face_index_map = fim[-1].clone()
+        self.weight_map = wim[-1].clone()
+
+        face_index_map = torch.flip(fim.view(bs, is_, is_), dims=(1,))
+        weight_map = torch.flip(wim.view(bs, is_, is_, 3), dims=(1,))
+
+        return face_index_map, weight_map
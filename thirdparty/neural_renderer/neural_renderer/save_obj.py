@@ -6,7 +6,10 @@ import cv2
 import numpy as np
 
 
-import neural_renderer.cuda.create_texture_image as create_texture_image_cuda
+try:
+    import neural_renderer.cuda.create_texture_image as create_texture_image_cuda
+except ImportError:
+    create_texture_image_cuda = None
 
 
 def create_texture_image(textures, texture_size_out=16):
@@ -0,0 +1,107 @@
+import unittest
+import os
+
+import torch
+import numpy as np
+from skimage.io import imread
+
+import neural_renderer as nr
+import utils
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+data_dir = os.path.join(current_dir, 'data')
+
+
+class TestRasterizeCPU(unittest.TestCase):
+    def test_case1(self):
+        """Face index map and weight map of two overlapping triangles, the nearer one wins."""
+
+        faces = [
+            [[-0.8, -0.8, 2.], [0.8, -0.8, 2.], [-0.8, 0.8, 2.]],
+            [[-0.4, -0.4, 1.], [0.4, -0.4, 1.], [-0.4, 0.4, 1.]],
+        ]
+        faces = torch.from_numpy(np.array(faces, np.float32))[None]
+
+        fim, wim = nr.rasterize_face_index_map_and_weight_map(faces, image_size=64, anti_aliasing=False,
+                                                              backend='cpu')
+        fim = fim[0].numpy()
+        wim = wim[0].numpy()
+
+        assert(fim.dtype == np.int32)
+        assert(wim.shape == (64, 64, 3))
+        # center pixel is covered by the nearer face, corners are background
+        assert(fim[32, 20] == 1)
+        assert(fim[55, 10] == 0)
+        assert(fim[0, 63] == -1 and fim[63, 63] == -1)
+        assert(np.allclose(wim[fim >= 0].sum(-1), 1, atol=1e-5))
+        assert(np.allclose(wim[fim < 0], 0))
+
+    def test_case2(self):
+        """Backside faces are culled and silhouettes equal to fim >= 0."""
+
+        faces = [[[-0.8, -0.8, 1.], [-0.8, 0.8, 1.], [0.8, -0.8, 1.]]]
+        faces = torch.from_numpy(np.array(faces, np.float32))[None]
+
+        fim = nr.rasterize_face_index_map(faces, image_size=32, anti_aliasing=False, backend='cpu')
+        assert((fim == -1).all())
+
+        faces = faces[:, :, [0, 2, 1]]
+        fim = nr.rasterize_face_index_map(faces, image_size=32, anti_aliasing=False, backend='cpu')
+        alpha = nr.rasterize_silhouettes(faces, image_size=32, anti_aliasing=False, backend='cpu')
+        assert(np.allclose((fim >= 0).float().numpy(), alpha.numpy()))
+
+    def test_incremental(self):
+        """Incremental fim / wim of moving triangles equal the full render of every frame, for any batch size."""
+
+        rng = np.random.RandomState(0)
+        centers = rng.uniform(-0.9, 0.9, (40, 1, 2))
+        offsets = np.array([[-0.1, -0.1], [0.1, -0.1], [-0.1, 0.1]])
+        depths = rng.uniform(1., 3., (40, 1, 1)).repeat(3, axis=2)
+
+        # a few triangles move in every frame, one of them is off screen in the last frames.
+        frames = []
+        for t in range(8):
+            moved = rng.rand(40, 1, 1) < 0.1
+            centers = centers + moved * rng.uniform(-0.2, 0.2, (40, 1, 2))
+            if t >= 6:
+                centers[0] = 3.
+            frames.append(np.concatenate([centers + offsets, depths], axis=-1))
+        frames = torch.from_numpy(np.stack(frames).astype(np.float32))
+
+        rasterizer = nr.IncrementalRasterizer(image_size=128, near=0.1, far=100)
+        start = 0
+        for bs in [1, 3, 2, 2]:
+            faces = frames[start:start + bs]
+            start += bs
+
+            fim, wim = rasterizer(faces)
+            fim_full, wim_full = nr.rasterize_face_index_map_and_weight_map(faces, image_size=128,
+                                                                            anti_aliasing=False, backend='cpu')
+            assert(torch.equal(fim, fim_full))
+            assert(torch.equal(wim, wim_full))
+            if start > 1:
+                assert(rasterizer.dirty_ratio < 1)
+
+    @unittest.skipUnless(torch.cuda.is_available(), 'load_obj requires cuda')
+    def test_teapot(self):
+        """Silhouette matches that by Blender and fim / wim match the cuda kernel."""
+
+        vertices, faces, _ = utils.load_teapot_batch()
+        vertices = nr.look_at(vertices, [0, 0, -(1. / np.tan(np.radians(30)) + 1)])
+        vertices = nr.perspective(vertices, angle=30)
+        faces = nr.vertices_to_faces(vertices, faces)
+
+        alpha = nr.rasterize_silhouettes(faces.cpu(), image_size=256, anti_aliasing=False, backend='cpu')
+        ref = imread(os.path.join(data_dir, 'teapot_blender.png'))
+        ref = (ref.min(-1) != 255).astype(np.float32)
+        assert(np.allclose(ref, alpha[2].numpy()))
+
+        fim, wim = nr.rasterize_face_index_map_and_weight_map(faces.cpu(), 256, False, backend='cpu')
+        fim_cuda, wim_cuda = nr.rasterize_face_index_map_and_weight_map(faces, 256, False, backend='cuda')
+        assert((fim != fim_cuda.cpu()).float().mean() < 1e-3)
+        same = fim == fim_cuda.cpu()
+        assert(np.allclose(wim[same].numpy(), wim_cuda.cpu()[same].numpy(), atol=1e-4))
+
+
+if __name__ == '__main__':
+    unittest.main()
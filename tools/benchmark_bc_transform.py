@@ -0,0 +1,85 @@
+import argparse
+import time
+import torch
+
+from utils.nmr import SMPLRenderer
+
+
+def loop_bc_transform(image_size, src_f2pts, dst_fims, dst_wims):
+    """
+    The per-sample implementation of SMPLRenderer.cal_bc_transform before batching, used as the reference.
+    """
+    bs = src_f2pts.shape[0]
+    T = -2 * torch.ones((bs, image_size * image_size, 2), dtype=torch.float32, device=src_f2pts.device)
+
+    for i in range(bs):
+        to_face_index_map = dst_fims[i].long().reshape(-1)
+        to_weight_map = dst_wims[i].reshape(-1, 3)
+
+        to_exist_mask = (to_face_index_map != -1)
+        to_exist_face_idx = to_face_index_map[to_exist_mask]
+        to_exist_face_weights = to_weight_map[to_exist_mask]
+
+        exist_smpl_T = (src_f2pts[i][to_exist_face_idx] * to_exist_face_weights[:, :, None]).sum(dim=1)
+        T[i, to_exist_mask] = exist_smpl_T
+
+    return T.view(bs, image_size, image_size, 2)
+
+
+def random_inputs(bs, image_size, nf, device):
+    src_f2pts = torch.rand(bs, nf, 3, 2, device=device) * 2 - 1
+
+    # roughly half of the pixels are covered by the body
+    dst_fims = torch.randint(0, nf, (bs, image_size, image_size), device=device).int()
+    dst_fims[torch.rand(bs, image_size, image_size, device=device) < 0.5] = -1
+
+    dst_wims = torch.rand(bs, image_size, image_size, 3, device=device)
+    dst_wims = dst_wims / dst_wims.sum(dim=-1, keepdim=True)
+    dst_wims[dst_fims == -1] = 0
+
+    return src_f2pts, dst_fims, dst_wims
+
+
+def timeit(func, repeats, device):
+    func()
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+
+    start = time.time()
+    for _ in range(repeats):
+        func()
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+
+    return (time.time() - start) / repeats * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--image_sizes', type=int, nargs='+', default=[256, 512])
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    print('{:>10} {:>6} {:>12} {:>12} {:>8}'.format('image_size', 'bs', 'loop (ms)', 'batch (ms)', 'speedup'))
+
+    for image_size in args.image_sizes:
+        render = SMPLRenderer(image_size=image_size).to(args.device)
+        nf = render.nf
+
+        for bs in args.batch_sizes:
+            src_f2pts, dst_fims, dst_wims = random_inputs(bs, image_size, nf, args.device)
+
+            with torch.no_grad():
+                ref_T = loop_bc_transform(image_size, src_f2pts, dst_fims, dst_wims)
+                T = render.cal_bc_transform(src_f2pts, dst_fims, dst_wims)
+                assert torch.allclose(ref_T, T, atol=1e-6)
+
+                loop_ms = timeit(lambda: loop_bc_transform(image_size, src_f2pts, dst_fims, dst_wims), args.repeats,
+                                 args.device)
+                batch_ms = timeit(lambda: render.cal_bc_transform(src_f2pts, dst_fims, dst_wims), args.repeats,
+                                  args.device)
+
+            print('{:>10} {:>6} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(image_size, bs, loop_ms, batch_ms,
+                                                                       loop_ms / batch_ms))
@@ -0,0 +1,25 @@
+import argparse
+import time
+
+from utils.mesh_bundle import MESH_BUNDLE_PATH, DEFAULT_SOURCES, compile_mesh_bundle, load_mesh_bundle
+from utils.nmr import SMPLRenderer
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--output', type=str, default=MESH_BUNDLE_PATH)
+parser.add_argument('--tex_sizes', type=int, nargs='+', default=[3])
+for name, path in DEFAULT_SOURCES.items():
+    parser.add_argument('--' + name, type=str, default=path)
+args = parser.parse_args()
+
+
+if __name__ == '__main__':
+    sources = {name: getattr(args, name) for name in DEFAULT_SOURCES}
+    names = compile_mesh_bundle(args.output, tex_sizes=args.tex_sizes, **sources)
+    print('{} arrays are compiled into {}.'.format(len(names), args.output))
+
+    if args.output == MESH_BUNDLE_PATH and load_mesh_bundle() is not None:
+        start = time.time()
+        SMPLRenderer(face_path=args.face_path, uv_map_path=args.mapping_path, tex_size=args.tex_sizes[0],
+                     has_front=True)
+        print('SMPLRenderer is created in {:.1f} ms.'.format((time.time() - start) * 1000))
@@ -3,6 +3,9 @@ import glob
 from tqdm import tqdm
 
 
+# The extraction is optional, `ImPerDataset` (with `--images_folder` pointing to the videos) and
+# `run_imitator.py --tgt_path xxx.mp4` decode the frames of the videos on the fly.
+
 # Replacing them as your own folder
 dataset_video_root_path = '/p300/tpami/iPER_examples/iPER_256_video_release'
 save_images_root_path = '/p300/tpami/iPER_examples/images'
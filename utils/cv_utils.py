@@ -1,6 +1,7 @@
 import cv2
 from matplotlib import pyplot as plt
 import numpy as np
+import torch
 
 
 HMR_IMG_SIZE = 224
@@ -20,6 +21,45 @@ def read_cv2_img(path):
     return img
 
 
+def read_img(image):
+    """
+    Reads an image from a path, or takes an in-memory frame.
+
+    Args:
+        image (str or np.ndarray or torch.Tensor): the path of the image, a (h, w, 3) RGB uint8 frame, or a
+            (3, h, w) RGB float frame in [0, 1].
+
+    Returns:
+        img (np.ndarray): (h, w, 3), RGB, uint8. The uint8 frames (and the uint8 cpu tensors) are not copied.
+    """
+    if isinstance(image, str):
+        return read_cv2_img(image)
+
+    if torch.is_tensor(image):
+        # shares the memory with the cpu tensors
+        image = image.detach().cpu().numpy()
+
+    if image.dtype == np.uint8:
+        assert image.ndim == 3 and image.shape[2] == 3, 'the uint8 frames must be (h, w, 3), RGB.'
+        return image
+
+    assert image.ndim == 3 and image.shape[0] == 3, 'the float frames must be (3, h, w), RGB, in [0, 1].'
+    img = np.clip(image.transpose((1, 2, 0)), 0, 1) * 255 + 0.5
+    return img.astype(np.uint8)
+
+
+def to_uint8_img(img):
+    """
+    Args:
+        img (np.ndarray): (h, w, 3), RGB, in [-1, 1], e.g, the predictions of the models.
+
+    Returns:
+        img (np.ndarray): (h, w, 3), RGB, uint8.
+    """
+    img = np.clip((img + 1) / 2.0, 0, 1) * 255
+    return img.astype(np.uint8)
+
+
 def save_cv2_img(img, path, image_size=None, normalize=False):
     img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
 
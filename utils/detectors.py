@@ -22,7 +22,7 @@ class PersonMaskRCNNDetector(object):
 
     PERSON_IDS = 1
 
-    def __init__(self, ks=3, threshold=0.5, to_gpu=True):
+    def __init__(self, ks=3, threshold=0.5, to_gpu=True, device=None):
         super(PersonMaskRCNNDetector, self).__init__()
 
         self.model = torchvision.models.detection.maskrcnn_resnet50_fpn(pretrained=True)
@@ -32,9 +32,11 @@ class PersonMaskRCNNDetector(object):
         self.ks = ks
         self.kernel = torch.ones(1, 1, ks, ks, dtype=torch.float32)
 
-        if to_gpu:
-            self.model = self.model.cuda()
-            self.kernel = self.kernel.cuda()
+        if device is None:
+            device = 'cuda' if to_gpu else 'cpu'
+
+        self.model = self.model.to(device)
+        self.kernel = self.kernel.to(device)
 
     def forward(self, images):
         predictions = self.model(images)
@@ -84,6 +86,31 @@ class PersonMaskRCNNDetector(object):
 
             return pid_bboxs, final_masks
 
+    def batch_inference(self, imgs):
+        """
+        Args:
+            imgs (torch.Tensor): (bs, 3, h, w), [-1, 1].
+
+        Returns:
+            bboxs (list of torch.Tensor): the (4,) bounding box of the largest person of every image.
+            masks (torch.Tensor): (bs, 1, h, w), its mask.
+        """
+        img_list = [(img + 1) / 2.0 for img in imgs]
+
+        with torch.no_grad():
+            all_bboxs, all_masks = [], []
+            for predictions in self.forward(img_list):
+                pid = self.get_bbox_max_ids(predictions['labels'], predictions['boxes'])
+                all_bboxs.append(predictions['boxes'][pid])
+                all_masks.append(predictions['masks'][pid])
+
+            final_masks = (torch.stack(all_masks) > self.threshold).float()
+
+            if self.ks > 0:
+                final_masks = morph(final_masks, self.ks, mode='dilate', kernel=self.kernel)
+
+            return all_bboxs, final_masks
+
 
 
 
@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import torch
+from tqdm import tqdm
+
+import utils.cv_utils as cv_utils
+from utils.video import read_frame_batches
+
+
+class FanOutImitator(object):
+    """
+    Imitation of one reference motion by many sources. The smpls of the reference frames are estimated by hmr
+    once and stay on the device, the pose-dependent terms of SMPL are computed once per frame for all the
+    sources, and the shape-dependent ones once per source (by the shape cache of SMPL). Every generator batch
+    contains several frames of several sources.
+    """
+
+    def __init__(self, imitator, batch_size=8):
+        """
+        Args:
+            imitator (models.imitator.Imitator):
+            batch_size (int): the maximum number of (source, frame) pairs of a generator batch.
+        """
+        self.imitator = imitator
+        self.batch_size = batch_size
+
+        self.tgt_smpls = None
+        self.names = []
+
+    @torch.no_grad()
+    def set_reference(self, tgt_paths=None, tgt_smpls=None):
+        """
+        Args:
+            tgt_paths (list of str or utils.video.VideoReader or sequence of frames or None): the reference frames,
+                or a reference video, or the in-memory frames.
+            tgt_smpls (np.ndarray or None): (n, 85), if it is None, they are estimated by hmr on tgt_paths.
+        """
+        imitator = self.imitator
+
+        if tgt_smpls is not None:
+            self.tgt_smpls = torch.tensor(np.asarray(tgt_smpls), dtype=torch.float32).to(imitator._device)
+            self.names = ['%.8d.jpg' % t for t in range(len(tgt_smpls))]
+            return
+
+        self.names = []
+        all_smpls = []
+        for t, names, ori_imgs in read_frame_batches(tgt_paths, self.batch_size):
+            imgs_hmr = np.stack([cv_utils.transform_img(ori_img, 224, transpose=True) * 2 - 1.0
+                                 for ori_img in ori_imgs])
+            imgs_hmr = torch.tensor(imgs_hmr, dtype=torch.float32).to(imitator._device)
+            all_smpls.append(imitator.hmr(imgs_hmr))
+            self.names.extend(names)
+
+        self.tgt_smpls = torch.cat(all_smpls, dim=0)
+
+    @torch.no_grad()
+    def run(self, src_infos, cam_strategy='smooth', output_dirs=None, video_writers=None, verbose=True):
+        """
+        Args:
+            src_infos (list of dict): the personalized sources, see `Imitator.personalize_batch`.
+            cam_strategy (str):
+            output_dirs (list of str or None): the folder of the `pred_*` images of every source.
+            video_writers (list of utils.video.VideoWriter or None): the video of every source.
+            verbose (bool):
+        """
+        assert self.tgt_smpls is not None, 'set_reference must be called first.'
+
+        imitator = self.imitator
+        num_frames = len(self.tgt_smpls)
+        num_srcs = len(src_infos)
+
+        # the shape-dependent terms of all the sources stay in the cache.
+        imitator.hmr.smpl.set_shape_cache(True, max_size=max(16, num_srcs))
+        imitator.first_cam = self.tgt_smpls[0:1, 0:3].clone()
+
+        group_size = min(num_srcs, self.batch_size)
+        num_steps = max(1, self.batch_size // group_size)
+
+        process_bar = tqdm(total=num_frames * num_srcs) if verbose else None
+        for t in range(0, num_frames, num_steps):
+            tgt_smpls = self.tgt_smpls[t:t + num_steps]
+            n = len(tgt_smpls)
+
+            # the pose-dependent terms of these frames, shared by all the sources.
+            Rs, v_pose_offsets = imitator.hmr.smpl.pose_blend(tgt_smpls[:, 3:75].contiguous())
+
+            for start in range(0, num_srcs, group_size):
+                group = src_infos[start:start + group_size]
+                self._compute(group, tgt_smpls, (Rs, v_pose_offsets), cam_strategy, t, start,
+                              output_dirs, video_writers)
+
+                if process_bar is not None:
+                    process_bar.update(n * len(group))
+
+        if process_bar is not None:
+            process_bar.close()
+
+    def _compute(self, group, tgt_smpls, pose_blend, cam_strategy, t, start, output_dirs, video_writers):
+        imitator = self.imitator
+        n = len(tgt_smpls)
+        m = len(group)
+
+        # (m * n) pairs, the pair of the i-th source and the j-th frame is i * n + j.
+        tsf_smpl = torch.cat([imitator.swap_smpl(src_info['cam'], src_info['shape'], tgt_smpls, cam_strategy)
+                              for src_info in group], dim=0)
+        pose_blend = tuple(x.repeat(m, *([1] * (x.dim() - 1))) for x in pose_blend)
+
+        def expand(xs):
+            return torch.cat([x.expand(n, *x.shape[1:]) for x in xs], dim=0)
+
+        src_p2verts = expand([src_info['p2verts'] for src_info in group])
+        src_img = expand([src_info['img'] for src_info in group])
+        tsf_inputs = imitator.transfer_params_by_tsf_smpl(tsf_smpl, src_p2verts, src_img, pose_blend=pose_blend)
+
+        src_encoder_outs, src_resnet_outs = zip(*[src_info['feats'] for src_info in group])
+        src_feats = ([expand(xs) for xs in zip(*src_encoder_outs)],
+                     [expand(xs) for xs in zip(*src_resnet_outs)])
+        bg_img = expand([src_info['bg'] for src_info in group])
+
+        preds = imitator.forward(tsf_inputs, imitator.tsf_info['T'], src_feats=src_feats, bg_img=bg_img)
+        preds = preds.permute(0, 2, 3, 1).cpu().numpy()
+
+        for i in range(m):
+            s = start + i
+            for j in range(n):
+                pred = preds[i * n + j]
+                if video_writers is not None:
+                    video_writers[s].write(pred, normalize=True)
+
+                if output_dirs is not None:
+                    out_path = os.path.join(output_dirs[s], 'pred_' + self.names[t + j])
+                    cv_utils.save_cv2_img(pred, out_path, normalize=True)
@@ -1,3 +1,4 @@
+import inspect
 import itertools
 import numpy as np
 import torch
@@ -5,6 +6,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import json
 
+from utils.mesh_bundle import load_mesh_bundle
+
 
 def save_to_obj(verts, faces, path):
     """
@@ -25,6 +28,16 @@ def save_to_obj(verts, faces, path):
         fp.write('s off\n')
 
 
+def load_faces(face_path='assets/pretrains/smpl_faces.npy'):
+    """
+    Returns the (F, 3) faces of SMPL, from the mesh bundle if it is compiled from face_path.
+    """
+    bundle = load_mesh_bundle()
+    if bundle is not None and bundle.matches(face_path=face_path) and bundle.get('faces') is not None:
+        return bundle.get('faces')
+    return np.load(face_path)
+
+
 def load_obj(obj_file):
     with open(obj_file, 'r') as fp:
         verts = []
@@ -175,6 +188,13 @@ def get_f2vts(uv_mapping_path, fill_back=False):
     For this mesh, pre-computes the bary-center coords.
     Returns F x 2
     """
+    bundle = load_mesh_bundle()
+    if bundle is not None and bundle.matches(mapping_path=uv_mapping_path) and bundle.get('f2vts') is not None:
+        f2vts = bundle.get('f2vts')
+        if fill_back:
+            f2vts = np.concatenate((f2vts, f2vts[:, ::-1]), axis=0)
+        return f2vts
+
     obj_info = load_obj(uv_mapping_path)
 
     vts = obj_info['vts']
@@ -385,6 +405,14 @@ def create_mapping(map_name, mapping_path='assets/pretrains/mapper.txt',
     :return:
     """
 
+    # the compiled variant, see utils/mesh_bundle.py
+    bundle = load_mesh_bundle()
+    if bundle is not None and bundle.matches(mapping_path=mapping_path, part_info=part_info,
+                                             front_info=front_info, head_info=head_info):
+        map_fn = bundle.get('map/%s/%d' % (map_name, fill_back))
+        if map_fn is not None:
+            return map_fn if contain_bg else map_fn[:-1]
+
     # F x C
     f2vts = get_f2vts(mapping_path, fill_back=fill_back)
     nf = f2vts.shape[0]
@@ -426,6 +454,16 @@ def get_part_face_ids(part_type, mapping_path='assets/pretrains/mapper.txt',
                       front_info='assets/pretrains/front_face_1.json',
                       head_info='assets/pretrains/head.json',
                       fill_back=False):
+    # the compiled face ids, see utils/mesh_bundle.py
+    bundle = load_mesh_bundle()
+    if bundle is not None and bundle.matches(mapping_path=mapping_path, part_info=part_info,
+                                             part_front_info=front_info, head_info=head_info):
+        if part_type in ['head_front', 'head_back'] and bundle.get('%s/%d' % (part_type, fill_back)) is not None:
+            return bundle.get('%s/%d' % (part_type, fill_back)).tolist()
+        elif part_type == 'par' and '%d' % fill_back in bundle.part_names:
+            return {name: bundle.get('par/%d/%s' % (fill_back, name)).tolist()
+                    for name in bundle.part_names['%d' % fill_back]}
+
     # F x C
     f2vts = get_f2vts(mapping_path, fill_back=fill_back)
     nf = f2vts.shape[0]
@@ -531,6 +569,12 @@ def create_uvsampler(uv_mapping_path='data/uv_mappings.txt', tex_size=2):
     F x T x T points.
     Returns F x T*T x 2
     """
+    bundle = load_mesh_bundle()
+    if bundle is not None and bundle.matches(mapping_path=uv_mapping_path):
+        uv = bundle.get('uvsampler/%d' % tex_size)
+        if uv is not None:
+            return uv
+
     alpha = np.arange(tex_size, dtype=np.float32) / (tex_size - 1)
     beta = np.arange(tex_size, dtype=np.float32) / (tex_size - 1)
     # Barycentric coordinate values
@@ -615,7 +659,7 @@ class UVImageModel(nn.Module):
         self.f, self.t = uv.shape[:2]
         # (1, f, t*t, 2)
         uv = uv.reshape(1, self.f, self.t * self.t, 2)
-        self.uv = torch.FloatTensor(uv).cuda()
+        self.register_buffer('uv', torch.FloatTensor(uv))
 
     def forward(self):
         uv_image = torch.tanh(self.weight)
@@ -632,17 +676,21 @@ class UVImageModel(nn.Module):
         # return 2 * torch.sigmoid(self.weight) - 1
 
 
-def compute_uv_image(uv, texture, uv_size=224):
+def optimize_uv_image(uv, texture, uv_size=224, num_iters=2000):
     """
+    The uv image fitted by Adam, the texture sampled from it by grid_sample is the given one. It is slow,
+    use `compute_uv_image` instead, it is kept as the reference of the splatting solver.
+
     :param uv: (f, t, t, 2)
     :param texture: torch.Tensor [f, t, t, 3]
     :param uv_size: int, default is 224
+    :param num_iters: int, default is 2000
     :return: uv_image (3,h,w) rgb(-1,1)
     """
     with torch.enable_grad():
-        uv_image_model = UVImageModel(uv, image_size=uv_size).cuda()
+        uv_image_model = UVImageModel(uv, image_size=uv_size).to(texture.device)
         opt = torch.optim.Adam(uv_image_model.parameters(), lr=1e-2)
-        for epoch in range(2000):
+        for epoch in range(num_iters):
             pred_texture = uv_image_model()
 
             loss = ((pred_texture - texture) ** 2).mean()
@@ -653,4 +701,113 @@ def compute_uv_image(uv, texture, uv_size=224):
             # if epoch % 10 == 0:
             #     print(epoch, loss.item())
 
-    return uv_image_model.get_uv_image()[0]
+    return uv_image_model.get_uv_image()[0].detach()
+
+
+def fill_uv_holes(uv_image, mask, max_iters=256):
+    """
+    Fills the holes of the uv image by the average of their filled 3x3 neighbours, ring by ring.
+
+    :param uv_image: torch.Tensor (3, h, w)
+    :param mask: torch.Tensor (h, w), 1 for the filled pixels, 0 for the holes.
+    :param max_iters: int, the maximum number of rings, the remaining holes are -1.
+    :return: uv_image (3, h, w)
+    """
+    uv_image = uv_image * mask
+    mask = mask[None, None].to(uv_image.dtype)
+    uv_image = uv_image[None]
+
+    for _ in range(max_iters):
+        holes = mask == 0
+        if not holes.any():
+            break
+
+        # the sum of the filled neighbours and their count, avg pooling is sum / 9.
+        neighbours = F.avg_pool2d(uv_image, 3, stride=1, padding=1)
+        count = F.avg_pool2d(mask, 3, stride=1, padding=1)
+        ring = holes & (count > 0)
+        if not ring.any():
+            break
+
+        uv_image = torch.where(ring, neighbours / count.clamp(min=1e-8), uv_image)
+        mask = torch.where(ring, torch.ones_like(mask), mask)
+
+    return torch.where(mask > 0, uv_image, torch.full_like(uv_image, -1))[0]
+
+
+def grid_sample_align_corners():
+    """
+    :return: bool, the align_corners of F.grid_sample without the argument, True before torch 1.3 (which has no
+        such argument), False since.
+    """
+    return 'align_corners' not in inspect.signature(F.grid_sample).parameters
+
+
+def compute_uv_image(uv, texture, uv_size=224, fill_holes=True, align_corners=None):
+    """
+    The inverse of grid_sample(uv_image, uv): every texel is splatted into its 4 neighbouring pixels of the uv
+    image with the bilinear weights of grid_sample, and the pixels are normalized by their accumulated weights.
+    It is the direct counterpart of `optimize_uv_image`, in milliseconds on cpu.
+
+    :param uv: (f, t, t, 2), in [-1, 1], the same as the grid of grid_sample.
+    :param texture: torch.Tensor [f, t, t, 3]
+    :param uv_size: int, default is 224
+    :param fill_holes: bool, fill the pixels without texels from their neighbours, otherwise they are -1.
+    :param align_corners: bool or None, the align_corners of the grid_sample to invert, None for the behaviour of
+        F.grid_sample without the argument, the same as `UVImageModel`.
+    :return: uv_image (3,h,w) rgb(-1,1)
+    """
+    if align_corners is None:
+        align_corners = grid_sample_align_corners()
+
+    device = texture.device
+    dtype = texture.dtype
+
+    if not torch.is_tensor(uv):
+        uv = torch.tensor(np.array(uv))
+    uv = uv.to(device=device, dtype=dtype).reshape(-1, 2)
+    colors = texture.detach().reshape(-1, 3).to(dtype)
+
+    # the pixel coordinates of grid_sample
+    if align_corners:
+        px = (uv[:, 0] + 1) / 2 * (uv_size - 1)
+        py = (uv[:, 1] + 1) / 2 * (uv_size - 1)
+    else:
+        px = ((uv[:, 0] + 1) * uv_size - 1) / 2
+        py = ((uv[:, 1] + 1) * uv_size - 1) / 2
+
+    x0 = torch.floor(px)
+    y0 = torch.floor(py)
+    fx = px - x0
+    fy = py - y0
+    x0 = x0.long()
+    y0 = y0.long()
+
+    color_sum = torch.zeros(uv_size * uv_size, 3, dtype=dtype, device=device)
+    weight_sum = torch.zeros(uv_size * uv_size, dtype=dtype, device=device)
+
+    for dx, dy in itertools.product([0, 1], [0, 1]):
+        xi = x0 + dx
+        yi = y0 + dy
+        w = (fx if dx else 1 - fx) * (fy if dy else 1 - fy)
+
+        # the corners outside the image are the zero padding of grid_sample.
+        valid = (xi >= 0) & (xi < uv_size) & (yi >= 0) & (yi < uv_size) & (w > 0)
+        pix = yi[valid] * uv_size + xi[valid]
+        w = w[valid]
+
+        color_sum.index_add_(0, pix, colors[valid] * w[:, None])
+        weight_sum.index_add_(0, pix, w)
+
+    # (3, h, w)
+    mask = (weight_sum > 1e-6).view(uv_size, uv_size)
+    uv_image = color_sum / weight_sum.clamp(min=1e-6)[:, None]
+    uv_image = uv_image.clamp(-1, 1).t().reshape(3, uv_size, uv_size)
+
+    if fill_holes:
+        uv_image = fill_uv_holes(uv_image, mask.to(dtype))
+    else:
+        uv_image = torch.where(mask[None], uv_image, torch.full_like(uv_image, -1))
+
+    return uv_image
+
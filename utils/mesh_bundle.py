@@ -0,0 +1,203 @@
+import os
+import json
+import struct
+import numpy as np
+
+
+MESH_BUNDLE_PATH = 'assets/pretrains/mesh_bundle.bin'
+
+MAGIC = b'IMPMESH1'
+ALIGNMENT = 64
+
+# the map_name variants of `mesh.create_mapping`.
+MAP_NAMES = ['uv', 'seg', 'uv_seg', 'par', 'front', 'head', 'back', 'ids', 'binary']
+
+# the default assets, the same as the ones of SMPLRenderer, mesh.create_mapping and mesh.get_part_face_ids.
+DEFAULT_SOURCES = {
+    'face_path': 'assets/pretrains/smpl_faces.npy',
+    'mapping_path': 'assets/pretrains/mapper.txt',
+    'part_info': 'assets/pretrains/smpl_part_info.json',
+    'front_info': 'assets/pretrains/front_facial.json',
+    'head_info': 'assets/pretrains/head.json',
+    'part_front_info': 'assets/pretrains/front_face_1.json'
+}
+
+_bundles = dict()
+_enabled = [True]
+
+
+def _align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _file_stamp(path):
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, int(stat.st_mtime)]
+
+
+class MeshBundle(object):
+    """
+    The mesh / UV assets compiled into a single binary file: the faces, f2vts, the uv samplers, every
+    `map_fn` variant of `mesh.create_mapping` and the part / head face ids of `mesh.get_part_face_ids`.
+
+    The file is a header (json) followed by the raw arrays, every array is a read-only view of one memory
+    map, so loading it only reads the header, and the pages are shared by the dataloader workers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mmap = np.memmap(path, dtype=np.uint8, mode='r')
+
+        magic = self._mmap[0:len(MAGIC)].tobytes()
+        if magic != MAGIC:
+            raise ValueError('{} is not a mesh bundle.'.format(path))
+
+        start = len(MAGIC) + 8
+        header_size = struct.unpack('<Q', self._mmap[len(MAGIC):start].tobytes())[0]
+        header = json.loads(self._mmap[start:start + header_size].tobytes().decode('utf-8'))
+
+        self.data_start = _align(start + header_size)
+        self.sources = header['sources']
+        self.arrays = header['arrays']
+        self.part_names = header['part_names']
+
+    def matches(self, **paths):
+        """
+        Args:
+            **paths: the asset paths of the caller, e.g, mapping_path='assets/pretrains/mapper.txt'.
+
+        Returns:
+            bool: the bundle is compiled from these files, and they are not modified since then.
+        """
+        for name, path in paths.items():
+            stamp = self.sources.get(name)
+            if stamp is None or stamp != _file_stamp(path):
+                return False
+        return True
+
+    def get(self, name):
+        """
+        Args:
+            name (str): the name of the array, e.g, `map/uv_seg/0`.
+
+        Returns:
+            np.ndarray or None: the read-only array, None if it is not in the bundle.
+        """
+        if name not in self.arrays:
+            return None
+
+        dtype, shape, offset = self.arrays[name]
+        dtype = np.dtype(dtype)
+        offset += self.data_start
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self._mmap[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+def load_mesh_bundle(path=MESH_BUNDLE_PATH):
+    """
+    Args:
+        path (str): the path of the bundle.
+
+    Returns:
+        MeshBundle or None: the bundle (one per process and path), None if it does not exist.
+    """
+    if not _enabled[0]:
+        return None
+
+    key = os.path.abspath(path)
+    if key not in _bundles:
+        _bundles[key] = MeshBundle(path) if os.path.isfile(path) else None
+    return _bundles[key]
+
+
+def compile_mesh_bundle(out_path=MESH_BUNDLE_PATH, tex_sizes=(3,), **sources):
+    """
+    Parses the OBJ and json assets once and writes them into a bundle. The variants whose assets are missing
+    are skipped, the functions of `mesh` fall back to the original assets for them.
+
+    Args:
+        out_path (str): the path of the bundle.
+        tex_sizes (tuple of int): the tex sizes of the uv samplers, the others are computed on the fly.
+        **sources: the asset paths overriding DEFAULT_SOURCES.
+
+    Returns:
+        names (list of str): the names of the compiled arrays.
+    """
+    import utils.mesh as mesh
+
+    paths = dict(DEFAULT_SOURCES, **sources)
+    arrays = dict()
+    part_names = dict()
+
+    def try_add(name, fn):
+        try:
+            arrays[name] = np.ascontiguousarray(fn())
+        except (IOError, OSError, AssertionError, KeyError):
+            print('skip {} of the mesh bundle.'.format(name))
+
+    # the functions of mesh must parse the assets, not read a previous bundle.
+    _enabled[0] = False
+    try:
+        try_add('faces', lambda: np.load(paths['face_path']))
+        try_add('f2vts', lambda: mesh.get_f2vts(paths['mapping_path'], fill_back=False))
+
+        for tex_size in tex_sizes:
+            try_add('uvsampler/%d' % tex_size,
+                    lambda: mesh.create_uvsampler(paths['mapping_path'], tex_size=tex_size).astype(np.float32))
+
+        for fill_back in [False, True]:
+            fb = int(fill_back)
+            for map_name in MAP_NAMES:
+                try_add('map/%s/%d' % (map_name, fb),
+                        lambda: mesh.create_mapping(map_name, paths['mapping_path'], part_info=paths['part_info'],
+                                                    front_info=paths['front_info'], head_info=paths['head_info'],
+                                                    contain_bg=True, fill_back=fill_back))
+
+            face_ids_args = dict(mapping_path=paths['mapping_path'], part_info=paths['part_info'],
+                                 front_info=paths['part_front_info'], head_info=paths['head_info'],
+                                 fill_back=fill_back)
+
+            try_add('head_front/%d' % fb, lambda: np.array(mesh.get_part_face_ids('head_front', **face_ids_args),
+                                                           dtype=np.int64))
+            try_add('head_back/%d' % fb, lambda: np.array(mesh.get_part_face_ids('head_back', **face_ids_args),
+                                                          dtype=np.int64))
+            try:
+                part_faces = mesh.get_part_face_ids('par', **face_ids_args)
+                part_names['%d' % fb] = list(part_faces.keys())
+                for part_name, faces in part_faces.items():
+                    arrays['par/%d/%s' % (fb, part_name)] = np.array(faces, dtype=np.int64)
+            except (IOError, OSError, AssertionError):
+                print('skip par/{} of the mesh bundle.'.format(fb))
+    finally:
+        _enabled[0] = True
+
+    # the offsets are relative to the data section, which starts at the first aligned byte after the header.
+    table = dict()
+    offset = 0
+    for name, array in arrays.items():
+        table[name] = [array.dtype.str, list(array.shape), offset]
+        offset += _align(array.nbytes)
+
+    header = {
+        'sources': {name: _file_stamp(path) for name, path in paths.items()},
+        'arrays': table,
+        'part_names': part_names
+    }
+    header = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = '%s.tmp.%d' % (out_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b'\0' * (data_start + table[name][2] - f.tell()))
+            f.write(array.tobytes())
+    os.rename(tmp_path, out_path)
+
+    _bundles.pop(os.path.abspath(out_path), None)
+
+    return list(arrays.keys())
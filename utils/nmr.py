@@ -104,7 +104,7 @@ class SMPLRenderer(nn.Module):
     def __init__(self, face_path='assets/pretrains/smpl_faces.npy',
                  uv_map_path='assets/pretrains/mapper.txt', map_name='uv_seg', tex_size=3, image_size=256,
                  anti_aliasing=True, fill_back=False, background_color=(0, 0, 0), viewing_angle=30, near=0.1, far=25.0,
-                 has_front=False):
+                 has_front=False, backend='auto'):
         """
         Args:
             face_path:
@@ -119,6 +119,8 @@ class SMPLRenderer(nn.Module):
             near:
             far:
             has_front:
+            backend: the rasterizer backend of render_fim / render_fim_wim / render_silhouettes,
+                'auto', 'cuda' or 'cpu', see nr.select_backend.
         """
 
         super(SMPLRenderer, self).__init__()
@@ -129,7 +131,7 @@ class SMPLRenderer(nn.Module):
         self.fill_back = fill_back
         self.map_name = map_name
 
-        faces = np.load(face_path)
+        faces = mesh.load_faces(face_path)
         self.tex_size = tex_size
         self.base_nf = faces.shape[0]
         self.register_buffer('coords', self.create_coords(tex_size))
@@ -168,6 +170,7 @@ class SMPLRenderer(nn.Module):
         self.light_direction = [0, 1, 0]
 
         self.rasterizer_eps = 1e-3
+        self.rasterizer_backend = backend
 
         # project function and camera
         self.near = near
@@ -176,6 +179,12 @@ class SMPLRenderer(nn.Module):
         self.viewing_angle = viewing_angle
         self.eye = [0, 0, -(1. / np.tan(np.radians(self.viewing_angle)) + 1)]
 
+        # the scratch buffers of plan_warp, reused between the frames.
+        self._scratch = dict()
+
+        # the dirty-tile rasterizer of the consecutive frames, see `set_incremental`.
+        self.incremental_rasterizer = None
+
     def set_ambient_light(self, int_dir=0.3, int_amb=0.7, direction=(1, 0.5, 1)):
         self.light_intensity_directional = int_dir
         self.light_intensity_ambient = int_amb
@@ -186,8 +195,7 @@ class SMPLRenderer(nn.Module):
         self.background_color = color
 
     def set_tex_size(self, tex_size):
-        del self.coords
-        self.coords = self.create_coords(tex_size).cuda()
+        self.coords = self.create_coords(tex_size).to(self.faces.device)
 
     def forward(self, cam, vertices, uv_imgs, dynamic=True, get_fim=False):
         bs = cam.shape[0]
@@ -239,7 +247,8 @@ class SMPLRenderer(nn.Module):
         fim = None
         if get_fim:
             fim = nr.rasterize_face_index_map(faces, image_size=self.image_size, anti_aliasing=False,
-                                              near=self.near, far=self.far, eps=self.rasterizer_eps)
+                                              near=self.near, far=self.far, eps=self.rasterizer_eps,
+                                              backend=self.rasterizer_backend)
 
         return images, fim
 
@@ -257,10 +266,26 @@ class SMPLRenderer(nn.Module):
 
         # rasterization
         faces = nr.vertices_to_faces(vertices, faces)
-        fim = nr.rasterize_face_index_map(faces, self.image_size, False)
+        fim = nr.rasterize_face_index_map(faces, self.image_size, False, backend=self.rasterizer_backend)
         return fim
 
-    def render_fim_wim(self, cam, vertices, faces=None):
+    def set_incremental(self, enable=True):
+        """
+        Enables the incremental rasterization of render_fim_wim(incremental=True): only the screen tiles touched
+        by the faces moved since the previous call are rasterized again, into the fim / wim of the previous call.
+        It always uses the pure pytorch tile rasterizer (on any device), see `nr.IncrementalRasterizer`. The samples
+        of the batches are taken as consecutive frames, so it pays off for the frames of one sequence in order, e.g,
+        `Imitator.inference`, with any batch size.
+
+        Args:
+            enable (bool):
+        """
+        if enable:
+            self.incremental_rasterizer = nr.IncrementalRasterizer(self.image_size, self.near, self.far)
+        else:
+            self.incremental_rasterizer = None
+
+    def render_fim_wim(self, cam, vertices, faces=None, incremental=False):
         if faces is None:
             bs = cam.shape[0]
             faces = self.faces.repeat(bs, 1, 1)
@@ -274,7 +299,11 @@ class SMPLRenderer(nn.Module):
 
         # rasterization
         faces = nr.vertices_to_faces(vertices, faces)
-        fim, wim = nr.rasterize_face_index_map_and_weight_map(faces, self.image_size, False)
+        if incremental and self.incremental_rasterizer is not None:
+            fim, wim = self.incremental_rasterizer(faces)
+        else:
+            fim, wim = nr.rasterize_face_index_map_and_weight_map(faces, self.image_size, False,
+                                                                  backend=self.rasterizer_backend)
         return faces, fim, wim
 
     def render_depth(self, cam, vertices):
@@ -306,7 +335,7 @@ class SMPLRenderer(nn.Module):
 
         # rasterization
         faces = nr.vertices_to_faces(vertices, faces)
-        images = nr.rasterize_silhouettes(faces, self.image_size, self.anti_aliasing)
+        images = nr.rasterize_silhouettes(faces, self.image_size, self.anti_aliasing, backend=self.rasterizer_backend)
         return images
 
     def infer_face_index_map(self, cam, vertices):
@@ -480,7 +509,7 @@ class SMPLRenderer(nn.Module):
         else:
             step = 1 / (tex_size - 1)
 
-        alpha_beta = torch.arange(0, 1+step, step, dtype=torch.float32).cuda()
+        alpha_beta = torch.arange(0, 1+step, step, dtype=torch.float32)
         xv, yv = torch.meshgrid([alpha_beta, alpha_beta])
 
         coords = torch.stack([xv.flatten(), yv.flatten()], dim=0)
@@ -504,153 +533,115 @@ class SMPLRenderer(nn.Module):
         return grid
 
     @staticmethod
-    def get_vis_f2pts(f2pts, fims):
+    def visible_faces(fims, nf):
         """
+        The batched visibility table of the faces, built by a scatter over the face index maps, without sorting
+        them or synchronizing with the host.
+
         Args:
-            f2pts: (bs, f, 3, 2) or (bs, f, 3, 3)
-            fims:  (bs, 256, 256)
+            fims (torch.Tensor): (bs, h, w), -1 for background.
+            nf (int): the number of faces.
 
         Returns:
-
+            vis (torch.Tensor): (bs, nf), bool, the faces visible in every face index map.
         """
-
-        def get_vis(orig_f2pts, fim):
-            """
-            Args:
-                orig_f2pts: (f, 3, 2) or (f, 3, 3)
-                fim: (256, 256)
-
-            Returns:
-                vis_f2pts: (f, 3, 2)
-            """
-            vis_f2pts = torch.zeros_like(orig_f2pts) - 2.0
-            # 0 is -1
-            face_ids = fim.unique()[1:].long()
-            vis_f2pts[face_ids] = orig_f2pts[face_ids]
-
-            return vis_f2pts
-
-        # import ipdb
-        # ipdb.set_trace()
-        if f2pts.dim() == 4:
-            all_vis_f2pts = []
-            bs = f2pts.shape[0]
-            for i in range(bs):
-                all_vis_f2pts.append(get_vis(f2pts[i], fims[i]))
-
-            all_vis_f2pts = torch.stack(all_vis_f2pts, dim=0)
-
-        else:
-            all_vis_f2pts = get_vis(f2pts, fims)
-
-        return all_vis_f2pts
+        bs = fims.shape[0]
+        # the index 0 is the background (-1).
+        # scatter_ of bool tensors needs torch >= 1.3.
+        vis = torch.zeros(bs, nf + 1, dtype=torch.uint8, device=fims.device)
+        vis.scatter_(1, fims.long().view(bs, -1) + 1, 1)
+        return vis[:, 1:] != 0
 
     @staticmethod
-    def set_null_f2pts(f2pts, fims):
+    def get_vis_f2pts(f2pts, fims, vis=None):
         """
         Args:
-            f2pts: (bs, f, 3, 2) or (bs, f, 3, 3)
-            fims:  (bs, 256, 256)
+            f2pts: (bs, f, 3, 2) or (bs, f, 3, 3), or (f, 3, 2) or (f, 3, 3)
+            fims:  (bs, 256, 256), or (256, 256)
+            vis: (bs, f), the visibility table of fims if it is already computed, see `visible_faces`.
 
         Returns:
-
+            vis_f2pts: the same shape as f2pts, the invisible faces are -2.
         """
+        if f2pts.dim() == 3:
+            return SMPLRenderer.get_vis_f2pts(f2pts[None], fims[None], vis=vis)[0]
 
-        def get_vis(orig_f2pts, fim):
-            """
-            Args:
-                orig_f2pts: (f, 3, 2) or (f, 3, 3)
-                fim: (256, 256)
+        if vis is None:
+            vis = SMPLRenderer.visible_faces(fims, f2pts.shape[1])
 
-            Returns:
-                vis_f2pts: (f, 3, 2)
-            """
-            # 0 is -1
-            face_ids = fim.unique()[1:].long()
-            orig_f2pts[face_ids] = -2.0
+        return f2pts.masked_fill(~vis[:, :, None, None], -2.0)
 
-            return orig_f2pts
+    @staticmethod
+    def set_null_f2pts(f2pts, fims, vis=None):
+        """
+        Args:
+            f2pts: (bs, f, 3, 2) or (bs, f, 3, 3), or (f, 3, 2) or (f, 3, 3)
+            fims:  (bs, 256, 256), or (256, 256)
+            vis: (bs, f), the visibility table of fims if it is already computed, see `visible_faces`.
 
-        if f2pts.dim() == 4:
-            all_vis_f2pts = []
-            bs = f2pts.shape[0]
-            for i in range(bs):
-                all_vis_f2pts.append(get_vis(f2pts[i], fims[i]))
+        Returns:
+            f2pts: the visible faces are set to -2 in place.
+        """
+        if f2pts.dim() == 3:
+            SMPLRenderer.set_null_f2pts(f2pts[None], fims[None], vis=vis)
+            return f2pts
 
-            all_vis_f2pts = torch.stack(all_vis_f2pts, dim=0)
+        if vis is None:
+            vis = SMPLRenderer.visible_faces(fims, f2pts.shape[1])
 
-        else:
-            all_vis_f2pts = get_vis(f2pts, fims)
-
-        return all_vis_f2pts
+        return f2pts.masked_fill_(vis[:, :, None, None], -2.0)
 
     def cal_transform(self, bc_f2pts, src_fim, dst_fim):
         """
         Args:
-            bc_f2pts:
+            bc_f2pts: (bs, nf, 2)
             src_fim:
-            dst_fim:
+            dst_fim: (bs, image_size, image_size)
 
         Returns:
-
+            T: (bs, image_size, image_size, 2), -2 for background.
         """
-        device = bc_f2pts.device
-        bs = src_fim.shape[0]
-        # T = renderer.init_T.repeat(bs, 1, 1, 1)    # (bs, image_size, image_size, 2)
-        T = (torch.zeros(bs, self.image_size, self.image_size, 2, device=device) - 2)
-        # 2. calculate occlusion flows, (bs, no, 2)
-        dst_ids = dst_fim != -1
-
-        # 3. calculate tgt flows, (bs, nt, 2)
-
-        for i in range(bs):
-            Ti = T[i]
+        bs, nf = bc_f2pts.shape[0:2]
 
-            tgt_i = dst_ids[i]
+        # (bs, h, w), global face index in the flattened (bs * nf) faces
+        dst_ids = dst_fim.long()
+        exist_mask = (dst_ids != -1)
+        face_offset = torch.arange(bs, device=dst_ids.device).view(bs, 1, 1) * nf
+        dst_ids = dst_ids.clamp(min=0) + face_offset
 
-            # (nf, 2)
-            tgt_flows = bc_f2pts[i, dst_fim[i, tgt_i].long()]  # (nt, 2)
-            Ti[tgt_i] = tgt_flows
+        # (bs * nf, 2)[(bs, h, w)] -> (bs, h, w, 2)
+        T = bc_f2pts.reshape(bs * nf, -1)[dst_ids]
+        T = T.masked_fill(~exist_mask[..., None], -2)
 
         return T
 
     def cal_bc_transform(self, src_f2pts, dst_fims, dst_wims):
         """
         Args:
-            src_f2pts: (bs, 13776, 3, 2)
+            src_f2pts: (bs, 13776, 3, 2) or (1, 13776, 3, 2)
             dst_fims:  (bs, 256, 256)
             dst_wims:  (bs, 256, 256, 3)
         Returns:
-
+            T: (bs, 256, 256, 2), -2 for background.
         """
-        bs = src_f2pts.shape[0]
-        T = -2 * torch.ones((bs, self.image_size * self.image_size, 2), dtype=torch.float32, device=src_f2pts.device)
-
-        for i in range(bs):
-            # (13776, 3, 2)
-            from_faces_verts_on_img = src_f2pts[i]
-
-            # to_face_index_map
-            to_face_index_map = dst_fims[i]
+        bs = dst_fims.shape[0]
+        src_bs, nf = src_f2pts.shape[0:2]
 
-            # to_weight_map
-            to_weight_map = dst_wims[i]
+        # (bs, 256, 256) -> (bs, 256*256), global face index in the flattened (src_bs * 13776) faces,
+        # a single source (src_bs = 1) is shared by all the bs targets.
+        to_face_index_map = dst_fims.long().reshape(bs, -1)
+        to_exist_mask = (to_face_index_map != -1)
+        to_face_index_map = to_face_index_map.clamp(min=0)
+        if src_bs != 1:
+            to_face_index_map = to_face_index_map + torch.arange(bs, device=to_face_index_map.device)[:, None] * nf
 
-            # (256, 256) -> (256*256, )
-            to_face_index_map = to_face_index_map.long().reshape(-1)
-            # (256, 256, 3) -> (256*256, 3)
-            to_weight_map = to_weight_map.reshape(-1, 3)
+        # (bs, 256, 256, 3) -> (bs, 256*256, 3, 1)
+        to_weight_map = dst_wims.reshape(bs, -1, 3, 1)
 
-            to_exist_mask = (to_face_index_map != -1)
-            # (exist_face_num,)
-            to_exist_face_idx = to_face_index_map[to_exist_mask]
-            # (exist_face_num, 3)
-            to_exist_face_weights = to_weight_map[to_exist_mask]
-
-            # (exist_face_num, 3, 2) * (exist_face_num, 3) -> sum -> (exist_face_num, 2)
-            exist_smpl_T = (from_faces_verts_on_img[to_exist_face_idx] * to_exist_face_weights[:, :, None]).sum(dim=1)
-            # (256, 256, 2)
-            T[i, to_exist_mask] = exist_smpl_T
+        # (bs * 13776, 3, 2)[(bs, 256*256)] -> (bs, 256*256, 3, 2) * (bs, 256*256, 3, 1) -> sum -> (bs, 256*256, 2)
+        from_faces_verts_on_img = src_f2pts.reshape(src_bs * nf, 3, -1)
+        T = (from_faces_verts_on_img[to_face_index_map] * to_weight_map).sum(dim=2)
+        T = T.masked_fill(~to_exist_mask[..., None], -2)
 
         T = T.view(bs, self.image_size, self.image_size, 2)
 
@@ -658,5 +649,124 @@ class SMPLRenderer(nn.Module):
 
         return T
 
+    def _scratch_buffer(self, name, numel, dtype, device):
+        key = (name, dtype, device)
+        buffer = self._scratch.get(key)
+        if buffer is None or buffer.numel() < numel:
+            buffer = torch.empty(numel, dtype=dtype, device=device)
+            self._scratch[key] = buffer
+        return buffer[:numel]
+
+    @staticmethod
+    def erode(bg_mask, ks):
+        """
+        The same as `util.morph(bg_mask, ks, mode='erode')` for binary masks, a min pooling where the pixels out
+        of the image are background.
+
+        Args:
+            bg_mask (torch.Tensor): (bs, 1, h, w), 1 for background and 0 for foreground.
+            ks (int): the kernel size.
+
+        Returns:
+            torch.Tensor: (bs, 1, h, w) for odd ks.
+        """
+        return 1 - F.max_pool2d(1 - bg_mask, kernel_size=ks, stride=1, padding=ks // 2)
+
+    def plan_warp(self, cam, vertices, src_f2pts=None, src_img=None, erode_ks=(), only_vis=False, rendered=None,
+                  incremental=False):
+        """
+        The fused warp planner, one call from the (bs) meshes to everything needed to warp the source(s) onto
+        them, it replaces the sequence render_fim_wim -> encode_fim -> p2verts -> cal_bc_transform ->
+        grid_sample -> morph.
+
+        Without autograd, the face index map is converted to indices once in a scratch buffer shared by
+        encode_fim and cal_bc_transform, the transform is accumulated vertex by vertex into T instead of
+        gathering the (bs, h * w, 3, 2) face points, and the scratch buffers are reused between the frames.
+        The masks are eroded by min pooling instead of a convolution.
+
+        Args:
+            cam (torch.Tensor): (bs, 3)
+            vertices (torch.Tensor): (bs, nv, 3)
+            src_f2pts (torch.Tensor or None): (1 or bs, nf, 3, 2), the projected faces of the source(s), e.g, the
+                p2verts of the source, T is not computed if it is None.
+            src_img (torch.Tensor or None): (1 or bs, 3, h, w), the source image(s) warped by T.
+            erode_ks (tuple of int): the kernel sizes of the eroded background masks.
+            only_vis (bool): set the p2verts of the invisible faces to -2, see `get_vis_f2pts`.
+            rendered (tuple or None): the (f2verts, fim, wim) of the meshes if they are already rendered.
+            incremental (bool): rasterize the meshes incrementally from the previous frame, see `set_incremental`.
+
+        Returns:
+            plan (dict):
+                'f2verts': (bs, nf, 3, 3), the projected faces;
+                'p2verts': (bs, nf, 3, 2), the projected faces in the coordinates of grid_sample;
+                'vis': (bs, nf), the visibility table of the faces, if only_vis is True;
+                'fim': (bs, h, w), -1 for background;
+                'wim': (bs, h, w, 3);
+                'cond': (bs, c, h, w), the encoded fim;
+                'T': (bs, h, w, 2), -2 for background, if src_f2pts is given;
+                'tsf_img': (bs, 3, h, w), if src_img is given;
+                'masks': the list of (bs, 1, h, w) eroded cond[:, -1:] (1 for background) of erode_ks, if it
+                    is not empty.
+        """
+        assert src_img is None or src_f2pts is not None, 'src_img is warped by T, which requires src_f2pts.'
+
+        if rendered is None:
+            rendered = self.render_fim_wim(cam, vertices, incremental=incremental)
+        f2verts, fim, wim = rendered
+        bs, h, w = fim.shape
+        num_pixels = bs * h * w
+
+        # flips the y-axis of the projected faces to the coordinates of grid_sample.
+        p2verts = f2verts[:, :, :, 0:2] * f2verts.new_tensor([1, -1])
+        plan = {'f2verts': f2verts, 'p2verts': p2verts, 'fim': fim, 'wim': wim}
+
+        if only_vis:
+            plan['vis'] = self.visible_faces(fim, p2verts.shape[1])
+            plan['p2verts'] = self.get_vis_f2pts(p2verts, fim, vis=plan['vis'])
+
+        if torch.is_grad_enabled():
+            plan['cond'], _ = self.encode_fim(cam, vertices, fim=fim, transpose=True)
+            if src_f2pts is not None:
+                plan['T'] = self.cal_bc_transform(src_f2pts, fim, wim)
+        else:
+            # the background (-1) is the last row of map_fn.
+            n_rows, nc = self.map_fn.shape
+            bg = (fim.reshape(-1) == -1)
+            ids = self._scratch_buffer('ids', num_pixels, torch.long, fim.device)
+            ids.copy_(fim.reshape(-1))
+            ids.masked_fill_(bg, n_rows - 1)
+
+            cond = torch.empty(bs, h, w, nc, dtype=self.map_fn.dtype, device=fim.device)
+            torch.index_select(self.map_fn, 0, ids, out=cond.view(-1, nc))
+            plan['cond'] = cond.permute(0, 3, 1, 2)
+
+            if src_f2pts is not None:
+                src_bs, nf = src_f2pts.shape[0:2]
+
+                # global face index in the flattened (src_bs * nf) faces, a single source is shared by all.
+                ids.masked_fill_(bg, 0)
+                if src_bs != 1:
+                    ids.view(bs, -1).add_(torch.arange(bs, device=ids.device)[:, None] * nf)
+
+                f2pts = src_f2pts.reshape(src_bs * nf, 3, 2)
+                weights = wim.reshape(num_pixels, 3)
+                taps = self._scratch_buffer('taps', num_pixels * 2, f2pts.dtype, f2pts.device).view(-1, 2)
+
+                T = torch.zeros(num_pixels, 2, dtype=f2pts.dtype, device=f2pts.device)
+                for k in range(3):
+                    torch.index_select(f2pts[:, k], 0, ids, out=taps)
+                    T.addcmul_(taps, weights[:, k:k + 1])
+                T.masked_fill_(bg[:, None], -2)
+                plan['T'] = T.view(bs, h, w, 2)
+
+        if src_img is not None:
+            plan['tsf_img'] = F.grid_sample(src_img.expand(bs, -1, -1, -1), plan['T'])
+
+        if erode_ks:
+            bg_mask = plan['cond'][:, -1:]
+            plan['masks'] = [self.erode(bg_mask, ks) for ks in erode_ks]
+
+        return plan
+
     def debug_textures(self):
         return torch.ones((self.nf, self.tex_size, self.tex_size, self.tex_size, 3), dtype=torch.float32)
@@ -0,0 +1,191 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+import torch
+from tqdm import tqdm
+
+import utils.cv_utils as cv_utils
+from utils.video import VideoReader, frame_name
+
+
+class ImitatorPipeline(object):
+    """
+    Streaming executor around `Imitator` with three overlapped stages connected by bounded queues:
+
+        1. prefetch: decode + resize the target frames on a thread pool;
+        2. compute: hmr -> render -> warping -> generator, batched on the gpu, in the caller's thread;
+        3. write: encode and save the predictions (and the ground truths) on worker threads.
+
+    The queues bound the number of batches in flight, so the memory is constant no matter how long
+    the reference video is.
+    """
+
+    def __init__(self, imitator, batch_size=1, num_readers=4, num_writers=4, queue_size=4):
+        """
+        Args:
+            imitator (models.imitator.Imitator): a personalized imitator.
+            batch_size (int): the number of target frames of a compute step.
+            num_readers (int): the number of decoding threads.
+            num_writers (int): the number of encoding threads.
+            queue_size (int): the maximum number of batches waiting between two stages.
+        """
+        self.imitator = imitator
+        self.batch_size = batch_size
+        self.num_readers = max(1, num_readers)
+        self.num_writers = max(1, num_writers)
+        self.queue_size = queue_size
+        self.image_size = imitator._opt.image_size
+
+    def _load(self, tgt_path):
+        return self._prepare(cv_utils.read_img(tgt_path))
+
+    def _prepare(self, ori_img):
+        img_hmr = cv_utils.transform_img(ori_img, cv_utils.HMR_IMG_SIZE, transpose=True) * 2 - 1.0
+        gt = cv2.resize(ori_img, (self.image_size, self.image_size))
+        return ori_img, img_hmr, gt
+
+    def _prefetch(self, tgt_paths, in_queue, stop):
+        with ThreadPoolExecutor(max_workers=self.num_readers) as pool:
+            if isinstance(tgt_paths, VideoReader):
+                # the video is decoded by the reader thread of VideoReader, only the resizing is done on the pool.
+                batches = ((t, names, [pool.submit(self._prepare, img) for img in imgs])
+                           for t, names, imgs in tgt_paths.batches(self.batch_size))
+            else:
+                batches = ((t, [frame_name(path, t + i) for i, path in enumerate(tgt_paths[t:t + self.batch_size])],
+                            [pool.submit(self._load, path) for path in tgt_paths[t:t + self.batch_size]])
+                           for t in range(0, len(tgt_paths), self.batch_size))
+
+            try:
+                for batch in batches:
+                    if stop.is_set():
+                        break
+                    # blocks when the compute stage falls behind
+                    in_queue.put(batch)
+            except Exception as e:
+                # e.g, a broken video, it is raised in the compute stage.
+                in_queue.put(e)
+            finally:
+                batches.close()
+                in_queue.put(None)
+
+    @staticmethod
+    def _write(out_queue, errors):
+        while True:
+            item = out_queue.get()
+            if item is None:
+                break
+
+            pred, gt, pred_path, gt_path = item
+            try:
+                cv_utils.save_cv2_img(pred, pred_path, normalize=True)
+                if gt_path is not None:
+                    cv_utils.save_cv2_img(gt, gt_path)
+            except Exception as e:
+                errors.append(e)
+
+    @torch.no_grad()
+    def run(self, tgt_paths, tgt_smpls=None, cam_strategy='smooth', output_dir='',
+            visualizer=None, verbose=True, save_gt=True, keep_outputs=False, video_writer=None, to_uint8=False):
+        """
+        Args:
+            tgt_paths (list of str or utils.video.VideoReader or sequence of frames): the paths of the target frames,
+                or a reference video, or the in-memory frames, see `cv_utils.read_img`.
+            tgt_smpls (np.ndarray or None): (n, 85), if it is None, they are estimated by hmr.
+            cam_strategy (str):
+            output_dir (str): the folder to save `pred_*` and `gt_*` images, nothing is saved if it is empty.
+            visualizer:
+            verbose (bool):
+            save_gt (bool): save the resized target frames or not.
+            keep_outputs (bool): return the predictions or not.
+            video_writer (utils.video.VideoWriter or None): the predictions are encoded into it in order, in the
+                compute thread.
+            to_uint8 (bool): keep the predictions as RGB uint8 frames or not.
+
+        Returns:
+            outputs (list of np.ndarray): the (h, w, 3) predictions in [-1, 1] (or in uint8 if to_uint8 is True)
+            if keep_outputs is True, otherwise an empty list.
+        """
+        in_queue = queue.Queue(maxsize=self.queue_size)
+        out_queue = queue.Queue(maxsize=self.queue_size * self.batch_size)
+        stop = threading.Event()
+        errors = []
+
+        reader = threading.Thread(target=self._prefetch, args=(tgt_paths, in_queue, stop), daemon=True)
+        writers = [threading.Thread(target=self._write, args=(out_queue, errors), daemon=True)
+                   for _ in range(self.num_writers if output_dir else 0)]
+        reader.start()
+        for writer in writers:
+            writer.start()
+
+        outputs = []
+        process_bar = tqdm(total=len(tgt_paths)) if verbose else None
+        try:
+            while True:
+                item = in_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                t, names, futures = item
+                loaded = [future.result() for future in futures]
+                ori_imgs = [x[0] for x in loaded]
+                imgs_hmr = np.stack([x[1] for x in loaded])
+                batch_smpls = tgt_smpls[t:t + len(names)] if tgt_smpls is not None else None
+
+                tsf_inputs = self.imitator.transfer_params_by_imgs(ori_imgs, batch_smpls, cam_strategy,
+                                                                   t=t, imgs_hmr=imgs_hmr)
+                if self.imitator._opt.key_pose_thresh > 0:
+                    preds = self.imitator.forward_keyframes(tsf_inputs, self.imitator.tsf_info['T'], t=t)
+                else:
+                    preds = self.imitator.forward(tsf_inputs, self.imitator.tsf_info['T'])
+
+                if visualizer is not None:
+                    visualizer.vis_named_img('pred_' + cam_strategy, preds)
+
+                preds = preds.permute(0, 2, 3, 1).cpu().numpy()
+
+                for filename, pred, (_, _, gt) in zip(names, preds, loaded):
+                    if keep_outputs:
+                        outputs.append(cv_utils.to_uint8_img(pred) if to_uint8 else pred)
+
+                    if video_writer is not None:
+                        video_writer.write(pred, normalize=True)
+
+                    if output_dir:
+                        gt_path = os.path.join(output_dir, 'gt_' + filename) if save_gt else None
+                        out_queue.put((pred, gt, os.path.join(output_dir, 'pred_' + filename), gt_path))
+
+                if process_bar is not None:
+                    process_bar.update(len(names))
+
+                if errors:
+                    raise errors[0]
+        finally:
+            stop.set()
+            # drain the prefetch queue so that the reader is never blocked on a full queue
+            while reader.is_alive():
+                try:
+                    in_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+            for _ in writers:
+                out_queue.put(None)
+            for writer in writers:
+                writer.join()
+
+            if process_bar is not None:
+                process_bar.close()
+
+        if errors:
+            raise errors[0]
+
+        if self.imitator._opt.key_pose_thresh > 0 and verbose:
+            print('keyframe ratio: {:.3f} ({} / {})'.format(self.imitator.keyframe_ratio,
+                                                            *self.imitator.keyframe_counts))
+
+        return outputs
@@ -0,0 +1,155 @@
+import copy
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def get_submodule(root, name):
+    """
+    Args:
+        root: a model or a nn.Module.
+        name (str): the dotted name of the submodule, e.g, `generator.tsf_model.resnets.0`.
+
+    Returns:
+        nn.Module
+    """
+    module = root
+    for attr in name.split('.'):
+        module = getattr(module, attr)
+    return module
+
+
+def set_submodule(root, name, module):
+    parent_name, _, attr = name.rpartition('.')
+    parent = get_submodule(root, parent_name) if parent_name else root
+    setattr(parent, attr, module)
+
+
+def check_quantization():
+    """
+    The FX graph mode quantization (torch.ao.quantization) requires torch >= 1.13.
+
+    Raises:
+        RuntimeError: if it is not available in the installed torch.
+    """
+    try:
+        from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    except ImportError:
+        raise RuntimeError('the int8 quantization requires torch >= 1.13 (torch.ao.quantization), but torch {} is '
+                           'installed, please upgrade torch or run without --quantize.'.format(torch.__version__))
+
+
+class Int8Quantizer(object):
+    """
+    Post-training INT8 quantization of the submodules of a model for cpu inference.
+
+    The conv stacks (`static_names`) are quantized with the FX graph mode of torch, their weights are int8 and
+    the scales of their activations are calibrated on representative inputs, because torch has no dynamic
+    quantized kernels of convolutions. The linear layers of `dynamic_names` are dynamically quantized. Every
+    quantized submodule takes and returns fp32 tensors, so the callers are unchanged.
+    """
+
+    def __init__(self, root, static_names, dynamic_names=()):
+        """
+        Args:
+            root: the model owning the submodules.
+            static_names (list of str): the conv stacks to quantize statically.
+            dynamic_names (list of str): the modules whose nn.Linear layers are quantized dynamically.
+        """
+        self.root = root
+        self.static_names = list(static_names)
+        self.dynamic_names = list(dynamic_names)
+        self.fp32_modules = dict()
+
+    def _record_inputs(self, calibrate):
+        example_inputs = dict()
+        hooks = []
+        for name in self.static_names:
+            def hook(module, args, name=name):
+                if name not in example_inputs:
+                    example_inputs[name] = tuple(arg.detach() for arg in args)
+
+            hooks.append(get_submodule(self.root, name).register_forward_pre_hook(hook))
+
+        try:
+            calibrate()
+        finally:
+            for hook in hooks:
+                hook.remove()
+
+        return example_inputs
+
+    @torch.no_grad()
+    def quantize(self, calibrate):
+        """
+        Args:
+            calibrate (callable): runs the model on representative inputs, it is called twice, the first run
+                records the example inputs of the submodules and the second one calibrates their observers.
+                The submodules which are not run by it are left in fp32.
+        """
+        check_quantization()
+
+        from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        names = self.static_names + self.dynamic_names
+        self.fp32_modules = {name: get_submodule(self.root, name) for name in names}
+
+        # 1. prepare, insert the observers
+        example_inputs = self._record_inputs(calibrate)
+        qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+
+        prepared = dict()
+        for name in self.static_names:
+            if name not in example_inputs:
+                continue
+            module = copy.deepcopy(self.fp32_modules[name]).eval()
+            prepared[name] = prepare_fx(module, qconfig_mapping, example_inputs[name])
+            set_submodule(self.root, name, prepared[name])
+
+        # 2. calibrate
+        calibrate()
+
+        # 3. convert
+        for name, module in prepared.items():
+            set_submodule(self.root, name, convert_fx(module))
+
+        for name in self.dynamic_names:
+            module = copy.deepcopy(self.fp32_modules[name]).eval()
+            set_submodule(self.root, name, quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8))
+
+    def restore(self):
+        """
+        Puts the fp32 submodules back.
+        """
+        for name, module in self.fp32_modules.items():
+            set_submodule(self.root, name, module)
+        self.fp32_modules = dict()
+
+
+def measure_drift(ref_outputs, outputs):
+    """
+    Measures the drift of the outputs against the reference (fp32) outputs with the SSIM and PSNR metrics
+    of his_evaluators.
+
+    Args:
+        ref_outputs (list of np.ndarray): (h, w, 3) in [-1, 1].
+        outputs (list of np.ndarray): (h, w, 3) in [-1, 1].
+
+    Returns:
+        psnr (float), ssim (float): the mean scores, higher is better.
+    """
+    from his_evaluators.metrics import SSIMMetric, PSNRMetric
+
+    def to_metric_inputs(images):
+        # the metrics take (3, h, w) in [0, 1]
+        return [np.clip((np.transpose(image, (2, 0, 1)) + 1) / 2, 0, 1).astype(np.float32) for image in images]
+
+    ref_outputs = to_metric_inputs(ref_outputs)
+    outputs = to_metric_inputs(outputs)
+
+    psnr = PSNRMetric().calculate_score(outputs, ref_outputs)
+    ssim = SSIMMetric().calculate_score(outputs, ref_outputs)
+
+    return float(psnr), float(ssim)
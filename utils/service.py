@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import socket
+import threading
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import numpy as np
+import torch
+
+import utils.cv_utils as cv_utils
+
+
+class ImitationJob(object):
+    """
+    A motion imitation request, its frames are consumed batch by batch by the ImitationService worker.
+    """
+
+    def __init__(self, src_path, tgt_paths, src_smpl=None, tgt_smpls=None, cam_strategy='smooth', output_dir=''):
+        self.src_path = src_path
+        self.src_smpl = src_smpl
+        self.tgt_paths = tgt_paths
+        self.tgt_smpls = tgt_smpls
+        self.cam_strategy = cam_strategy
+        self.output_dir = output_dir
+
+        self.src_info = None
+        self.first_cam = None
+        self.next = 0
+        self.ready_time = time.time()
+
+        self.outputs = []
+        self.error = None
+        self.done = threading.Event()
+
+    @property
+    def remaining(self):
+        return len(self.tgt_paths) - self.next
+
+
+class ImitationService(object):
+    """
+    Keeps a personalized-on-demand `Imitator` resident and runs the imitation jobs of concurrent requests.
+
+    A single worker thread owns the imitator. It coalesces the pending frames of all jobs into shared batches of
+    at most `max_batch` frames, and it waits at most `max_latency` seconds after the oldest pending frame became
+    ready for other frames to fill the batch.
+    """
+
+    def __init__(self, imitator, max_batch=8, max_latency=0.05, max_sources=8):
+        """
+        Args:
+            imitator (models.imitator.Imitator):
+            max_batch (int): the maximum number of frames of a generator batch.
+            max_latency (float): the maximum waiting time (seconds) to fill a batch.
+            max_sources (int): the number of personalized sources kept in memory.
+        """
+        self.imitator = imitator
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_sources = max_sources
+
+        self.sources = OrderedDict()
+        self.jobs = []
+        self.cond = threading.Condition()
+        self.running = False
+        self.worker = None
+
+    def start(self):
+        self.running = True
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.worker.join()
+
+    def submit(self, job):
+        with self.cond:
+            job.ready_time = time.time()
+            self.jobs.append(job)
+            self.cond.notify_all()
+        return job
+
+    def num_pending(self):
+        with self.cond:
+            return sum(job.remaining for job in self.jobs)
+
+    def _source(self, job):
+        key = (job.src_path, None if job.src_smpl is None else np.asarray(job.src_smpl, np.float32).tobytes())
+        if key not in self.sources:
+            self.sources[key] = self.imitator._cached_personalize(job.src_path, job.src_smpl)
+            while len(self.sources) > self.max_sources:
+                self.sources.popitem(last=False)
+        self.sources.move_to_end(key)
+        return self.sources[key]
+
+    def _collect(self):
+        """
+        Waits for a batch of frames, returns a list of (job, start, end).
+        """
+        with self.cond:
+            while self.running and not self.jobs:
+                self.cond.wait()
+
+            while self.running:
+                pending = sum(job.remaining for job in self.jobs)
+                deadline = min(job.ready_time for job in self.jobs) + self.max_latency
+                now = time.time()
+                if pending >= self.max_batch or now >= deadline:
+                    break
+                self.cond.wait(deadline - now)
+
+            if not self.running:
+                return []
+
+            batch = []
+            slots = self.max_batch
+            for job in self.jobs:
+                if slots == 0:
+                    break
+                num = min(slots, job.remaining)
+                batch.append((job, job.next, job.next + num))
+                job.next += num
+                job.ready_time = time.time()
+                slots -= num
+
+            self.jobs = [job for job in self.jobs if job.remaining > 0]
+
+        return batch
+
+    @torch.no_grad()
+    def _compute(self, batch):
+        imitator = self.imitator
+
+        tsf_inputs, Ts, fims, tsf_imgs, enc_outs, res_outs, bgs = [], [], [], [], [], [], []
+        for job, start, end in batch:
+            num = end - start
+            if job.src_info is None:
+                job.src_info = self._source(job)
+
+            imitator.src_info = job.src_info
+            imitator.first_cam = job.first_cam
+            tgt_smpls = job.tgt_smpls[start:end] if job.tgt_smpls is not None else None
+            tsf_inputs.append(imitator.transfer_params_batch(job.tgt_paths[start:end], tgt_smpls,
+                                                             job.cam_strategy, t=start))
+            job.first_cam = imitator.first_cam
+
+            Ts.append(imitator.tsf_info['T'])
+            fims.append(imitator.tsf_info['fim'])
+            tsf_imgs.append(imitator.tsf_info['tsf_img'])
+
+            src_encoder_outs, src_resnet_outs = job.src_info['feats']
+            enc_outs.append([x.expand(num, -1, -1, -1) for x in src_encoder_outs])
+            res_outs.append([x.expand(num, -1, -1, -1) for x in src_resnet_outs])
+            bgs.append(job.src_info['bg'].expand(num, -1, -1, -1))
+
+        # one generator batch shared by all the jobs
+        src_feats = ([torch.cat(xs, dim=0) for xs in zip(*enc_outs)],
+                     [torch.cat(xs, dim=0) for xs in zip(*res_outs)])
+        imitator.tsf_info = {'fim': torch.cat(fims, dim=0), 'tsf_img': torch.cat(tsf_imgs, dim=0)}
+        preds = imitator.forward(torch.cat(tsf_inputs, dim=0), torch.cat(Ts, dim=0),
+                                 src_feats=src_feats, bg_img=torch.cat(bgs, dim=0))
+        preds = preds.permute(0, 2, 3, 1).cpu().numpy()
+
+        i = 0
+        for job, start, end in batch:
+            for t in range(start, end):
+                if job.output_dir:
+                    filename = os.path.split(job.tgt_paths[t])[-1]
+                    out_path = os.path.join(job.output_dir, 'pred_' + filename)
+                    cv_utils.save_cv2_img(preds[i], out_path, normalize=True)
+                    job.outputs.append(out_path)
+                i += 1
+
+            if job.remaining == 0:
+                job.done.set()
+
+    def _run(self):
+        while self.running:
+            batch = self._collect()
+            if not batch:
+                continue
+
+            try:
+                self._compute(batch)
+            except Exception as e:
+                traceback.print_exc()
+                with self.cond:
+                    failed = set(job for job, _, _ in batch)
+                    self.jobs = [job for job in self.jobs if job not in failed]
+                for job in failed:
+                    job.error = '{}: {}'.format(type(e).__name__, e)
+                    job.done.set()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP:
+        GET  /health  -> {"status": "ok", "pending": int}
+        POST /imitate {"src_path", "tgt_paths", "src_smpl", "tgt_smpls", "cam_strategy", "output_dir"}
+                      -> {"outputs": [paths of the predictions], "num_frames": int, "time": float}
+    """
+
+    service = None
+
+    def address_string(self):
+        # the client address of a unix socket is not a (host, port) tuple.
+        return str(self.client_address[0]) if isinstance(self.client_address, tuple) else 'unix'
+
+    def _reply(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok', 'pending': self.service.num_pending()})
+        else:
+            self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/imitate':
+            self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            job = ImitationJob(src_path=request['src_path'],
+                               tgt_paths=list(request['tgt_paths']),
+                               src_smpl=request.get('src_smpl', None),
+                               tgt_smpls=request.get('tgt_smpls', None),
+                               cam_strategy=request.get('cam_strategy', 'smooth'),
+                               output_dir=request.get('output_dir', ''))
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {'error': 'bad request: {}'.format(e)})
+            return
+
+        if job.output_dir and not os.path.exists(job.output_dir):
+            os.makedirs(job.output_dir)
+
+        start = time.time()
+        if job.remaining > 0:
+            self.service.submit(job).done.wait()
+
+        if job.error is not None:
+            self._reply(500, {'error': job.error})
+        else:
+            self._reply(200, {'outputs': job.outputs, 'num_frames': len(job.tgt_paths),
+                              'time': time.time() - start})
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(service, host='127.0.0.1', port=8800, unix_socket=''):
+    """
+    Args:
+        service (ImitationService):
+        host (str):
+        port (int):
+        unix_socket (str): if it is not empty, listen on this unix socket instead of (host, port).
+
+    Returns:
+        socketserver.BaseServer: call its serve_forever() to run the service.
+    """
+    handler = type('ImitationRequestHandler', (ServiceRequestHandler,), {'service': service})
+
+    if unix_socket:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('unix sockets are not supported on this platform.')
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    else:
+        return ThreadingHTTPServer((host, port), handler)
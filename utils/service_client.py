@@ -0,0 +1,97 @@
+import json
+import glob
+import os
+import socket
+import argparse
+import http.client
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, unix_socket, timeout=None):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+
+class ServiceClient(object):
+    """
+    Minimal client of the imitation service (see run_service.py), it only depends on the standard library.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8800, unix_socket='', timeout=None):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+
+    def _request(self, method, path, data=None):
+        if self.unix_socket:
+            conn = UnixHTTPConnection(self.unix_socket, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        try:
+            body = json.dumps(data) if data is not None else None
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            result = json.loads(response.read().decode('utf-8'))
+        finally:
+            conn.close()
+
+        if response.status != 200:
+            raise RuntimeError('{} {} failed ({}): {}'.format(method, path, response.status, result.get('error')))
+
+        return result
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def imitate(self, src_path, tgt_paths, output_dir='', src_smpl=None, tgt_smpls=None, cam_strategy='smooth'):
+        """
+        Args:
+            src_path (str): the path of the source image, visible to the service.
+            tgt_paths (list of str): the paths of the reference frames, visible to the service.
+            output_dir (str): the folder where the service saves the predictions.
+            src_smpl (list or None): (85,)
+            tgt_smpls (list or None): (n, 85)
+            cam_strategy (str):
+
+        Returns:
+            dict: {'outputs': [paths of the predictions], 'num_frames': int, 'time': float}
+        """
+        data = {
+            'src_path': os.path.abspath(src_path),
+            'tgt_paths': [os.path.abspath(path) for path in tgt_paths],
+            'output_dir': os.path.abspath(output_dir) if output_dir else '',
+            'src_smpl': src_smpl,
+            'tgt_smpls': tgt_smpls,
+            'cam_strategy': cam_strategy
+        }
+        return self._request('POST', '/imitate', data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--unix_socket', type=str, default='')
+    parser.add_argument('--src_path', type=str, required=True)
+    parser.add_argument('--tgt_path', type=str, required=True, help='a reference image or a folder of frames.')
+    parser.add_argument('--output_dir', type=str, default='')
+    parser.add_argument('--cam_strategy', type=str, default='smooth')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.tgt_path):
+        tgt_paths = sorted(glob.glob(os.path.join(args.tgt_path, '*')))
+    else:
+        tgt_paths = [args.tgt_path]
+
+    client = ServiceClient(args.host, args.port, args.unix_socket)
+    print(client.health())
+    result = client.imitate(args.src_path, tgt_paths, args.output_dir, cam_strategy=args.cam_strategy)
+    print('{} frames in {:.3f}s'.format(result['num_frames'], result['time']))
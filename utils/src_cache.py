@@ -0,0 +1,212 @@
+import os
+import shutil
+import hashlib
+import pickle
+import numpy as np
+import torch
+
+
+# the options that change the personalized source information.
+FINGERPRINT_OPTS = ['image_size', 'tex_size', 'map_name', 'uv_mapping', 'part_info', 'smpl_model', 'hmr_model',
+                    'gen_name', 'load_path', 'load_epoch', 'checkpoints_dir', 'name', 'repeat_num', 'cond_nc',
+                    'bg_model', 'bg_ks', 'ft_ks', 'only_vis', 'has_detector', 'front_warp', 'rasterizer']
+
+# the options pointing to checkpoints, their size and modification time are part of the fingerprint.
+FINGERPRINT_FILES = ['smpl_model', 'hmr_model', 'load_path', 'bg_model']
+
+
+def _file_stamp(path):
+    if path and os.path.isfile(path):
+        stat = os.stat(path)
+        return path, stat.st_size, int(stat.st_mtime)
+    return path
+
+
+def _flatten(value, arrays):
+    """
+    Splits a nested structure of tensors / arrays into a picklable skeleton and a list of arrays.
+    """
+    if torch.is_tensor(value):
+        arrays.append(value.detach().cpu().numpy())
+        return 'tensor', len(arrays) - 1
+    elif isinstance(value, np.ndarray):
+        arrays.append(value)
+        return 'ndarray', len(arrays) - 1
+    elif isinstance(value, dict):
+        return 'dict', {k: _flatten(v, arrays) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return type(value).__name__, [_flatten(v, arrays) for v in value]
+    else:
+        return 'object', value
+
+
+def _unflatten(skeleton, load_array, device):
+    kind, value = skeleton
+    if kind == 'tensor':
+        return torch.from_numpy(load_array(value)).to(device)
+    elif kind == 'ndarray':
+        return np.array(load_array(value))
+    elif kind == 'dict':
+        return {k: _unflatten(v, load_array, device) for k, v in value.items()}
+    elif kind == 'list':
+        return [_unflatten(v, load_array, device) for v in value]
+    elif kind == 'tuple':
+        return tuple(_unflatten(v, load_array, device) for v in value)
+    else:
+        return value
+
+
+class SourceCache(object):
+    """
+    On-disk cache of the personalized source information (src_info), keyed by the content of the source image
+    and a fingerprint of the checkpoints and options. Every entry is a folder with a `meta.pkl` skeleton and one
+    `.npy` file per tensor, which are loaded with memory mapping. The least recently used entries are evicted
+    when the total size exceeds `max_size` GB.
+    """
+
+    META_NAME = 'meta.pkl'
+
+    def __init__(self, cache_dir, max_size=10.0):
+        """
+        Args:
+            cache_dir (str): the folder of the cache.
+            max_size (float): the maximum total size of the cache in GB.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size * (1 << 30))
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def fingerprint(opt, model_name=''):
+        """
+        Args:
+            opt: the options of the model.
+            model_name (str): the name of the model, e.g, `Imitator`.
+
+        Returns:
+            str: the fingerprint of the model name, checkpoints and options.
+        """
+        items = [model_name]
+        for name in FINGERPRINT_OPTS:
+            value = getattr(opt, name, None)
+            if name in FINGERPRINT_FILES:
+                value = _file_stamp(value)
+            items.append((name, value))
+
+        return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+    def key(self, src_path, opt, model_name='', src_smpl=None):
+        """
+        Args:
+            src_path (str or np.ndarray or torch.Tensor): the path of the source image, or the in-memory frame
+                (see `cv_utils.read_img`) whose pixels are hashed.
+            opt: the options of the model.
+            model_name (str): the name of the model.
+            src_smpl (np.ndarray or None): (85,) the given smpl of the source image.
+
+        Returns:
+            str: the key of the entry.
+        """
+        sha = hashlib.sha1()
+        if isinstance(src_path, str):
+            with open(src_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+        else:
+            image = src_path.detach().cpu().numpy() if torch.is_tensor(src_path) else np.asarray(src_path)
+            sha.update(repr((image.shape, image.dtype.str)).encode('utf-8'))
+            sha.update(np.ascontiguousarray(image).data)
+
+        sha.update(self.fingerprint(opt, model_name).encode('utf-8'))
+
+        if src_smpl is not None:
+            sha.update(np.asarray(src_smpl, dtype=np.float32).tobytes())
+
+        return sha.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key, device='cuda'):
+        """
+        Args:
+            key (str): the key of the entry.
+            device (str or torch.device): the device of the loaded tensors.
+
+        Returns:
+            dict or None: the src_info, None if it is not in the cache.
+        """
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, self.META_NAME)
+        if not os.path.isfile(meta_path):
+            return None
+
+        try:
+            with open(meta_path, 'rb') as f:
+                skeleton = pickle.load(f)
+
+            def load_array(i):
+                # copy-on-write mapping, the pages are only read when they are copied to the device.
+                return np.load(os.path.join(entry_dir, '%d.npy' % i), mmap_mode='c')
+
+            src_info = _unflatten(skeleton, load_array, device)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            # broken entry, e.g, interrupted by an eviction of another process.
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        # mark as recently used
+        os.utime(meta_path, None)
+
+        return src_info
+
+    def save(self, key, src_info):
+        """
+        Args:
+            key (str): the key of the entry.
+            src_info (dict): the src_info to save.
+        """
+        entry_dir = self._entry_dir(key)
+        tmp_dir = '%s.tmp.%d' % (entry_dir, os.getpid())
+
+        arrays = []
+        skeleton = _flatten(src_info, arrays)
+
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for i, array in enumerate(arrays):
+            np.save(os.path.join(tmp_dir, '%d.npy' % i), np.ascontiguousarray(array))
+
+        # the meta file is written last, an entry without it is never loaded.
+        with open(os.path.join(tmp_dir, self.META_NAME), 'wb') as f:
+            pickle.dump(skeleton, f, protocol=2)
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.rename(tmp_dir, entry_dir)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the total size is not larger than max_size.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry_dir, self.META_NAME)
+            if not os.path.isfile(meta_path):
+                continue
+
+            size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(meta_path), size, entry_dir))
+            total += size
+
+        entries.sort()
+        for _, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
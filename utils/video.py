@@ -7,11 +7,16 @@ import os
 import glob
 import cv2
 import shutil
+import queue
+import threading
+import subprocess
 from multiprocessing import Pool
 from functools import partial
 from tqdm import tqdm
 import numpy as np
 
+import utils.cv_utils as cv_utils
+
 
 def auto_unzip_fun(x, f):
     return f(*x)
@@ -22,33 +27,381 @@ def render_and_save(pose_visualizer, bg_img, smpl_pose, smpl_cam, save_path):
     cv2.imwrite(save_path, render_img)
 
 
+class VideoWriter(object):
+    """
+    Streaming video sink, the frames are encoded as soon as they are written, without any intermediate image or
+    video file. The `ffmpeg` backend pipes the raw frames to a single ffmpeg (libx264) process, and the `cv2`
+    backend falls back to cv2.VideoWriter (mp4v) when ffmpeg is not available.
+    """
+
+    BACKENDS = ('auto', 'ffmpeg', 'cv2')
+
+    def __init__(self, output_mp4_path, fps=24, rgb=True, backend='auto', crf=18):
+        """
+        Args:
+            output_mp4_path (str): the path of the output video.
+            fps (int or float):
+            rgb (bool): the channel order of the written frames is RGB or BGR.
+            backend (str): `auto`, `ffmpeg` or `cv2`.
+            crf (int): the quality of the ffmpeg libx264 encoder, lower is better.
+        """
+        assert backend in self.BACKENDS, 'backend must be one of {}, but got {}'.format(self.BACKENDS, backend)
+
+        if backend == 'auto':
+            backend = 'ffmpeg' if shutil.which('ffmpeg') else 'cv2'
+
+        self.output_mp4_path = output_mp4_path
+        self.fps = fps
+        self.rgb = rgb
+        self.backend = backend
+        self.crf = crf
+
+        self.size = None
+        self.num_frames = 0
+        self._proc = None
+        self._writer = None
+
+    def _open(self, w, h):
+        self.size = (w, h)
+
+        if self.backend == 'ffmpeg':
+            cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24' if self.rgb else 'bgr24',
+                   '-s', '%dx%d' % (w, h), '-r', str(self.fps), '-i', '-',
+                   # libx264 with yuv420p requires even sizes.
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                   '-vcodec', 'libx264', '-crf', str(self.crf), '-pix_fmt', 'yuv420p',
+                   self.output_mp4_path]
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            self._writer = cv2.VideoWriter(self.output_mp4_path, fourcc, self.fps, (w, h))
+
+    def write(self, frame, normalize=False):
+        """
+        Args:
+            frame (np.ndarray): (h, w, 3), uint8 in [0, 255], or float in [-1, 1] if normalize is True.
+            normalize (bool): map the frame from [-1, 1] to [0, 255].
+        """
+        if normalize:
+            frame = np.clip((frame + 1) / 2.0 * 255, 0, 255)
+
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        h, w = frame.shape[:2]
+
+        if self.size is None:
+            self._open(w, h)
+        elif self.size != (w, h):
+            frame = cv2.resize(frame, self.size)
+
+        if self._proc is not None:
+            try:
+                self._proc.stdin.write(frame.tobytes())
+            except BrokenPipeError:
+                raise RuntimeError('ffmpeg exited while writing {}'.format(self.output_mp4_path))
+        else:
+            self._writer.write(frame if not self.rgb else frame[:, :, ::-1].copy())
+
+        self.num_frames += 1
+
+    def close(self):
+        if self._proc is not None:
+            self._proc.stdin.close()
+            code = self._proc.wait()
+            self._proc = None
+            if code != 0:
+                raise RuntimeError('ffmpeg failed ({}) to encode {}'.format(code, self.output_mp4_path))
+
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+
+def is_video_file(path):
+    return os.path.isfile(path) and os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def probe_video(video_path):
+    """
+    Args:
+        video_path (str):
+
+    Returns:
+        w (int), h (int), num_frames (int), fps (float): num_frames is read from the container, it might be
+        an estimation for some codecs.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError('can not open the video {}'.format(video_path))
+
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    return w, h, num_frames, fps
+
+
+def read_video_frame(video_path, t, max_size=0):
+    """
+    Random access to a single frame, it seeks to the t-th frame and decodes it.
+
+    Args:
+        video_path (str):
+        t (int): the index of the frame.
+        max_size (int): if it is larger than 0, the frame is resized so that its longer side is max_size.
+
+    Returns:
+        img (np.ndarray): (h, w, 3), RGB, uint8.
+    """
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, t)
+    ret, img = cap.read()
+    cap.release()
+
+    if not ret:
+        raise IOError('can not read the frame {} of {}'.format(t, video_path))
+
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    if max_size > 0 and max(img.shape[:2]) > max_size:
+        h, w = img.shape[:2]
+        scale = max_size / max(h, w)
+        img = cv2.resize(img, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_AREA)
+
+    return img
+
+
+class VideoReader(object):
+    """
+    Streaming video source, used in place of a list of extracted frames. The frames are decoded lazily by a
+    background thread into a bounded buffer, so the memory is constant no matter how long the video is.
+    The `ffmpeg` backend decodes (and down-scales) in a single ffmpeg process, and the `cv2` backend falls back
+    to cv2.VideoCapture when ffmpeg is not available.
+
+    The frames are named `frame%08d.png` after their index in the video, the same names as the frames
+    extracted by `tools/unzip_iPER.py`.
+    """
+
+    BACKENDS = ('auto', 'ffmpeg', 'cv2')
+
+    def __init__(self, video_path, itv=1, max_size=0, buffer_size=32, backend='auto'):
+        """
+        Args:
+            video_path (str): the path of the video.
+            itv (int): only every itv-th frame is read.
+            max_size (int): if it is larger than 0, the frames are decoded at a reduced resolution
+                so that their longer side is at most max_size.
+            buffer_size (int): the maximum number of decoded frames waiting to be consumed.
+            backend (str): `auto`, `ffmpeg` or `cv2`.
+        """
+        assert backend in self.BACKENDS, 'backend must be one of {}, but got {}'.format(self.BACKENDS, backend)
+
+        if backend == 'auto':
+            backend = 'ffmpeg' if shutil.which('ffmpeg') else 'cv2'
+
+        self.video_path = video_path
+        self.itv = max(1, itv)
+        self.buffer_size = buffer_size
+        self.backend = backend
+
+        w, h, num_frames, fps = probe_video(video_path)
+        self.src_size = (w, h)
+        self.num_frames = num_frames
+        self.fps = fps
+
+        if 0 < max_size < max(w, h):
+            scale = max_size / max(w, h)
+            self.size = (int(round(w * scale)), int(round(h * scale)))
+        else:
+            self.size = (w, h)
+
+    def __len__(self):
+        return (self.num_frames + self.itv - 1) // self.itv
+
+    def frame_name(self, i):
+        return 'frame%08d.png' % (i * self.itv)
+
+    def _decode_ffmpeg(self, buffer, stop):
+        w, h = self.size
+        filters = ['scale=%d:%d' % (w, h)]
+        if self.itv > 1:
+            filters.insert(0, 'select=not(mod(n\\,%d))' % self.itv)
+
+        cmd = ['ffmpeg', '-loglevel', 'error', '-i', self.video_path,
+               '-vf', ','.join(filters), '-vsync', '0',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=w * h * 3)
+
+        try:
+            frame_bytes = w * h * 3
+            while not stop.is_set():
+                data = proc.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                buffer.put(np.frombuffer(data, dtype=np.uint8).reshape(h, w, 3))
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def _decode_cv2(self, buffer, stop):
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            t = 0
+            while not stop.is_set():
+                # the skipped frames are only grabbed, without being converted.
+                if t % self.itv != 0:
+                    if not cap.grab():
+                        break
+                    t += 1
+                    continue
+
+                ret, img = cap.read()
+                if not ret:
+                    break
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                if self.size != self.src_size:
+                    img = cv2.resize(img, self.size, interpolation=cv2.INTER_AREA)
+                buffer.put(img)
+                t += 1
+        finally:
+            cap.release()
+
+    def _decode(self, buffer, stop):
+        try:
+            if self.backend == 'ffmpeg':
+                self._decode_ffmpeg(buffer, stop)
+            else:
+                self._decode_cv2(buffer, stop)
+        except Exception as e:
+            buffer.put(e)
+        finally:
+            buffer.put(None)
+
+    def __iter__(self):
+        """
+        Yields:
+            img (np.ndarray): (h, w, 3), RGB, uint8.
+        """
+        buffer = queue.Queue(maxsize=self.buffer_size)
+        stop = threading.Event()
+        decoder = threading.Thread(target=self._decode, args=(buffer, stop), daemon=True)
+        decoder.start()
+
+        try:
+            while True:
+                item = buffer.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # drain the buffer so that the decoder is never blocked on a full buffer
+            while decoder.is_alive():
+                try:
+                    buffer.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def batches(self, batch_size):
+        """
+        Yields:
+            t (int): the index of the first frame of the batch.
+            names (list of str): the names of the frames.
+            imgs (list of np.ndarray): the decoded frames, (h, w, 3), RGB, uint8.
+        """
+        t, imgs = 0, []
+        for img in self:
+            imgs.append(img)
+            if len(imgs) == batch_size:
+                yield t, [self.frame_name(i) for i in range(t, t + len(imgs))], imgs
+                t, imgs = t + len(imgs), []
+
+        if imgs:
+            yield t, [self.frame_name(i) for i in range(t, t + len(imgs))], imgs
+
+    def save_frames(self, save_dir):
+        """
+        Saves the frames, for the callers that need the frames on disk (e.g, the pairs of meta imitation).
+
+        Returns:
+            paths (list of str): the paths of the saved frames.
+        """
+        paths = []
+        for i, img in enumerate(self):
+            path = os.path.join(save_dir, self.frame_name(i))
+            cv2.imwrite(path, cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+            paths.append(path)
+        return paths
+
+
+def frame_name(tgt_path, t):
+    """
+    Args:
+        tgt_path (str or np.ndarray or torch.Tensor): the path of the t-th frame, or the frame itself.
+        t (int): the index of the frame.
+
+    Returns:
+        str: the file name of the frame, `%.8d.jpg` for the in-memory frames.
+    """
+    if isinstance(tgt_path, str):
+        return os.path.split(tgt_path)[-1]
+    return '%.8d.jpg' % t
+
+
+def read_frame_batches(tgt_paths, batch_size):
+    """
+    Args:
+        tgt_paths (list of str or VideoReader or sequence of frames): the paths of the frames, or a video, or
+            the in-memory frames (see `cv_utils.read_img`), e.g, a (n, h, w, 3) uint8 array.
+        batch_size (int):
+
+    Yields:
+        t (int): the index of the first frame of the batch.
+        names (list of str): the file names of the frames.
+        imgs (list of np.ndarray): the decoded frames, (h, w, 3), RGB, uint8.
+    """
+    if isinstance(tgt_paths, VideoReader):
+        for batch in tgt_paths.batches(batch_size):
+            yield batch
+    else:
+        for t in range(0, len(tgt_paths), batch_size):
+            batch_paths = tgt_paths[t:t + batch_size]
+            imgs = [cv_utils.read_img(path) for path in batch_paths]
+            yield t, [frame_name(path, t + i) for i, path in enumerate(batch_paths)], imgs
+
+
 def make_video(output_mp4_path, img_path_list, save_frames_dir=None, fps=24):
     """
     output_path is the final mp4 name
     img_dir is where the images to make into video are saved.
-    """
 
-    first_img = cv2.imread(img_path_list[0])
-    h, w = first_img.shape[:2]
+    The frames are piped to the encoder while they are read, use `VideoWriter` directly to encode the outputs
+    of the models without saving the frames.
+    """
 
     pool_size = 40
-    tmp_avi_video_path = '%s.avi' % output_mp4_path
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-
-    videoWriter = cv2.VideoWriter(tmp_avi_video_path, fourcc, fps, (w, h))
     args_list = [(img_path,) for img_path in img_path_list]
-    with Pool(pool_size) as p:
+    with VideoWriter(output_mp4_path, fps=fps, rgb=False) as writer, Pool(pool_size) as p:
         for img in tqdm(p.imap(partial(auto_unzip_fun, f=cv2.imread), args_list), total=len(args_list)):
-            videoWriter.write(img)
-    videoWriter.release()
+            writer.write(img)
 
     if save_frames_dir:
         for i, img_path in enumerate(img_path_list):
             shutil.copy(img_path, '%s/%.8d.jpg' % (save_frames_dir, i))
 
-    os.system("ffmpeg -y -i %s -vcodec h264 %s > /dev/null 2>&1" % (tmp_avi_video_path, output_mp4_path))
-    os.system("rm %s" % (tmp_avi_video_path))
-
 
 def fuse_image(img_path_list, row_num, col_num):
     assert len(img_path_list) == row_num * col_num
@@ -69,9 +422,6 @@ def fuse_video(video_frames_path_list, output_mp4_path, row_num, col_num, fps=24
     assert len(video_frames_path_list) == row_num * col_num
 
     frame_num = len(video_frames_path_list[0])
-    first_img = cv2.imread(video_frames_path_list[0][0])
-    h, w = first_img.shape[:2]
-    fused_h, fused_w = h * row_num, w * col_num
 
     args_list = []
     for frame_idx in range(frame_num):
@@ -79,18 +429,6 @@ def fuse_video(video_frames_path_list, output_mp4_path, row_num, col_num, fps=24
         args_list.append((fused_frame_path_list, row_num, col_num))
 
     pool_size = 40
-    tmp_avi_video_path = '%s.avi' % output_mp4_path
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-
-    # for args in args_list:
-    #     fuse_image(*args)
-    # exit()
-
-    videoWriter = cv2.VideoWriter(tmp_avi_video_path, fourcc, fps, (fused_w, fused_h))
-    with Pool(pool_size) as p:
+    with VideoWriter(output_mp4_path, fps=fps, rgb=False) as writer, Pool(pool_size) as p:
         for img in tqdm(p.imap(partial(auto_unzip_fun, f=fuse_image), args_list), total=len(args_list)):
-            videoWriter.write(img)
-    videoWriter.release()
-
-    os.system("ffmpeg -y -i %s -vcodec h264 %s > /dev/null 2>&1" % (tmp_avi_video_path, output_mp4_path))
-    os.system("rm %s" % (tmp_avi_video_path))
+            writer.write(img)